@@ -0,0 +1,177 @@
+"""
+离线批处理任务（OpenAI Batch API）
+
+适合大批量、对时效不敏感的任务：请求写成JSONL上传，服务端异步处理，
+不占用在线接口的速率限制。流程：
+1. submit_batch：把提示逐行写入JSONL文件（不会一次性载入内存）并上传、创建任务
+2. poll_batch：轮询任务状态直到结束
+3. collect_batch：逐行流式读取结果，按custom_id产出回复
+
+运行本文件会启动本地模拟服务（mock_server.py）演示完整流程，无需API密钥
+"""
+
+from dotenv import load_dotenv
+import json
+import os
+import tempfile
+import time
+
+load_dotenv()
+
+# 批处理任务的终止状态
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def _iter_requests(prompts, model, temperature, endpoint):
+    """把提示转换为Batch格式的请求行
+
+    prompts中的元素可以是字符串（自动生成custom_id），也可以是(custom_id, 提示)元组
+    """
+    for index, item in enumerate(prompts):
+        if isinstance(item, tuple):
+            custom_id, prompt = item
+        else:
+            custom_id, prompt = f"request-{index}", item
+        yield {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": endpoint,
+            "body": {
+                "model": model,
+                "temperature": temperature,
+                "messages": [{"role": "user", "content": prompt}],
+            },
+        }
+
+def write_batch_file(prompts, path, model=None, temperature=0.7,
+                     endpoint="/v1/chat/completions"):
+    """把提示逐行写入Batch格式的JSONL文件
+
+    prompts可以是任意可迭代对象（包括生成器），写入过程不会把全部请求放进内存
+
+    Returns:
+        写入的请求数
+    """
+    model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for request in _iter_requests(prompts, model, temperature, endpoint):
+            f.write(json.dumps(request, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+def submit_batch(client, prompts, model=None, temperature=0.7, path=None,
+                 endpoint="/v1/chat/completions", metadata=None):
+    """写入请求文件、上传并创建批处理任务
+
+    Args:
+        client: OpenAI客户端实例
+        prompts: 提示的可迭代对象，元素为字符串或(custom_id, 提示)元组
+        model: 使用的模型名称，如果为None则从环境变量读取
+        temperature: 温度参数
+        path: 请求文件的保存路径，为None时写入临时文件并在上传后删除
+        endpoint: 批处理调用的接口
+        metadata: 附加在任务上的元数据
+
+    Returns:
+        批处理任务ID
+    """
+    keep_file = path is not None
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+    try:
+        count = write_batch_file(prompts, path, model, temperature, endpoint)
+        with open(path, "rb") as f:
+            batch_file = client.files.create(file=f, purpose="batch")
+    finally:
+        if not keep_file:
+            os.remove(path)
+
+    extra = {"metadata": metadata} if metadata else {}
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=endpoint,
+        completion_window="24h",
+        **extra
+    )
+    print(f"已提交批处理任务 {batch.id}，共 {count} 个请求")
+    return batch.id
+
+def poll_batch(client, batch_id, interval=30.0, timeout=None, verbose=True):
+    """轮询批处理任务直到进入终止状态
+
+    Args:
+        client: OpenAI客户端实例
+        batch_id: 批处理任务ID
+        interval: 轮询间隔（秒）
+        timeout: 最长等待时间（秒），None表示一直等待
+        verbose: 是否打印进度
+
+    Returns:
+        最终的Batch对象
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if verbose:
+            counts = batch.request_counts
+            done = f"{counts.completed}/{counts.total}" if counts else "-"
+            print(f"批处理任务 {batch_id}: {batch.status}，已完成 {done}")
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"等待批处理任务 {batch_id} 超时")
+        time.sleep(interval)
+
+def _iter_file_lines(client, file_id):
+    """流式读取文件内容，逐行产出解析后的JSON"""
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+def collect_batch(client, batch):
+    """流式读取批处理结果
+
+    依次读取输出文件和错误文件，不会把整个结果文件载入内存
+
+    Args:
+        client: OpenAI客户端实例
+        batch: Batch对象或批处理任务ID
+
+    Yields:
+        (custom_id, 回复内容, 错误信息)，成功时错误信息为None，失败时回复内容为None
+    """
+    if isinstance(batch, str):
+        batch = client.batches.retrieve(batch)
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for row in _iter_file_lines(client, file_id):
+            response = row.get("response") or {}
+            error = row.get("error")
+            if error is None and response.get("status_code") == 200:
+                content = response["body"]["choices"][0]["message"]["content"]
+                yield row["custom_id"], content, None
+            else:
+                yield row["custom_id"], None, error or response.get("body")
+
+def main():
+    from openai import OpenAI
+    from mock_server import start_mock_server
+
+    # 启动本地模拟服务，离线演示完整的批处理流程
+    server = start_mock_server(batch_delay=0.5)
+    client = OpenAI(api_key="mock-key", base_url=server.base_url)
+
+    prompts = (f"第{i}个问题：{i}的平方是多少？" for i in range(5))
+    batch_id = submit_batch(client, prompts, model="mock-model")
+    batch = poll_batch(client, batch_id, interval=0.2)
+    for custom_id, content, error in collect_batch(client, batch):
+        print(f"{custom_id}: {content if error is None else error}")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+from functools import lru_cache
+import tiktoken
+
+# 参考OpenAI cookbook的计数方式：每条消息有固定的格式开销，回复前还有3个token的引导
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """获取模型对应的tiktoken编码器，未知模型回退到cl100k_base"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_message_tokens(message, model="gpt-3.5-turbo"):
+    """计算单条消息占用的token数"""
+    encoding = get_encoding(model)
+    num_tokens = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        if isinstance(value, str):
+            num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += TOKENS_PER_NAME
+    return num_tokens
+
+class TokenCountedMessages(list):
+    """记录每条消息token数的消息历史
+
+    本身就是一个list，可以直接作为messages传给OpenAI接口。
+    每条消息只在append时计算一次token数，之后每轮对话只需要为新消息付出分词开销，
+    不必在每轮都重新对整个历史分词。
+    """
+
+    def __init__(self, messages=(), model="gpt-3.5-turbo"):
+        super().__init__()
+        self.model = model
+        self._token_counts = []
+        self.extend(messages)
+
+    @classmethod
+    def from_counts(cls, messages, token_counts, model="gpt-3.5-turbo"):
+        """用已知的token数构造，例如从ConversationLog恢复的历史，不需要重新分词"""
+        instance = cls(model=model)
+        list.extend(instance, messages)
+        instance._token_counts = list(token_counts)
+        return instance
+
+    def append(self, message):
+        super().append(message)
+        self._token_counts.append(count_message_tokens(message, self.model))
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def _sync_counts(self):
+        """如果列表被append以外的方式修改过，重新计算全部token数"""
+        if len(self._token_counts) != len(self):
+            self._token_counts = [count_message_tokens(m, self.model) for m in self]
+
+    @property
+    def total_tokens(self):
+        """整个历史发送给模型时占用的token数"""
+        self._sync_counts()
+        return sum(self._token_counts) + REPLY_PRIMING_TOKENS
+
+    def _pop_at(self, index):
+        del self._token_counts[index]
+        return super().pop(index)
+
+    def trim(self, max_tokens):
+        """淘汰最早的非system对话，直到总token数不超过max_tokens
+
+        淘汰以轮次为单位：删除最早的一条非system消息后，紧随其后的assistant/tool回复也一起删除，
+        避免历史以一条孤立的回复开头。最后一条消息（当前的用户输入）始终保留。
+
+        Returns:
+            被淘汰的消息列表
+        """
+        self._sync_counts()
+        evicted = []
+        total = sum(self._token_counts) + REPLY_PRIMING_TOKENS
+        while total > max_tokens:
+            index = next(
+                (i for i, m in enumerate(self[:-1]) if m.get("role") != "system"),
+                None
+            )
+            if index is None:
+                break
+            total -= self._token_counts[index]
+            evicted.append(self._pop_at(index))
+            while index < len(self) - 1 and self[index].get("role") in ("assistant", "tool"):
+                total -= self._token_counts[index]
+                evicted.append(self._pop_at(index))
+        return evicted
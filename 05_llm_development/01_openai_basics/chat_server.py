@@ -0,0 +1,363 @@
+"""
+多会话流式对话服务
+
+把interactive_chat的对话逻辑放到HTTP接口后面，一个进程在asyncio上同时服务大量会话：
+1. POST /sessions/{session_id}/messages：以SSE流式返回回复
+2. WS /sessions/{session_id}/ws：WebSocket连接，每收到一条消息就流式返回回复
+3. 会话历史有上限（消息条数和可选的token预算），内存中只保留最近活跃的会话，
+   空闲超时或超出数量上限的会话写入磁盘，下次访问时再加载
+
+启动：python chat_server.py  或  uvicorn chat_server:app --host 0.0.0.0 --port 8000
+"""
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from openai_chat import init_async_openai_client, astream_chat
+from chat_history import TokenCountedMessages
+import asyncio
+import json
+import os
+import re
+import time
+
+# 加载环境变量
+load_dotenv()
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class Session:
+    """单个会话的历史和状态"""
+
+    def __init__(self, session_id, messages):
+        self.session_id = session_id
+        self.messages = messages
+        self.last_active = time.monotonic()
+        # 同一会话的消息按顺序处理，避免两个回复交错写入历史
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+
+class SessionManager:
+    """管理会话历史：内存中按LRU保留活跃会话，其余的换出到磁盘"""
+
+    def __init__(self, client, model=None, system_message=None, temperature=0.7,
+                 max_context_tokens=None, max_history_messages=50,
+                 max_sessions_in_memory=1000, idle_timeout=600.0,
+                 max_concurrent_streams=100, storage_dir="chat_sessions"):
+        """
+        Args:
+            client: AsyncOpenAI客户端实例
+            model: 使用的模型名称，如果为None则从环境变量读取
+            system_message: 每个新会话的系统提示
+            temperature: 温度参数
+            max_context_tokens: 每个会话发送给模型的历史token上限，为None时只按条数限制
+            max_history_messages: 每个会话保留的非system消息条数上限
+            max_sessions_in_memory: 内存中最多保留的会话数
+            idle_timeout: 会话空闲多少秒后写入磁盘
+            max_concurrent_streams: 同时向模型发出的流式请求数上限
+            storage_dir: 换出会话的存放目录
+        """
+        self.client = client
+        self.model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        self.system_message = system_message
+        self.temperature = temperature
+        self.max_context_tokens = max_context_tokens
+        self.max_history_messages = max_history_messages
+        self.max_sessions_in_memory = max_sessions_in_memory
+        self.idle_timeout = idle_timeout
+        self.storage_dir = storage_dir
+        self.stats = {"requests": 0, "errors": 0, "loaded": 0, "evicted": 0}
+        self._sessions = OrderedDict()
+        self._loading = {}
+        self._saving = {}
+        self._streams = asyncio.Semaphore(max_concurrent_streams)
+        os.makedirs(storage_dir, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.storage_dir, f"{session_id}.json")
+
+    def _new_messages(self, saved=()):
+        if self.max_context_tokens is None:
+            messages = list(saved)
+        else:
+            messages = TokenCountedMessages(saved, self.model)
+        if not messages and self.system_message:
+            messages.append({"role": "system", "content": self.system_message})
+        return messages
+
+    def _read(self, session_id):
+        try:
+            with open(self._path(session_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, session_id, messages):
+        path = self._path(session_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(messages), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def get(self, session_id):
+        """获取会话，不在内存中时从磁盘加载，磁盘上也没有时新建"""
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"无效的会话ID: {session_id}")
+        while True:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+            # 会话正在换出时，等写入完成再读取，避免读到旧的历史
+            saving = self._saving.get(session_id)
+            if saving is not None:
+                await saving
+                # 已完成的任务await时不会让出事件循环，这里直接移除，不等完成回调
+                if self._saving.get(session_id) is saving:
+                    del self._saving[session_id]
+                continue
+            # 同一会话的并发请求共用一次磁盘读取
+            task = self._loading.get(session_id)
+            if task is None:
+                task = asyncio.ensure_future(asyncio.to_thread(self._read, session_id))
+                self._loading[session_id] = task
+            try:
+                saved = await task
+            finally:
+                if self._loading.get(session_id) is task:
+                    del self._loading[session_id]
+            # 读取期间会话可能已被其他请求加载甚至再次换出，此时读到的内容已过期
+            if session_id in self._sessions or session_id in self._saving:
+                continue
+            if saved is not None:
+                self.stats["loaded"] += 1
+            session = Session(session_id, self._new_messages(saved or ()))
+            self._sessions[session_id] = session
+            # 换出在后台写盘，返回前不能让出事件循环，否则新会话可能被其他请求立即换出
+            self._evict_overflow()
+            return session
+
+    def _evict(self, session):
+        """把会话从内存中移除并在后台写入磁盘；正在处理或等待处理消息的会话不换出"""
+        session_id = session.session_id
+        if session.lock.locked() or session.waiters or self._sessions.get(session_id) is not session:
+            return None
+        self._sessions.pop(session_id, None)
+        task = asyncio.ensure_future(asyncio.to_thread(self._write, session_id, list(session.messages)))
+        self._saving[session_id] = task
+
+        def saved(task):
+            if self._saving.get(session_id) is task:
+                del self._saving[session_id]
+
+        task.add_done_callback(saved)
+        self.stats["evicted"] += 1
+        return task
+
+    def _evict_overflow(self):
+        # 刚加载的会话排在最后，正在使用的会话会被跳过
+        for session in list(self._sessions.values())[:-1]:
+            if len(self._sessions) <= self.max_sessions_in_memory:
+                break
+            self._evict(session)
+
+    async def evict_idle(self):
+        """把空闲超时的会话写入磁盘"""
+        deadline = time.monotonic() - self.idle_timeout
+        tasks = [self._evict(s) for s in list(self._sessions.values()) if s.last_active < deadline]
+        await asyncio.gather(*(t for t in tasks if t is not None))
+
+    async def run_evictor(self, interval=30.0):
+        """后台任务：定期换出空闲会话"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.evict_idle()
+
+    async def flush(self):
+        """把内存中的所有会话写入磁盘，服务关闭时调用"""
+        await asyncio.gather(*self._saving.values())
+        for session in list(self._sessions.values()):
+            await asyncio.to_thread(self._write, session.session_id, list(session.messages))
+
+    async def delete(self, session_id):
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"无效的会话ID: {session_id}")
+        self._sessions.pop(session_id, None)
+        saving = self._saving.get(session_id)
+        if saving is not None:
+            await saving
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _remove(messages, index):
+        if isinstance(messages, TokenCountedMessages):
+            messages._pop_at(index)
+        else:
+            del messages[index]
+
+    def _bound_history(self, messages):
+        """按条数和token预算裁剪历史，以轮次为单位淘汰，system消息和当前输入始终保留"""
+        while sum(1 for m in messages if m.get("role") != "system") > self.max_history_messages:
+            index = next(i for i, m in enumerate(messages) if m.get("role") != "system")
+            if index == len(messages) - 1:
+                break
+            self._remove(messages, index)
+            while index < len(messages) - 1 and messages[index].get("role") in ("assistant", "tool"):
+                self._remove(messages, index)
+        if self.max_context_tokens is not None:
+            messages.trim(self.max_context_tokens)
+
+    async def _acquire(self, session_id):
+        """获取会话并持有它的锁；等锁期间会话可能已被换出，此时重新加载"""
+        while True:
+            session = await self.get(session_id)
+            session.waiters += 1
+            try:
+                await session.lock.acquire()
+            finally:
+                session.waiters -= 1
+            if self._sessions.get(session_id) is session:
+                return session
+            session.lock.release()
+
+    async def chat(self, session_id, user_message):
+        """向会话发送一条消息，逐段产出回复内容
+
+        回复完成后才写入历史；请求失败时撤回这条用户消息，会话可以继续使用
+        """
+        session = await self._acquire(session_id)
+        try:
+            session.last_active = time.monotonic()
+            self.stats["requests"] += 1
+            messages = session.messages
+            messages.append({"role": "user", "content": user_message})
+            self._bound_history(messages)
+            stats = {}
+            try:
+                async with self._streams:
+                    async for content in astream_chat(self.client, messages, self.model,
+                                                      self.temperature, on_complete=stats.update):
+                        yield content
+            except BaseException:
+                # 包括客户端断开导致的取消
+                self.stats["errors"] += 1
+                if messages and messages[-1].get("role") == "user":
+                    self._remove(messages, len(messages) - 1)
+                raise
+            messages.append({"role": "assistant", "content": stats["content"]})
+            session.last_active = time.monotonic()
+        finally:
+            session.lock.release()
+        # 并发高峰时内存中的会话数可能暂时超出上限，空闲下来后再换出
+        self._evict_overflow()
+
+    def snapshot(self):
+        return {
+            "sessions_in_memory": len(self._sessions),
+            **self.stats,
+        }
+
+class ChatRequest(BaseModel):
+    message: str
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def create_app(manager_factory=None, evict_interval=30.0):
+    """创建FastAPI应用
+
+    Args:
+        manager_factory: 返回SessionManager的函数，在服务启动时调用；
+            默认使用共享的AsyncOpenAI客户端和环境变量中的模型
+        evict_interval: 检查空闲会话的间隔（秒）
+    """
+    if manager_factory is None:
+        def manager_factory():
+            return SessionManager(
+                init_async_openai_client(),
+                system_message=os.getenv("CHAT_SYSTEM_MESSAGE", "你是一个友好的AI助手。"),
+            )
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.manager = manager_factory()
+        evictor = asyncio.create_task(app.state.manager.run_evictor(evict_interval))
+        yield
+        evictor.cancel()
+        await app.state.manager.flush()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/sessions/{session_id}/messages")
+    async def post_message(session_id: str, request: ChatRequest):
+        manager = app.state.manager
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise HTTPException(status_code=400, detail="无效的会话ID")
+
+        async def events():
+            try:
+                async for content in manager.chat(session_id, request.message):
+                    yield _sse("delta", {"content": content})
+            except Exception as e:
+                yield _sse("error", {"message": str(e)})
+                return
+            yield _sse("done", {})
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    @app.websocket("/sessions/{session_id}/ws")
+    async def websocket_chat(websocket: WebSocket, session_id: str):
+        manager = app.state.manager
+        if not SESSION_ID_PATTERN.match(session_id):
+            await websocket.close(code=1008)
+            return
+        await websocket.accept()
+        try:
+            while True:
+                user_message = await websocket.receive_text()
+                try:
+                    async for content in manager.chat(session_id, user_message):
+                        await websocket.send_json({"type": "delta", "content": content})
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "message": str(e)})
+                    continue
+                await websocket.send_json({"type": "done"})
+        except WebSocketDisconnect:
+            pass
+
+    @app.get("/sessions/{session_id}")
+    async def get_session(session_id: str):
+        try:
+            session = await app.state.manager.get(session_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"session_id": session_id, "messages": list(session.messages)}
+
+    @app.delete("/sessions/{session_id}")
+    async def delete_session(session_id: str):
+        try:
+            await app.state.manager.delete(session_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"deleted": session_id}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.manager.snapshot()
+
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("CHAT_SERVER_PORT", "8000")))
@@ -0,0 +1,266 @@
+"""
+只追加的对话日志
+
+每个会话对应两个文件：
+1. {path}.jsonl：每行一条消息，只在末尾追加
+2. {path}.idx：定长的二进制索引，每条消息一个记录（偏移、长度、token数、角色）
+
+恢复会话时只读索引的末尾，按token预算从后往前选出要加载的消息，再从日志中一次读出这一段，
+读取量只与预算有关，与历史长度无关。日志超过一定大小时自动压缩：只保留system消息和最近的对话，
+被淘汰的部分追加到归档文件中。
+"""
+
+from chat_history import count_message_tokens, REPLY_PRIMING_TOKENS
+import json
+import os
+import struct
+
+# 偏移(8字节)、长度(4字节)、token数(4字节)、角色(1字节)
+INDEX_RECORD = struct.Struct("<QIIB")
+ROLE_CODES = {"system": 0, "user": 1, "assistant": 2, "tool": 3}
+# 从索引末尾往前读时，每次读取的记录数
+INDEX_READ_BLOCK = 256
+
+class ConversationLog:
+    """单个会话的只追加消息日志，支持按token预算快速恢复最近的对话"""
+
+    def __init__(self, path, model="gpt-3.5-turbo", count_tokens=None,
+                 max_log_bytes=16 * 1024 * 1024, retain_tokens=8000, archive=True, durable=False):
+        """
+        Args:
+            path: 日志文件路径（不含扩展名）
+            model: 计算token数时使用的模型
+            count_tokens: 自定义的单条消息token计数函数，默认使用tiktoken
+            max_log_bytes: 日志超过该大小时自动压缩，为None时不自动压缩
+            retain_tokens: 自动压缩时保留的最近对话的token数
+            archive: 压缩时是否把被淘汰的消息追加到{path}.archive.jsonl
+            durable: 每次追加后是否fsync，保证断电时不丢消息
+        """
+        self.path = path
+        self.log_path = path + ".jsonl"
+        self.index_path = path + ".idx"
+        self.archive_path = path + ".archive.jsonl"
+        self.model = model
+        self.count_tokens = count_tokens or (lambda message: count_message_tokens(message, model))
+        self.max_log_bytes = max_log_bytes
+        self.retain_tokens = retain_tokens
+        self.archive = archive
+        self.durable = durable
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._log = open(self.log_path, "ab")
+        self._index = open(self.index_path, "ab")
+
+    def __len__(self):
+        return self._records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+    def _recover(self):
+        """检查日志和索引是否一致，进程在两次写入之间退出时修复它们
+
+        正常情况下只读取最后一条索引记录；日志比索引长时只为多出的部分补建索引
+        """
+        for path in (self.log_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        log_size = os.path.getsize(self.log_path)
+        records = os.path.getsize(self.index_path) // INDEX_RECORD.size
+        end = 0
+        if records:
+            offset, length, _, _ = self._read_index(records - 1, records)[0]
+            end = offset + length
+        if end == log_size:
+            self._records, self._log_size = records, log_size
+            return
+        # 索引与日志对不上（例如压缩时只替换了其中一个文件），从头重建
+        if end > log_size or not self._rebuild_index(records, end):
+            self._rebuild_index(0, 0)
+
+    def _rebuild_index(self, records, offset):
+        """从第records条消息（日志偏移offset）开始扫描日志补建索引，丢弃末尾不完整的一行
+
+        Returns:
+            日志中间出现无法解析的行时返回False，说明起点不是消息边界
+        """
+        entries = []
+        with open(self.log_path, "rb") as f:
+            if offset:
+                f.seek(offset - 1)
+                if f.read(1) != b"\n":
+                    return False
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    if records:
+                        return False
+                    break
+                entries.append(self._index_entry(offset, len(line), message))
+                offset += len(line)
+            log_size = f.seek(0, os.SEEK_END)
+        if log_size != offset:
+            with open(self.log_path, "r+b") as f:
+                f.truncate(offset)
+        with open(self.index_path, "r+b") as f:
+            f.truncate(records * INDEX_RECORD.size)
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(entries))
+        self._records, self._log_size = records + len(entries), offset
+        return True
+
+    def _index_entry(self, offset, length, message):
+        return INDEX_RECORD.pack(offset, length, self.count_tokens(message),
+                                 ROLE_CODES.get(message.get("role"), 3))
+
+    @staticmethod
+    def _write_index(path, entries):
+        with open(path, "wb") as f:
+            f.write(b"".join(entries))
+
+    def append(self, message):
+        """追加一条消息：先写日志再写索引，索引记录了消息的token数，恢复时无需重新分词
+
+        token数在写入任何文件之前算好；写入中途出错时把两个文件截回追加前的长度，
+        内存中的偏移和记录数只在两者都写入成功后更新
+        """
+        line = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+        entry = self._index_entry(self._log_size, len(line), message)
+        try:
+            self._log.write(line)
+            self._log.flush()
+            self._index.write(entry)
+            self._index.flush()
+            if self.durable:
+                os.fsync(self._log.fileno())
+                os.fsync(self._index.fileno())
+        except BaseException:
+            self._log.truncate(self._log_size)
+            self._index.truncate(self._records * INDEX_RECORD.size)
+            raise
+        self._log_size += len(line)
+        self._records += 1
+        if self.max_log_bytes is not None and self._log_size > self.max_log_bytes:
+            self.compact(self.retain_tokens)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def _read_index(self, start, stop):
+        """读取[start, stop)范围内的索引记录"""
+        with open(self.index_path, "rb") as f:
+            f.seek(start * INDEX_RECORD.size)
+            data = f.read((stop - start) * INDEX_RECORD.size)
+        return list(INDEX_RECORD.iter_unpack(data))
+
+    def _select_tail(self, max_tokens):
+        """按token预算从后往前选出保留的消息
+
+        与TokenCountedMessages.trim的淘汰规则一致：开头的system消息始终保留，
+        不以孤立的assistant/tool回复开头，最后一条消息始终保留
+
+        Returns:
+            (system记录或None, 保留部分的起始序号, 保留部分的索引记录)
+        """
+        if self._records == 0:
+            return None, 0, []
+        first = self._read_index(0, 1)[0]
+        system = first if first[3] == ROLE_CODES["system"] else None
+        floor = 1 if system is not None else 0
+        if max_tokens is None:
+            return system, floor, self._read_index(floor, self._records)
+        budget = max_tokens - REPLY_PRIMING_TOKENS - (system[2] if system else 0)
+        tail, start, full = [], self._records, False
+        while start > floor and not full:
+            block = self._read_index(max(floor, start - INDEX_READ_BLOCK), start)
+            for entry in reversed(block):
+                if tail and entry[2] > budget:
+                    full = True
+                    break
+                budget -= entry[2]
+                tail.append(entry)
+                start -= 1
+        tail.reverse()
+        while len(tail) > 1 and tail[0][3] in (ROLE_CODES["assistant"], ROLE_CODES["tool"]):
+            tail.pop(0)
+            start += 1
+        return system, start, tail
+
+    def _read_messages(self, entries):
+        """从日志中读出连续的一段消息"""
+        if not entries:
+            return []
+        start = entries[0][0]
+        end = entries[-1][0] + entries[-1][1]
+        with open(self.log_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(data[offset - start:offset - start + length])
+                for offset, length, _, _ in entries]
+
+    def load_tail(self, max_tokens=None):
+        """读取在token预算内的最近消息
+
+        Args:
+            max_tokens: token预算，为None时读取全部消息
+
+        Returns:
+            (消息列表, 每条消息的token数)，可直接传给TokenCountedMessages.from_counts
+        """
+        system, _, tail = self._select_tail(max_tokens)
+        entries = ([system] if system else []) + tail
+        messages = self._read_messages([system]) if system else []
+        messages += self._read_messages(tail)
+        return messages, [entry[2] for entry in entries]
+
+    def compact(self, keep_tokens=None):
+        """压缩日志：只保留system消息和token预算内的最近对话，重写日志和索引
+
+        Args:
+            keep_tokens: 保留的token数，默认为retain_tokens
+        """
+        system, start, tail = self._select_tail(keep_tokens or self.retain_tokens)
+        floor = 1 if system is not None else 0
+        if start == floor:
+            return 0
+        if self.archive:
+            dropped = self._read_index(floor, start)
+            with open(self.log_path, "rb") as src, open(self.archive_path, "ab") as dst:
+                src.seek(dropped[0][0])
+                dst.write(src.read(dropped[-1][0] + dropped[-1][1] - dropped[0][0]))
+        entries = ([system] if system else []) + tail
+        self._log.close()
+        self._index.close()
+        lines, index, offset = [], [], 0
+        with open(self.log_path, "rb") as f:
+            for old_offset, length, tokens, role in entries:
+                f.seek(old_offset)
+                lines.append(f.read(length))
+                index.append(INDEX_RECORD.pack(offset, length, tokens, role))
+                offset += length
+        # 先替换日志再替换索引；两者之间进程退出时，下次打开会发现不一致并重建索引
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+        self._write_index(self.index_path + ".tmp", index)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self._records, self._log_size = len(entries), offset
+        self._log = open(self.log_path, "ab")
+        self._index = open(self.index_path, "ab")
+        return start - floor
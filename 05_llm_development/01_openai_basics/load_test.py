@@ -0,0 +1,203 @@
+"""
+对话函数压测工具
+
+默认在本地启动mock_server.py中的模拟服务，不消耗真实额度；
+也可以通过--base-url指向任意OpenAI兼容服务。
+对每个客户端函数、每个并发度发送固定数量的请求，统计吞吐量（请求/秒）、
+错误数以及延迟的p50/p95/p99；流式函数额外统计首token耗时（TTFT）。
+
+示例：
+    python load_test.py --requests 200 --concurrency 1 8 32 --ttft-median 0.2
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import argparse
+import asyncio
+import os
+import time
+
+def percentile(sorted_values, q):
+    """计算已排序样本的分位数"""
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def summarize(name, concurrency, latencies, ttfts, errors, elapsed):
+    latencies = sorted(latencies)
+    row = {
+        "function": name,
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+    if ttfts:
+        ttfts = sorted(ttfts)
+        row["ttft_p50"] = percentile(ttfts, 0.50)
+        row["ttft_p99"] = percentile(ttfts, 0.99)
+    return row
+
+def run_sync(name, call, total, concurrency):
+    """用线程池并发执行同步函数；call返回None表示失败，返回数字表示TTFT"""
+    latencies, ttfts, errors = [], [], 0
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            result = call(i)
+        except Exception:
+            return None, None
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, result in executor.map(one, range(total)):
+            if latency is None or result is None:
+                errors += 1
+                continue
+            latencies.append(latency)
+            if isinstance(result, float):
+                ttfts.append(result)
+    return summarize(name, concurrency, latencies, ttfts, errors, time.perf_counter() - start)
+
+def run_async(name, call, total, concurrency):
+    """用信号量限制并发执行异步函数"""
+    async def runner():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result = await call(i)
+                except Exception:
+                    return None
+                return None if result is None else time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(total)))
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(runner())
+    latencies = [r for r in results if r is not None]
+    return summarize(name, concurrency, latencies, [], len(results) - len(latencies), elapsed)
+
+def build_scenarios(base_url):
+    """构造要压测的客户端函数，每个函数接收请求序号"""
+    import openai_chat as chat
+
+    client = chat.init_openai_client(base_urls=[base_url])
+
+    def simple(i):
+        return chat.simple_chat(client, f"问题{i}", model="mock-model")
+
+    def stream(i):
+        stats = {}
+        messages = [{"role": "user", "content": f"问题{i}"}]
+        for _ in chat.stream_chat(client, messages, model="mock-model", on_complete=stats.update,
+                                  include_usage=True):
+            pass
+        return stats.get("ttft")
+
+    def memory(i):
+        messages = [
+            {"role": "system", "content": "你是一个友好的AI助手。"},
+            {"role": "user", "content": f"问题{i}"},
+        ]
+        response, _ = chat.chat_with_memory(client, messages, model="mock-model")
+        return response
+
+    scenarios = [("simple_chat", simple, run_sync),
+                 ("stream_chat", stream, run_sync),
+                 ("chat_with_memory", memory, run_sync)]
+
+    async def asimple(i):
+        # 异步客户端与事件循环绑定，每轮压测使用各自的客户端
+        return await chat.asimple_chat(async_clients[asyncio.get_running_loop()], f"问题{i}",
+                                       model="mock-model")
+
+    async_clients = _LoopLocalClients(base_url)
+    scenarios.append(("asimple_chat", asimple, run_async))
+
+    try:
+        # 与LangChain示例一样通过create_chat_model创建；不传限流器，
+        # 否则会注册全局调度器，其他场景的压测结果也会受到限流
+        llm = chat.create_chat_model(model="mock-model", base_url=base_url, rate_limiter=None)
+    except ImportError:
+        print("未安装langchain-openai，跳过LangChain场景")
+    else:
+        scenarios.append(("langchain_invoke", lambda i: llm.invoke(f"问题{i}").content, run_sync))
+    return scenarios
+
+class _LoopLocalClients(dict):
+    """为每个事件循环创建独立的AsyncOpenAI客户端"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def __missing__(self, loop):
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=self.base_url)
+        self[loop] = client
+        return client
+
+def print_table(rows):
+    header = f"{'function':<18}{'conc':>6}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ttft50':>9}{'ttft99':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        ttft = (f"{r['ttft_p50']:>9.3f}{r['ttft_p99']:>9.3f}" if "ttft_p50" in r else f"{'-':>9}{'-':>9}")
+        print(f"{r['function']:<18}{r['concurrency']:>6}{r['requests']:>7}{r['errors']:>6}"
+              f"{r['throughput']:>9.1f}{r['p50']:>9.3f}{r['p95']:>9.3f}{r['p99']:>9.3f}{ttft}")
+
+def main():
+    parser = argparse.ArgumentParser(description="对话函数压测")
+    parser.add_argument("--base-url", help="压测的服务地址，默认启动本地模拟服务")
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--functions", nargs="*", help="只压测指定的函数")
+    parser.add_argument("--ttft-median", type=float, default=0.05)
+    parser.add_argument("--ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=16)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        from mock_server import start_mock_server, LatencyModel
+        server = start_mock_server(
+            ttft=LatencyModel("lognormal", median=args.ttft_median, sigma=args.ttft_sigma),
+            tokens_per_second=args.tokens_per_second,
+            completion_tokens=args.completion_tokens,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+        )
+        base_url = server.base_url
+        print(f"已启动本地模拟服务: {base_url}")
+
+    rows = []
+    for name, call, runner in build_scenarios(base_url):
+        if args.functions and name not in args.functions:
+            continue
+        for concurrency in args.concurrency:
+            print(f"压测 {name}，并发度 {concurrency} ...")
+            # chat_with_memory等函数会打印回复内容，压测期间丢弃这些输出
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                rows.append(runner(name, call, args.requests, concurrency))
+    print_table(rows)
+
+    if server is not None:
+        print(f"模拟服务请求统计: {server.request_counts}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+对话请求的延迟与token用量统计
+
+ChatMetrics本身就是一个指标钩子（可调用对象），通过openai_chat.set_metrics_hook注册后，
+每次请求结束都会收到一个事件字典：
+    model、latency（秒）、ttft（首token耗时，仅流式请求）、prompt_tokens、
+    completion_tokens、retries、error（异常，成功时为None）、stream
+
+统计结果可以导出为Prometheus文本格式，也可以定期写出JSON快照
+"""
+
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+# 延迟直方图的桶边界（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Prometheus风格的累计直方图，同时保留最近的样本用于计算分位数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, reservoir_size=4096):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=reservoir_size)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """按最近的样本计算分位数，没有样本时返回None"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+class _ModelStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.errors = defaultdict(int)
+        self.latency = Histogram()
+        self.ttft = Histogram()
+
+def _error_type(error):
+    status = getattr(error, "status_code", None)
+    return str(status) if status is not None else type(error).__name__
+
+class ChatMetrics:
+    """按模型汇总请求延迟、首token耗时、token用量、重试和错误"""
+
+    def __init__(self):
+        self._models = defaultdict(_ModelStats)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        """记录一次请求事件"""
+        with self._lock:
+            stats = self._models[event["model"]]
+            stats.requests += 1
+            stats.retries += event.get("retries", 0)
+            if event.get("error") is not None:
+                stats.errors[_error_type(event["error"])] += 1
+                return
+            stats.latency.observe(event["latency"])
+            if event.get("ttft") is not None:
+                stats.ttft.observe(event["ttft"])
+            stats.prompt_tokens += event.get("prompt_tokens") or 0
+            stats.completion_tokens += event.get("completion_tokens") or 0
+
+    def snapshot(self):
+        """返回当前所有模型的统计结果"""
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "models": {
+                    model: {
+                        "requests": s.requests,
+                        "retries": s.retries,
+                        "errors": dict(s.errors),
+                        "prompt_tokens": s.prompt_tokens,
+                        "completion_tokens": s.completion_tokens,
+                        "latency": s.latency.summary(),
+                        "ttft": s.ttft.summary(),
+                    }
+                    for model, s in self._models.items()
+                },
+            }
+
+    def to_prometheus(self):
+        """导出为Prometheus文本格式"""
+        lines = []
+
+        def histogram(name, help_text, attr):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for model, s in self._models.items():
+                h = getattr(s, attr)
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{model="{model}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{model="{model}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{model="{model}"}} {h.sum}')
+                lines.append(f'{name}_count{{model="{model}"}} {h.count}')
+
+        def counter(name, help_text, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in values:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        with self._lock:
+            models = self._models.items()
+            counter("llm_requests_total", "Chat completion requests.",
+                    [({"model": m}, s.requests) for m, s in models])
+            counter("llm_retries_total", "Retries after rate limiting.",
+                    [({"model": m}, s.retries) for m, s in models])
+            counter("llm_errors_total", "Failed requests by error type.",
+                    [({"model": m, "type": t}, c) for m, s in models for t, c in s.errors.items()])
+            counter("llm_prompt_tokens_total", "Prompt tokens sent.",
+                    [({"model": m}, s.prompt_tokens) for m, s in models])
+            counter("llm_completion_tokens_total", "Completion tokens received.",
+                    [({"model": m}, s.completion_tokens) for m, s in models])
+            histogram("llm_request_latency_seconds", "End-to-end request latency.", "latency")
+            histogram("llm_time_to_first_token_seconds", "Time to first streamed token.", "ttft")
+        return "\n".join(lines) + "\n"
+
+    def start_json_reporter(self, path, interval=60.0):
+        """启动后台线程，每隔interval秒把快照追加写入path（每行一个JSON）
+
+        Returns:
+            threading.Event，调用set()停止写出
+        """
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(interval):
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+
+        threading.Thread(target=report, daemon=True).start()
+        return stop
+
+    def start_prometheus_server(self, host="0.0.0.0", port=9100):
+        """在后台线程中提供 /metrics 接口供Prometheus抓取
+
+        Returns:
+            ThreadingHTTPServer实例，调用shutdown()停止
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
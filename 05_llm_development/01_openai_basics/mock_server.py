@@ -0,0 +1,423 @@
+"""
+本地OpenAI兼容模拟服务
+
+用于在不消耗真实额度、不联网的情况下验证和压测客户端代码，目前支持：
+1. 对话：POST /v1/chat/completions（支持stream=True的SSE流式响应）
+2. 向量化：POST /v1/embeddings（根据文本哈希生成确定性的单位向量）
+3. 文件上传与下载：POST /v1/files、GET /v1/files/{id}/content
+4. 批处理任务：POST /v1/batches、GET /v1/batches/{id}、POST /v1/batches/{id}/cancel
+
+对话和向量化接口可以配置首token延迟分布、生成速度（tokens/s）、回复长度，
+并按比例注入500错误和带Retry-After的429错误。
+回复内容为"mock reply: <最后一条用户消息>"，之后补足到指定的token数。
+"""
+
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import random
+import struct
+import threading
+import time
+
+_ids = itertools.count(1)
+
+def _new_id(prefix):
+    return f"{prefix}-mock{next(_ids)}"
+
+class LatencyModel:
+    """延迟分布
+
+    kind可选：
+    - "fixed"：固定为value秒
+    - "uniform"：在[low, high]之间均匀分布
+    - "lognormal"：中位数为median、对数标准差为sigma的对数正态分布，适合模拟长尾
+    """
+
+    def __init__(self, kind="fixed", value=0.0, low=0.0, high=0.0, median=0.1, sigma=0.5):
+        self.kind = kind
+        self.value = value
+        self.low = low
+        self.high = high
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.value
+        if self.kind == "uniform":
+            return random.uniform(self.low, self.high)
+        if self.kind == "lognormal":
+            return random.lognormvariate(0.0, self.sigma) * self.median
+        raise ValueError(f"未知的延迟分布: {self.kind}")
+
+def _estimate_tokens(text):
+    """粗略估算token数，模拟服务不需要精确值"""
+    return max(1, len(text) // 4)
+
+def _reply_pieces(messages, completion_tokens=1):
+    """生成回复的分段内容，每段视为一个token"""
+    last_user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    return [f"mock reply: {last_user}"] + [f" token{i}" for i in range(1, completion_tokens)]
+
+def _mock_chat_completion(body, completion_tokens=1):
+    """根据请求体生成一个确定性的chat.completion响应"""
+    messages = body.get("messages", [])
+    pieces = _reply_pieces(messages, completion_tokens)
+    content = "".join(pieces)
+    prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+    return {
+        "id": _new_id("chatcmpl"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock-model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        },
+    }
+
+def _mock_embedding(text, dim):
+    """根据文本哈希生成确定性的单位向量，相同文本总是得到相同的向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """模拟服务，保存延迟/错误注入配置以及文件和批处理任务状态"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, batch_delay=0.0, ttft=None, tokens_per_second=None,
+                 completion_tokens=1, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, embedding_latency=None, embedding_dim=1536):
+        """
+        Args:
+            address: 监听地址，例如("127.0.0.1", 0)，端口为0时自动分配
+            batch_delay: 批处理任务开始执行前的等待时间（秒），用于模拟排队
+            ttft: 首token延迟的LatencyModel，None表示没有延迟
+            tokens_per_second: 生成速度，None表示瞬间生成完毕
+            completion_tokens: 每个回复包含的token数
+            error_rate: 返回500错误的比例
+            rate_limit_rate: 返回429错误的比例
+            retry_after: 429响应中Retry-After的秒数
+            embedding_latency: 向量化接口延迟的LatencyModel
+            embedding_dim: 向量维度
+        """
+        super().__init__(address, MockOpenAIHandler)
+        self.batch_delay = batch_delay
+        self.ttft = ttft or LatencyModel()
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.embedding_latency = embedding_latency or LatencyModel()
+        self.embedding_dim = embedding_dim
+        self.request_counts = {"chat": 0, "embeddings": 0, "errors": 0, "rate_limited": 0}
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def add_file(self, content, filename, purpose):
+        file_id = _new_id("file")
+        with self.lock:
+            self.files[file_id] = {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+                "content": content,
+            }
+        return file_id
+
+    def file_info(self, file_id):
+        info = dict(self.files[file_id])
+        info.pop("content")
+        return info
+
+    def run_batch(self, batch_id):
+        """逐行执行批处理输入文件，生成输出文件和错误文件"""
+        time.sleep(self.batch_delay)
+        batch = self.batches[batch_id]
+        if batch["status"] == "cancelling":
+            batch["status"] = "cancelled"
+            return
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        outputs, errors = [], []
+        lines = self.files[batch["input_file_id"]]["content"].splitlines()
+        batch["request_counts"]["total"] = len(lines)
+        for line in lines:
+            request = json.loads(line)
+            result = {"id": _new_id("batch_req"), "custom_id": request["custom_id"]}
+            if request.get("url") != batch["endpoint"]:
+                result["response"] = None
+                result["error"] = {"code": "invalid_url", "message": "url与批处理endpoint不一致"}
+                errors.append(result)
+                batch["request_counts"]["failed"] += 1
+                continue
+            result["response"] = {
+                "status_code": 200,
+                "request_id": _new_id("req"),
+                "body": _mock_chat_completion(request["body"], self.completion_tokens),
+            }
+            result["error"] = None
+            outputs.append(result)
+            batch["request_counts"]["completed"] += 1
+
+        def dump(rows):
+            return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+        if outputs:
+            batch["output_file_id"] = self.add_file(dump(outputs), f"{batch_id}_output.jsonl", "batch_output")
+        if errors:
+            batch["error_file_id"] = self.add_file(dump(errors), f"{batch_id}_error.jsonl", "batch_output")
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    server: MockOpenAIServer
+    # HTTP/1.1才能复用keep-alive连接，压测结果才能反映客户端连接池的效果
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # 不输出访问日志，避免干扰示例输出
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        body = json.dumps({"error": {"message": message, "type": "invalid_request_error"}},
+                          ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_error(self):
+        """按配置的比例注入错误，注入时返回True"""
+        roll = random.random()
+        server = self.server
+        if roll < server.rate_limit_rate:
+            server.request_counts["rate_limited"] += 1
+            self._send_error(429, "Rate limit reached (mock)",
+                             {"Retry-After": str(server.retry_after)})
+            return True
+        if roll < server.rate_limit_rate + server.error_rate:
+            server.request_counts["errors"] += 1
+            self._send_error(500, "Internal server error (mock)")
+            return True
+        return False
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _chat_completions(self, body):
+        server = self.server
+        server.request_counts["chat"] += 1
+        if self._inject_error():
+            return
+        time.sleep(server.ttft.sample())
+        token_delay = 1.0 / server.tokens_per_second if server.tokens_per_second else 0.0
+        if not body.get("stream"):
+            time.sleep(token_delay * max(0, server.completion_tokens - 1))
+            return self._send_json(_mock_chat_completion(body, server.completion_tokens))
+
+        # 流式响应：SSE事件通过chunked编码逐个发送
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_id, created = _new_id("chatcmpl"), int(time.time())
+        model = body.get("model", "mock-model")
+        pieces = _reply_pieces(body.get("messages", []), server.completion_tokens)
+
+        def event(choices, usage=None):
+            payload = {"id": chunk_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": choices, "usage": usage}
+            self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        for i, piece in enumerate(pieces):
+            if i > 0:
+                time.sleep(token_delay)
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            event([{"index": 0, "delta": delta, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+            event([], {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                       "total_tokens": prompt_tokens + len(pieces)})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _embeddings(self, body):
+        server = self.server
+        server.request_counts["embeddings"] += 1
+        if self._inject_error():
+            return
+        time.sleep(server.embedding_latency.sample())
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dim = body.get("dimensions") or server.embedding_dim
+        data = []
+        for index, text in enumerate(inputs):
+            vector = _mock_embedding(str(text), dim)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(_estimate_tokens(str(text)) for text in inputs)
+        self._send_json({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "mock-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+            batch = self.server.batches.get(parts[2])
+            if batch is None:
+                return self._send_error(404, f"batch {parts[2]} 不存在")
+            return self._send_json(batch)
+        if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content":
+            file = self.server.files.get(parts[2])
+            if file is None:
+                return self._send_error(404, f"file {parts[2]} 不存在")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(file["content"])))
+            self.end_headers()
+            self.wfile.write(file["content"])
+            return
+        if parts[:2] == ["v1", "files"] and len(parts) == 3:
+            if parts[2] not in self.server.files:
+                return self._send_error(404, f"file {parts[2]} 不存在")
+            return self._send_json(self.server.file_info(parts[2]))
+        self._send_error(404, f"不支持的接口: GET {self.path}")
+
+    def do_POST(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts == ["v1", "chat", "completions"]:
+            return self._chat_completions(json.loads(self._read_body()))
+        if parts == ["v1", "embeddings"]:
+            return self._embeddings(json.loads(self._read_body()))
+        if parts == ["v1", "files"]:
+            return self._upload_file()
+        if parts == ["v1", "batches"]:
+            return self._create_batch(json.loads(self._read_body()))
+        if parts[:2] == ["v1", "batches"] and len(parts) == 4 and parts[3] == "cancel":
+            batch = self.server.batches.get(parts[2])
+            if batch is None:
+                return self._send_error(404, f"batch {parts[2]} 不存在")
+            if batch["status"] in ("validating", "in_progress"):
+                batch["status"] = "cancelling"
+            return self._send_json(batch)
+        self._send_error(404, f"不支持的接口: POST {self.path}")
+
+    def _upload_file(self):
+        """解析multipart/form-data上传的文件"""
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=default_policy).parsebytes(header + self._read_body())
+        fields, content, filename = {}, None, "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+            else:
+                fields[name] = part.get_content().strip()
+        if content is None:
+            return self._send_error(400, "缺少file字段")
+        file_id = self.server.add_file(content, filename, fields.get("purpose", "batch"))
+        self._send_json(self.server.file_info(file_id))
+
+    def _create_batch(self, body):
+        if body.get("input_file_id") not in self.server.files:
+            return self._send_error(400, "input_file_id不存在")
+        batch_id = _new_id("batch")
+        self.server.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "metadata": body.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        threading.Thread(target=self.server.run_batch, args=(batch_id,), daemon=True).start()
+        self._send_json(self.server.batches[batch_id])
+
+def start_mock_server(host="127.0.0.1", port=0, **kwargs):
+    """在后台线程中启动模拟服务
+
+    Returns:
+        MockOpenAIServer实例，通过server.base_url获取API地址，用完后调用server.shutdown()
+    """
+    server = MockOpenAIServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft-median", type=float, default=0.2, help="首token延迟中位数（秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="首token延迟的对数标准差")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        ("127.0.0.1", args.port),
+        ttft=LatencyModel("lognormal", median=args.ttft_median, sigma=args.ttft_sigma),
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    print(f"模拟服务已启动: {server.base_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,341 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from chat_history import TokenCountedMessages, get_encoding
+from rate_limiter import RateLimitScheduler
+from routing import EndpointRouter, AsyncEndpointRouter
+import importlib.util
+import threading
+import asyncio
+import httpx
+import time
 import os
 
 # 加载环境变量中的API密钥
 load_dotenv()
 
-def init_openai_client():
+# 进程级共享的客户端缓存，相同配置只创建一次，复用同一个keep-alive连接池
+_client_cache = {}
+_client_lock = threading.RLock()
+
+def _client_key(kind, max_connections, max_keepalive_connections,
+                keepalive_expiry, http2, timeout, connect_timeout):
+    """生成客户端缓存的键，API地址和密钥变化时会得到新的客户端"""
+    return (
+        kind,
+        os.getenv("OPENAI_API_KEY"),
+        os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        max_connections, max_keepalive_connections, keepalive_expiry,
+        http2, timeout, connect_timeout,
+    )
+
+def _build_http_client(client_cls, max_connections, max_keepalive_connections,
+                       keepalive_expiry, http2, timeout, connect_timeout):
+    """按连接池配置创建httpx客户端，并挂上请求计数钩子"""
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("未安装h2，已回退到HTTP/1.1（可执行 pip install httpx[http2]）")
+        http2 = False
+
+    counter = {"requests": 0}
+    if client_cls is httpx.AsyncClient:
+        async def count_request(request):
+            counter["requests"] += 1
+    else:
+        def count_request(request):
+            counter["requests"] += 1
+
+    http_client = client_cls(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        http2=http2,
+        event_hooks={"request": [count_request]},
+    )
+    http_client._pool_config = {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "http2": http2,
+    }
+    http_client._request_counter = counter
+    return http_client
+
+def _get_or_create(kind, factory, *pool_args):
+    key = _client_key(kind, *pool_args)
+    with _client_lock:
+        if key not in _client_cache:
+            _client_cache[key] = factory()
+        return _client_cache[key]
+
+def get_http_client(max_connections=100, max_keepalive_connections=20,
+                    keepalive_expiry=30.0, http2=False, timeout=60.0,
+                    connect_timeout=10.0):
+    """获取进程内共享的httpx连接池
+
+    可以传给LangChain的ChatOpenAI(http_client=...)，让所有示例共用同一个连接池
+    """
+    pool_args = (max_connections, max_keepalive_connections, keepalive_expiry,
+                 http2, timeout, connect_timeout)
+    return _get_or_create(
+        "http", lambda: _build_http_client(httpx.Client, *pool_args), *pool_args
+    )
+
+def get_async_http_client(max_connections=100, max_keepalive_connections=20,
+                          keepalive_expiry=30.0, http2=False, timeout=60.0,
+                          connect_timeout=10.0):
+    """获取进程内共享的异步httpx连接池
+
+    注意：异步连接池与创建它的事件循环绑定，适合在同一个长期运行的事件循环中使用
+    """
+    pool_args = (max_connections, max_keepalive_connections, keepalive_expiry,
+                 http2, timeout, connect_timeout)
+    return _get_or_create(
+        "async_http", lambda: _build_http_client(httpx.AsyncClient, *pool_args), *pool_args
+    )
+
+def _resolve_base_urls(base_urls):
+    """确定要使用的端点列表，OPENAI_BASE_URL中可以用逗号分隔多个地址"""
+    if base_urls is None:
+        base_urls = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").split(",")
+    return tuple(url.strip() for url in base_urls if url.strip())
+
+def init_openai_client(max_connections=100, max_keepalive_connections=20,
+                       keepalive_expiry=30.0, http2=False, timeout=60.0,
+                       connect_timeout=10.0, base_urls=None, hedge=False):
     """初始化OpenAI客户端
     
     确保在.env文件中设置了OPENAI_API_KEY
-    可选：在.env中设置OPENAI_BASE_URL来自定义API地址
+    可选：在.env中设置OPENAI_BASE_URL来自定义API地址，多个OpenAI兼容端点用逗号分隔
+
+    相同配置下多次调用返回同一个客户端实例，所有调用共享一个keep-alive连接池，
+    避免每次都重新建立TCP/TLS连接
+
+    Args:
+        max_connections: 连接池最大连接数
+        max_keepalive_connections: 最多保留的空闲keep-alive连接数
+        keepalive_expiry: 空闲连接的保留时间（秒）
+        http2: 是否启用HTTP/2（需要安装h2）
+        timeout: 请求超时时间（秒）
+        connect_timeout: 建立连接的超时时间（秒）
+        base_urls: 端点地址列表，为None时从OPENAI_BASE_URL读取；
+            有多个端点时返回EndpointRouter，按延迟路由并在出错时故障转移
+        hedge: 多端点时是否启用对冲请求
     """
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-    )
-    return client
+    pool_args = (max_connections, max_keepalive_connections, keepalive_expiry,
+                 http2, timeout, connect_timeout)
+    urls = _resolve_base_urls(base_urls)
+
+    def factory():
+        clients = [
+            OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=url,
+                http_client=get_http_client(*pool_args)
+            )
+            for url in urls
+        ]
+        if len(clients) == 1:
+            return clients[0]
+        return EndpointRouter(clients, hedge=hedge)
+
+    return _get_or_create(("openai", urls, hedge), factory, *pool_args)
+
+def init_async_openai_client(max_connections=100, max_keepalive_connections=20,
+                             keepalive_expiry=30.0, http2=False, timeout=60.0,
+                             connect_timeout=10.0, base_urls=None, hedge=False):
+    """初始化异步OpenAI客户端
+
+    配置方式与init_openai_client相同，适用于asyncio环境下的并发调用
+    """
+    pool_args = (max_connections, max_keepalive_connections, keepalive_expiry,
+                 http2, timeout, connect_timeout)
+
+    urls = _resolve_base_urls(base_urls)
+
+    def factory():
+        clients = [
+            AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=url,
+                http_client=get_async_http_client(*pool_args)
+            )
+            for url in urls
+        ]
+        if len(clients) == 1:
+            return clients[0]
+        return AsyncEndpointRouter(clients, hedge=hedge)
+
+    return _get_or_create(("async_openai", urls, hedge), factory, *pool_args)
+
+def get_pool_stats(client):
+    """查看客户端底层连接池的统计信息
+
+    Args:
+        client: OpenAI/AsyncOpenAI客户端实例，或httpx客户端
+
+    Returns:
+        包含连接数、空闲连接数、累计请求数等信息的字典
+    """
+    http_client = getattr(client, "_client", client)
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for conn in connections if conn.is_idle())
+    counter = getattr(http_client, "_request_counter", {"requests": 0})
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "requests": counter["requests"],
+        **getattr(http_client, "_pool_config", {}),
+    }
+
+def create_chat_model(**kwargs):
+    """创建LangChain的ChatOpenAI实例，与本模块的对话函数共用同一个连接池和限流调度器
+
+    LangChain示例都应通过它创建ChatOpenAI，而不是各自新建客户端；
+    kwargs原样传给ChatOpenAI，未指定base_url时使用OPENAI_BASE_URL中的第一个端点。
+    还没有设置限流调度器时，按OPENAI_RPM/OPENAI_TPM创建一个并注册为全局调度器，
+    之后同一进程中的所有ChatOpenAI和对话函数共享同一份额度
+    """
+    from langchain_openai import ChatOpenAI
+
+    kwargs.setdefault("http_client", get_http_client())
+    kwargs.setdefault("base_url", _resolve_base_urls(None)[0])
+    if "rate_limiter" not in kwargs:
+        with _client_lock:
+            if _rate_limit_scheduler is None:
+                set_rate_limit_scheduler(RateLimitScheduler(
+                    requests_per_minute=int(os.getenv("OPENAI_RPM", "500")),
+                    tokens_per_minute=int(os.getenv("OPENAI_TPM", "200000"))
+                ))
+            kwargs["rate_limiter"] = _rate_limit_scheduler.as_langchain_rate_limiter()
+    return ChatOpenAI(**kwargs)
+
+def close_openai_clients():
+    """关闭并清空所有共享客户端（同步部分），通常在进程退出前调用"""
+    with _client_lock:
+        for key, client in list(_client_cache.items()):
+            if key[0] == "http" or isinstance(client, EndpointRouter):
+                client.close()
+        _client_cache.clear()
+
+# 所有对话函数共享的限流调度器，为None时不限流
+_rate_limit_scheduler = None
+
+def set_rate_limit_scheduler(scheduler):
+    """设置全局共享的RateLimitScheduler，之后本模块中所有对话请求都经过它排队
+
+    Args:
+        scheduler: RateLimitScheduler实例，传入None关闭限流
+    """
+    global _rate_limit_scheduler
+    _rate_limit_scheduler = scheduler
+
+def get_rate_limit_scheduler():
+    """获取当前共享的限流调度器"""
+    return _rate_limit_scheduler
+
+# 请求结束时接收指标事件的钩子，为None时不统计
+_metrics_hook = None
+
+def set_metrics_hook(hook):
+    """设置指标钩子，例如ChatMetrics实例
+
+    钩子是一个可调用对象，每次请求结束时收到一个事件字典，包含model、latency、ttft、
+    prompt_tokens、completion_tokens、retries、error、stream
+
+    Args:
+        hook: 可调用对象，传入None关闭统计
+    """
+    global _metrics_hook
+    _metrics_hook = hook
+
+def _emit_metrics(model, start, retries, usage=None, ttft=None, completion_tokens=None,
+                  error=None, stream=False):
+    """向指标钩子发送一次请求事件，钩子自身的异常不影响对话"""
+    if _metrics_hook is None:
+        return
+    event = {
+        "model": model,
+        "latency": time.perf_counter() - start,
+        "ttft": ttft,
+        "prompt_tokens": usage.prompt_tokens if usage is not None else None,
+        "completion_tokens": completion_tokens if usage is None else usage.completion_tokens,
+        "retries": retries,
+        "error": error,
+        "stream": stream,
+    }
+    try:
+        _metrics_hook(event)
+    except Exception as e:
+        print(f"指标钩子执行出错: {str(e)}")
+
+def _create_completion(client, **kwargs):
+    """发起chat.completions请求，设置了调度器时由调度器控制速率和重试
+
+    设置了调度器时关闭客户端自带的重试，否则SDK的重试会绕过调度器的额度、429暂停和并发调整。
+    非流式请求在这里上报指标，流式请求由调用方在流结束时上报
+
+    Returns:
+        (响应对象, 重试次数)
+    """
+    attempts = []
+
+    def create(**params):
+        attempts.append(1)
+        return client.chat.completions.create(**params)
+
+    start = time.perf_counter()
+    stream = kwargs.get("stream", False)
+    try:
+        if _rate_limit_scheduler is None:
+            response = create(**kwargs)
+        else:
+            client = client.with_options(max_retries=0)
+            response = _rate_limit_scheduler.call(create, **kwargs)
+    except Exception as e:
+        _emit_metrics(kwargs["model"], start, len(attempts) - 1, error=e, stream=stream)
+        raise
+    if not stream:
+        _emit_metrics(kwargs["model"], start, len(attempts) - 1, usage=response.usage)
+    return response, len(attempts) - 1
 
-def simple_chat(client, user_message, model=None, temperature=0.7):
+async def _acreate_completion(client, **kwargs):
+    """_create_completion的异步版本"""
+    attempts = []
+
+    async def create(**params):
+        attempts.append(1)
+        return await client.chat.completions.create(**params)
+
+    start = time.perf_counter()
+    stream = kwargs.get("stream", False)
+    try:
+        if _rate_limit_scheduler is None:
+            response = await create(**kwargs)
+        else:
+            client = client.with_options(max_retries=0)
+            response = await _rate_limit_scheduler.acall(create, **kwargs)
+    except Exception as e:
+        _emit_metrics(kwargs["model"], start, len(attempts) - 1, error=e, stream=stream)
+        raise
+    if not stream:
+        _emit_metrics(kwargs["model"], start, len(attempts) - 1, usage=response.usage)
+    return response, len(attempts) - 1
+
+def _apply_context_budget(messages, model, max_context_tokens):
+    """按token预算裁剪消息历史，必要时把普通列表包装为TokenCountedMessages"""
+    if max_context_tokens is None:
+        return messages
+    if not isinstance(messages, TokenCountedMessages):
+        messages = TokenCountedMessages(messages, model)
+    messages.trim(max_context_tokens)
+    return messages
+
+def simple_chat(client, user_message, model=None, temperature=0.7, cache=None,
+                semantic_cache=None):
     """简单的对话函数
     
     Args:
@@ -25,25 +343,148 @@ def simple_chat(client, user_message, model=None, temperature=0.7):
         user_message: 用户输入的消息
         model: 使用的模型名称，如果为None则从环境变量读取
         temperature: 温度参数，控制响应的随机性
+        cache: 可选的ResponseCache实例，相同请求直接返回磁盘上的缓存结果
+        semantic_cache: 可选的SemanticCache实例，意思相近的问题直接复用之前的回答；
+            向量化失败时跳过缓存，照常请求API
     
     Returns:
         assistant的回复内容
     """
     try:
         model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-        response = client.chat.completions.create(
+        messages = [
+            {"role": "user", "content": user_message}
+        ]
+        use_cache = cache is not None and cache.cacheable(temperature)
+        if use_cache:
+            key = cache.make_key(model, temperature, messages, str(client.base_url))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        use_semantic_cache = semantic_cache is not None and semantic_cache.cacheable(temperature)
+        vector = None
+        if use_semantic_cache:
+            try:
+                answer, _, vector = semantic_cache.lookup(model, user_message)
+            except Exception as e:
+                print(f"语义缓存查询失败，直接请求API: {str(e)}")
+                answer = None
+            if answer is not None:
+                return answer
+        response, _ = _create_completion(
+            client,
             model=model,
             temperature=temperature,
-            messages=[
-                {"role": "user", "content": user_message}
-            ]
+            messages=messages
         )
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        if use_cache and content is not None:
+            cache.set(key, content)
+        if use_semantic_cache and content is not None:
+            try:
+                semantic_cache.add(model, user_message, content, vector)
+            except Exception as e:
+                print(f"写入语义缓存失败: {str(e)}")
+        return content
     except Exception as e:
         print(f"调用API时发生错误: {str(e)}")
         return None
 
-def chat_with_memory(client, messages, model=None, temperature=0.7):
+def _stream_stats(model, parts, usage, start, first_token_at):
+    """汇总一次流式响应的结果和耗时指标
+
+    服务端没有返回用量时用tiktoken估算completion_tokens；估算失败（例如离线时无法下载编码文件）
+    不影响已经收到的回复，completion_tokens和tokens_per_second记为None
+    """
+    end = time.perf_counter()
+    content = "".join(parts)
+    if usage is not None:
+        completion_tokens = usage.completion_tokens
+    else:
+        try:
+            completion_tokens = len(get_encoding(model).encode(content))
+        except Exception as e:
+            print(f"估算token数失败: {str(e)}")
+            completion_tokens = None
+    ttft = None if first_token_at is None else first_token_at - start
+    generation_time = end - (first_token_at or start)
+    if completion_tokens is None:
+        tokens_per_second = None
+    else:
+        tokens_per_second = completion_tokens / generation_time if generation_time > 0 else 0.0
+    return {
+        "content": content,
+        "ttft": ttft,
+        "latency": end - start,
+        "prompt_tokens": usage.prompt_tokens if usage is not None else None,
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": tokens_per_second,
+    }
+
+def _stream_options(include_usage):
+    """流式请求的额外参数，只在显式开启时才发送stream_options"""
+    return {"stream_options": {"include_usage": True}} if include_usage else {}
+
+def stream_chat(client, messages, model=None, temperature=0.7, on_complete=None,
+                include_usage=False):
+    """流式对话生成器，按到达顺序逐段产出回复内容
+
+    不直接打印，调用方可以把增量内容交给界面、日志等任意消费者。
+    流结束后把结果和指标交给on_complete回调，同时作为生成器的返回值
+    （可通过 result = yield from stream_chat(...) 取得）。
+
+    Args:
+        client: OpenAI客户端实例
+        messages: 消息历史列表
+        model: 使用的模型名称，如果为None则从环境变量读取
+        temperature: 温度参数
+        on_complete: 流结束时调用的回调，参数为包含content、ttft（首token耗时，秒）、
+            latency（总耗时，秒）、prompt_tokens、completion_tokens、tokens_per_second的字典
+        include_usage: 是否请求服务端在最后一个chunk中返回token用量（stream_options）；
+            不少OpenAI兼容网关不支持该参数，默认关闭，completion_tokens用tiktoken估算
+            （估算失败时与tokens_per_second一起为None），prompt_tokens为None
+
+    Yields:
+        回复内容的增量片段
+    """
+    model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    start = time.perf_counter()
+    first_token_at = None
+    usage = None
+    parts = []
+
+    response, retries = _create_completion(
+        client,
+        model=model,
+        temperature=temperature,
+        messages=messages,
+        stream=True,
+        **_stream_options(include_usage)
+    )
+    try:
+        for chunk in response:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                content = chunk.choices[0].delta.content
+                parts.append(content)
+                yield content
+    except Exception as e:
+        _emit_metrics(model, start, retries, error=e, stream=True)
+        raise
+    finally:
+        # 调用方提前停止迭代时也要释放连接
+        response.close()
+
+    stats = _stream_stats(model, parts, usage, start, first_token_at)
+    _emit_metrics(model, start, retries, usage, stats["ttft"], stats["completion_tokens"], stream=True)
+    if on_complete is not None:
+        on_complete(stats)
+    return stats
+
+def chat_with_memory(client, messages, model=None, temperature=0.7, max_context_tokens=None):
     """带上下文记忆的对话函数
     
     Args:
@@ -51,37 +492,30 @@ def chat_with_memory(client, messages, model=None, temperature=0.7):
         messages: 消息历史列表
         model: 使用的模型名称，如果为None则从环境变量读取
         temperature: 温度参数
+        max_context_tokens: 发送给模型的历史token上限，超出时淘汰最早的非system对话；
+            为None时发送完整历史
     
     Returns:
         assistant的回复内容和更新后的消息历史
     """
     try:
         model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-        response = client.chat.completions.create(
-            model=model,
-            temperature=temperature,
-            messages=messages,
-            stream=True  # 启用流式响应
-        )
-        
-        # 用于存储完整的响应文本
-        full_response = ""
-        
-        # 逐个处理流式响应的内容
-        for chunk in response:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                print(content, end='', flush=True)  # 实时打印内容
-                full_response += content
+        messages = _apply_context_budget(messages, model, max_context_tokens)
+        # 逐个处理流式响应的内容，完整文本由stream_chat拼接
+        stats = {}
+        for content in stream_chat(client, messages, model, temperature, on_complete=stats.update):
+            print(content, end='', flush=True)  # 实时打印内容
         
         print()  # 打印换行
+        full_response = stats["content"]
         messages.append({"role": "assistant", "content": full_response})
         return full_response, messages
     except Exception as e:
         print(f"\n调用API时发生错误: {str(e)}")
         return None, messages
 
-def interactive_chat(client, system_message=None, model=None, temperature=0.7):
+def interactive_chat(client, system_message=None, model=None, temperature=0.7,
+                     max_context_tokens=None, semantic_cache=None, log=None):
     """交互式对话函数
     
     Args:
@@ -89,10 +523,29 @@ def interactive_chat(client, system_message=None, model=None, temperature=0.7):
         system_message: 系统提示信息，用于设置AI助手的角色和行为
         model: 使用的模型名称，如果为None则从环境变量读取
         temperature: 温度参数
+        max_context_tokens: 历史token上限，长对话中会自动淘汰最早的对话轮次
+        semantic_cache: 可选的SemanticCache实例，用于对话的第一个问题；
+            后续问题依赖上下文，不使用语义缓存
+        log: 可选的ConversationLog实例，对话会持久化到日志中；
+            日志中已有历史时，只加载token预算内的最近对话继续聊
     """
-    messages = []
-    if system_message:
-        messages.append({"role": "system", "content": system_message})
+    model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    if log is not None and len(log):
+        saved, token_counts = log.load_tail(max_context_tokens)
+        if max_context_tokens is None:
+            messages = saved
+        else:
+            messages = TokenCountedMessages.from_counts(saved, token_counts, model)
+        print(f"已从日志恢复{len(messages)}条消息（共{len(log)}条）")
+    else:
+        messages = [] if max_context_tokens is None else TokenCountedMessages(model=model)
+        if system_message:
+            messages.append({"role": "system", "content": system_message})
+            if log is not None:
+                log.append(messages[-1])
+    # 同一模型、不同system提示下的回答不能混用
+    namespace = (model, system_message)
+    has_context = any(m.get("role") != "system" for m in messages)
     
     print("=== 开始交互式对话 ===")
     print('输入问题开始对话，直接按回车键结束对话')
@@ -104,16 +557,186 @@ def interactive_chat(client, system_message=None, model=None, temperature=0.7):
             break
         
         messages.append({"role": "user", "content": user_input})
-        response, messages = chat_with_memory(client, messages, model, temperature)
+        vector = None
+        if semantic_cache is not None and semantic_cache.cacheable(temperature) and not has_context:
+            try:
+                answer, similarity, vector = semantic_cache.lookup(namespace, user_input)
+            except Exception as e:
+                print(f"语义缓存查询失败，直接请求API: {str(e)}")
+                answer = None
+            if answer is not None:
+                messages.append({"role": "assistant", "content": answer})
+                if log is not None:
+                    log.extend(messages[-2:])
+                has_context = True
+                print(f"\nAI（缓存命中，相似度{similarity:.2f}）: {answer}")
+                continue
+        response, messages = chat_with_memory(
+            client, messages, model, temperature, max_context_tokens
+        )
         
         if response:
+            if vector is not None:
+                try:
+                    semantic_cache.add(namespace, user_input, response, vector)
+                except Exception as e:
+                    print(f"写入语义缓存失败: {str(e)}")
+            if log is not None:
+                # 本轮成功后再写入日志，失败的问题不会在恢复时出现
+                log.extend(messages[-2:])
+            has_context = True
             print(f"\nAI: {response}")
         else:
             print("\nAI: 抱歉，处理您的问题时出现错误。")
             break
 
+async def asimple_chat(client, user_message, model=None, temperature=0.7, cache=None):
+    """simple_chat的异步版本
+
+    Args:
+        client: AsyncOpenAI客户端实例
+        user_message: 用户输入的消息
+        model: 使用的模型名称，如果为None则从环境变量读取
+        temperature: 温度参数，控制响应的随机性
+        cache: 可选的ResponseCache实例，相同请求直接返回磁盘上的缓存结果；
+            SQLite读写在线程池中进行，不阻塞事件循环
+
+    Returns:
+        assistant的回复内容
+    """
+    try:
+        model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        messages = [
+            {"role": "user", "content": user_message}
+        ]
+        use_cache = cache is not None and cache.cacheable(temperature)
+        if use_cache:
+            key = cache.make_key(model, temperature, messages, str(client.base_url))
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                return cached
+        response, _ = await _acreate_completion(
+            client,
+            model=model,
+            temperature=temperature,
+            messages=messages
+        )
+        content = response.choices[0].message.content
+        if use_cache and content is not None:
+            await asyncio.to_thread(cache.set, key, content)
+        return content
+    except Exception as e:
+        print(f"调用API时发生错误: {str(e)}")
+        return None
+
+async def astream_chat(client, messages, model=None, temperature=0.7, on_complete=None,
+                       include_usage=False):
+    """stream_chat的异步版本，是一个异步生成器
+
+    异步生成器没有返回值，结果和指标只通过on_complete回调给出
+
+    Args:
+        client: AsyncOpenAI客户端实例
+        messages: 消息历史列表
+        model: 使用的模型名称，如果为None则从环境变量读取
+        temperature: 温度参数
+        on_complete: 流结束时调用的回调，参数与stream_chat相同
+        include_usage: 是否请求服务端返回token用量，与stream_chat相同
+
+    Yields:
+        回复内容的增量片段
+    """
+    model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    start = time.perf_counter()
+    first_token_at = None
+    usage = None
+    parts = []
+
+    response, retries = await _acreate_completion(
+        client,
+        model=model,
+        temperature=temperature,
+        messages=messages,
+        stream=True,
+        **_stream_options(include_usage)
+    )
+    try:
+        async for chunk in response:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                content = chunk.choices[0].delta.content
+                parts.append(content)
+                yield content
+    except Exception as e:
+        _emit_metrics(model, start, retries, error=e, stream=True)
+        raise
+    finally:
+        await response.close()
+
+    stats = _stream_stats(model, parts, usage, start, first_token_at)
+    _emit_metrics(model, start, retries, usage, stats["ttft"], stats["completion_tokens"], stream=True)
+    if on_complete is not None:
+        on_complete(stats)
+
+async def achat_with_memory(client, messages, model=None, temperature=0.7, max_context_tokens=None):
+    """chat_with_memory的异步版本
+
+    Args:
+        client: AsyncOpenAI客户端实例
+        messages: 消息历史列表
+        model: 使用的模型名称，如果为None则从环境变量读取
+        temperature: 温度参数
+        max_context_tokens: 发送给模型的历史token上限，超出时淘汰最早的非system对话；
+            为None时发送完整历史
+
+    Returns:
+        assistant的回复内容和更新后的消息历史
+    """
+    try:
+        model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        messages = _apply_context_budget(messages, model, max_context_tokens)
+        stats = {}
+        async for content in astream_chat(client, messages, model, temperature, on_complete=stats.update):
+            print(content, end='', flush=True)
+
+        print()
+        full_response = stats["content"]
+        messages.append({"role": "assistant", "content": full_response})
+        return full_response, messages
+    except Exception as e:
+        print(f"\n调用API时发生错误: {str(e)}")
+        return None, messages
+
+async def chat_many(client, prompts, model=None, temperature=0.7, max_concurrency=8,
+                    cache=None):
+    """并发处理一批相互独立的提示
+
+    使用信号量限制同时进行的请求数，结果按输入顺序返回
+
+    Args:
+        client: AsyncOpenAI客户端实例
+        prompts: 用户消息列表
+        model: 使用的模型名称，如果为None则从环境变量读取
+        temperature: 温度参数
+        max_concurrency: 最大并发请求数
+        cache: 可选的ResponseCache实例，重跑相同的批量任务时直接命中缓存
+
+    Returns:
+        与prompts一一对应的回复列表，失败的请求对应None
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def worker(prompt):
+        async with semaphore:
+            return await asimple_chat(client, prompt, model, temperature, cache)
+
+    return await asyncio.gather(*(worker(prompt) for prompt in prompts))
+
 def main():
-    # 初始化客户端
+    # 初始化客户端（进程内共享连接池）
     client = init_openai_client()
     
     # # 简单对话示例
@@ -136,8 +759,67 @@ def main():
     # response, messages = chat_with_memory(client, messages)
     # print(f"AI: {response}\n")
     
+    # # 带磁盘缓存的对话示例：temperature=0时相同问题第二次直接命中缓存
+    # print("=== 响应缓存示例 ===")
+    # from response_cache import ResponseCache
+    # cache = ResponseCache("chat_cache.sqlite3", max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600)
+    # for _ in range(2):
+    #     print(simple_chat(client, "1+1等于几？", temperature=0, cache=cache))
+    # print(f"缓存统计: {cache.stats()}")
+
+    # # 语义缓存示例：换一种问法也能命中之前的回答
+    # print("=== 语义缓存示例 ===")
+    # from semantic_cache import SemanticCache, openai_embedder
+    # semantic_cache = SemanticCache(openai_embedder(client), threshold=0.92)
+    # print(simple_chat(client, "Python的GIL是什么？", temperature=0, semantic_cache=semantic_cache))
+    # print(simple_chat(client, "能解释一下Python里的GIL吗？", temperature=0, semantic_cache=semantic_cache))
+    # print(f"语义缓存统计: {semantic_cache.stats()}")
+
+    # # 限流调度示例：所有对话请求共享RPM/TPM额度，遇到429自动退避
+    # set_rate_limit_scheduler(RateLimitScheduler(requests_per_minute=60, tokens_per_minute=40000))
+    # print(simple_chat(client, "你好"))
+    # print(f"调度器状态: {get_rate_limit_scheduler().snapshot()}")
+
+    # # 指标统计示例：记录每个模型的延迟分布、首token耗时和token用量
+    # from metrics import ChatMetrics
+    # metrics = ChatMetrics()
+    # set_metrics_hook(metrics)
+    # metrics.start_json_reporter("chat_metrics.jsonl", interval=60)
+    # simple_chat(client, "你好")
+    # print(metrics.to_prometheus())
+
+    # # 多端点路由示例：按延迟选择端点，出错自动切换，慢请求触发对冲
+    # router = init_openai_client(
+    #     base_urls=["https://gateway-a.example.com/v1", "https://gateway-b.example.com/v1"],
+    #     hedge=True
+    # )
+    # print(simple_chat(router, "你好"))
+    # print(f"端点状态: {router.stats()}")
+
+    # # 流式对话示例：由调用方决定如何消费增量内容
+    # print("=== 流式对话示例 ===")
+    # stream_messages = [{"role": "user", "content": "用三句话介绍Python"}]
+    # for delta in stream_chat(client, stream_messages, include_usage=True, on_complete=lambda stats: print(
+    #         f"\n首token耗时: {stats['ttft']:.3f}s, 总耗时: {stats['latency']:.3f}s, "
+    #         f"速度: {stats['tokens_per_second']:.1f} tokens/s")):
+    #     print(delta, end='', flush=True)
+
+    # # 并发批量对话示例
+    # print("=== 并发批量对话示例 ===")
+    # async_client = init_async_openai_client()
+    # prompts = ["什么是Python？", "什么是asyncio？", "什么是信号量？"]
+    # results = asyncio.run(chat_many(async_client, prompts, max_concurrency=2))
+    # for prompt, result in zip(prompts, results):
+    #     print(f"用户: {prompt}\nAI: {result}\n")
+
+    # # 持久化对话示例：退出后再次运行会从日志末尾恢复最近的对话
+    # from conversation_log import ConversationLog
+    # with ConversationLog("chat_logs/default") as log:
+    #     interactive_chat(client, "你是一个友好的AI助手。", max_context_tokens=3000, log=log)
+
     # 交互式对话示例
-    interactive_chat(client, "你是一个友好的AI助手，擅长解释各种问题。")
+    interactive_chat(client, "你是一个友好的AI助手，擅长解释各种问题。", max_context_tokens=3000)
+    print(f"连接池统计: {get_pool_stats(client)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
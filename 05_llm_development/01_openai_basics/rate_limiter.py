@@ -0,0 +1,271 @@
+"""
+客户端限流调度器
+
+在请求发出之前按额度排队，而不是等服务端返回429后再处理：
+1. 两个令牌桶分别限制每分钟请求数（RPM）和每分钟token数（TPM），请求token数用tiktoken估算
+2. 收到429时遵守Retry-After，所有请求一起暂停，避免错误风暴
+3. 并发数按AIMD调整：遇到429减半，连续成功时缓慢增加，逐步逼近额度允许的最大吞吐
+
+同一个调度器可以在同步和异步代码中共享。经调度器发出的请求要关闭OpenAI客户端自带的重试
+（client.with_options(max_retries=0)），由调度器统一处理重试。
+"""
+
+from email.utils import parsedate_to_datetime
+from chat_history import count_message_tokens, REPLY_PRIMING_TOKENS
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，允许一定的突发量"""
+
+    def __init__(self, rate_per_minute, burst_seconds=10.0):
+        """
+        Args:
+            rate_per_minute: 每分钟补充的令牌数
+            burst_seconds: 桶容量相当于多少秒的补充量
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, amount, now):
+        """尝试取出amount个令牌
+
+        超过桶容量的大请求在桶满时放行，余额变为负数，由之后的请求偿还
+
+        Returns:
+            0表示成功，否则为还需要等待的秒数
+        """
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            self.level -= amount
+            return 0.0
+        return (needed - self.level) / self.rate
+
+def _retry_after_seconds(error):
+    """从429错误的响应头中解析Retry-After"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def _is_rate_limit_error(error):
+    return getattr(error, "status_code", None) == 429
+
+class RateLimitScheduler:
+    """按RPM/TPM额度调度请求，并根据429自适应调整并发数"""
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200000,
+                 max_concurrency=64, min_concurrency=1, initial_concurrency=8,
+                 max_retries=5, default_backoff=1.0, model="gpt-3.5-turbo",
+                 default_completion_tokens=256):
+        """
+        Args:
+            requests_per_minute: 每分钟请求数上限
+            tokens_per_minute: 每分钟token数上限
+            max_concurrency: 并发数上限
+            min_concurrency: 并发数下限
+            initial_concurrency: 初始并发数
+            max_retries: 遇到429时的最大重试次数
+            default_backoff: 没有Retry-After时的初始退避时间（秒），每次重试翻倍
+            model: 估算token数时使用的模型
+            default_completion_tokens: 请求未设置max_tokens时为回复预留的token数
+        """
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.max_retries = max_retries
+        self.default_backoff = default_backoff
+        self.model = model
+        self.default_completion_tokens = default_completion_tokens
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease_at = 0.0
+        self.stats = {"requests": 0, "rate_limited": 0, "retries": 0}
+        self._lock = threading.Lock()
+        self._slot_released = threading.Condition(self._lock)
+
+    def estimate_tokens(self, messages=(), max_tokens=None):
+        """估算一次请求会消耗的token数：提示部分加上为回复预留的部分"""
+        prompt_tokens = sum(count_message_tokens(m, self.model) for m in messages)
+        return prompt_tokens + REPLY_PRIMING_TOKENS + (max_tokens or self.default_completion_tokens)
+
+    def _try_admit(self, tokens):
+        """尝试获得一个并发名额和对应的RPM/TPM额度，调用方需持有锁
+
+        Returns:
+            0表示已获得，否则为建议的等待秒数
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.concurrency_limit):
+            return None  # 等待其他请求释放名额
+        wait = self.request_bucket.try_take(1, now)
+        if wait:
+            return wait
+        wait = self.token_bucket.try_take(tokens, now)
+        if wait:
+            self.request_bucket.level += 1  # 退还已取出的请求令牌
+            return wait
+        self.in_flight += 1
+        self.stats["requests"] += 1
+        return 0.0
+
+    def try_acquire(self, tokens):
+        """不等待地尝试获得发出请求的额度
+
+        Returns:
+            是否已获得；获得后需要调用release归还
+        """
+        with self._lock:
+            return self._try_admit(tokens) == 0.0
+
+    def acquire(self, tokens):
+        """阻塞直到可以发出请求"""
+        with self._slot_released:
+            while True:
+                wait = self._try_admit(tokens)
+                if wait == 0.0:
+                    return
+                self._slot_released.wait(timeout=wait)
+
+    async def aacquire(self, tokens):
+        """acquire的异步版本，等待期间不阻塞事件循环"""
+        while True:
+            with self._lock:
+                wait = self._try_admit(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(0.01 if wait is None else wait)
+
+    def release(self, error=None, adjust=True):
+        """请求结束后归还并发名额，并根据结果调整并发上限
+
+        Args:
+            error: 请求失败时的异常，成功时为None
+            adjust: 是否根据本次结果调整并发上限
+        """
+        with self._slot_released:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if error is not None and _is_rate_limit_error(error):
+                self.stats["rate_limited"] += 1
+                # 同一批并发请求同时收到的429只减半一次
+                if adjust and now - self.last_decrease_at > 1.0:
+                    self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                    self.last_decrease_at = now
+            elif error is None and adjust:
+                self.concurrency_limit = min(
+                    self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit
+                )
+            self._slot_released.notify_all()
+
+    def _backoff(self, error, attempt):
+        """计算重试前的等待时间，并让所有请求一起暂停"""
+        delay = _retry_after_seconds(error)
+        if delay is None:
+            delay = self.default_backoff * (2 ** attempt)
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.stats["retries"] += 1
+        return delay
+
+    def call(self, fn, *args, **kwargs):
+        """在调度器的控制下调用fn，遇到429时按Retry-After重试
+
+        token数根据kwargs中的messages和max_tokens估算。
+        对于流式请求，并发名额在请求建立后即归还。
+        """
+        tokens = self.estimate_tokens(kwargs.get("messages", ()), kwargs.get("max_tokens"))
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.release(e)
+                if not _is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(e, attempt))
+                continue
+            self.release()
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """call的异步版本，fn为返回awaitable的函数"""
+        tokens = self.estimate_tokens(kwargs.get("messages", ()), kwargs.get("max_tokens"))
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(tokens)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self.release(e)
+                if not _is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(e, attempt))
+                continue
+            self.release()
+            return result
+
+    def as_langchain_rate_limiter(self, tokens_per_request=None):
+        """包装为LangChain的BaseRateLimiter，可传给ChatOpenAI(rate_limiter=...)
+
+        LangChain只在请求前调用限流器，因此这里只共享RPM/TPM额度和429暂停状态，
+        不参与并发数调整；每个请求按tokens_per_request估算token数
+        """
+        from langchain_core.rate_limiters import BaseRateLimiter
+
+        scheduler = self
+        tokens = tokens_per_request or self.default_completion_tokens * 2
+
+        class SchedulerRateLimiter(BaseRateLimiter):
+            def acquire(self, *, blocking=True):
+                if not blocking:
+                    if not scheduler.try_acquire(tokens):
+                        return False
+                else:
+                    scheduler.acquire(tokens)
+                scheduler.release(adjust=False)
+                return True
+
+            async def aacquire(self, *, blocking=True):
+                if not blocking:
+                    if not scheduler.try_acquire(tokens):
+                        return False
+                else:
+                    await scheduler.aacquire(tokens)
+                scheduler.release(adjust=False)
+                return True
+
+        return SchedulerRateLimiter()
+
+    def snapshot(self):
+        """返回当前的调度状态"""
+        with self._lock:
+            return {
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "in_flight": self.in_flight,
+                **self.stats,
+            }
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class ResponseCache:
+    """基于SQLite的对话响应缓存（精确匹配）
+
+    以(model, temperature, messages, base_url)的哈希作为键，把模型回复持久化到磁盘，
+    相同请求再次出现时直接返回缓存结果。SQLite开启WAL模式，多个进程可以安全地同时读写。
+
+    淘汰策略：
+    - ttl：条目写入超过ttl秒后视为过期（None表示不过期）
+    - max_bytes：缓存内容总大小超过上限时，按最近访问时间淘汰最久未用的条目（LRU）
+    """
+
+    def __init__(self, path="chat_cache.sqlite3", max_bytes=100 * 1024 * 1024,
+                 ttl=None, deterministic_only=True):
+        """
+        Args:
+            path: SQLite数据库文件路径
+            max_bytes: 缓存内容的总字节数上限
+            ttl: 条目有效期（秒），None表示永不过期
+            deterministic_only: 为True时只缓存temperature为0的请求
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.deterministic_only = deterministic_only
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        """每个线程使用独立的连接，跨进程并发由SQLite的文件锁保证"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    @staticmethod
+    def make_key(model, temperature, messages, base_url=None):
+        """根据请求参数生成缓存键"""
+        payload = json.dumps(
+            {"model": model, "temperature": temperature,
+             "messages": list(messages), "base_url": base_url},
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cacheable(self, temperature):
+        """判断某个temperature下的请求是否应该使用缓存"""
+        return not self.deterministic_only or temperature == 0
+
+    def get(self, key):
+        """读取缓存，命中时返回回复文本，否则返回None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._bump(conn, "misses")
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self._bump(conn, "hits")
+            return row[0]
+
+    def set(self, key, value):
+        """写入缓存，并在超出容量时按LRU淘汰"""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        if self.ttl is not None:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    @staticmethod
+    def _bump(conn, name):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def stats(self):
+        """返回缓存统计：本进程与所有进程累计的命中/未命中次数、条目数和占用字节数"""
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "total_hits": counters.get("hits", 0),
+            "total_misses": counters.get("misses", 0),
+            "entries": entries,
+            "bytes": total,
+        }
+
+    def clear(self):
+        """清空缓存内容和计数"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("DELETE FROM counters")
+        self.hits = 0
+        self.misses = 0
+
+class _Transaction:
+    """把一组语句包在BEGIN IMMEDIATE事务中，避免多进程写入时的读写升级死锁"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
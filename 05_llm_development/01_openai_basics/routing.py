@@ -0,0 +1,410 @@
+"""
+多端点路由与对冲请求
+
+把多个OpenAI兼容端点包装成一个"客户端"，对话函数无需修改即可使用：
+1. 路由：按每个端点观测到的延迟（EWMA）排序，优先使用最快的端点
+2. 故障转移：遇到连接错误、超时、429或5xx时换下一个端点重试，出错的端点进入冷却期
+3. 对冲（可选）：首选端点在其p95延迟内还没有返回首个token（非流式请求为完整响应）时，
+   向第二个端点再发一次请求，先返回的胜出，较慢的一个被取消
+
+同步路由器的对冲请求在线程池中执行，用完后调用close()或使用with语句释放线程池；
+with_options得到的路由器与原路由器共用同一个线程池
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+import asyncio
+import threading
+import time
+import openai
+
+def is_retryable_error(error):
+    """判断错误是否值得换一个端点重试"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+class Endpoint:
+    """单个端点的客户端和延迟统计"""
+
+    def __init__(self, client, window=200):
+        self.client = client
+        self.base_url = str(client.base_url)
+        # 流式请求记录首token耗时，非流式请求记录完整延迟，两者分开统计
+        self.ewma = {"stream": None, "complete": None}
+        self.samples = {"stream": deque(maxlen=window), "complete": deque(maxlen=window)}
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.hedged_wins = 0
+
+class _RouterBase:
+    def __init__(self, clients, alpha=0.2, hedge=False, hedge_quantile=0.95,
+                 min_hedge_samples=20, default_hedge_delay=2.0, min_hedge_delay=0.05,
+                 cooldown=5.0, max_cooldown=120.0):
+        """
+        Args:
+            clients: 各端点的客户端实例
+            alpha: EWMA的平滑系数，越大越看重最近的延迟
+            hedge: 是否启用对冲请求
+            hedge_quantile: 触发对冲的延迟分位数
+            min_hedge_samples: 样本数少于该值时使用default_hedge_delay
+            default_hedge_delay: 样本不足时的对冲等待时间（秒）
+            min_hedge_delay: 对冲等待时间的下限（秒）
+            cooldown: 端点出错后的初始冷却时间（秒），连续出错时翻倍
+            max_cooldown: 冷却时间上限（秒）
+        """
+        if not clients:
+            raise ValueError("至少需要一个端点")
+        self.endpoints = [Endpoint(client) for client in clients]
+        self.alpha = alpha
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_samples = min_hedge_samples
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._options = dict(alpha=alpha, hedge=hedge, hedge_quantile=hedge_quantile,
+                             min_hedge_samples=min_hedge_samples,
+                             default_hedge_delay=default_hedge_delay,
+                             min_hedge_delay=min_hedge_delay, cooldown=cooldown,
+                             max_cooldown=max_cooldown)
+        self._lock = threading.Lock()
+        # 让router.chat.completions.create(...)与OpenAI客户端的用法一致
+        self.chat = SimpleNamespace(completions=self)
+
+    @property
+    def base_url(self):
+        return self.endpoints[0].client.base_url
+
+    @property
+    def _client(self):
+        """底层的httpx客户端（各端点共享同一个连接池），供get_pool_stats使用"""
+        return self.endpoints[0].client._client
+
+    def __getattr__(self, name):
+        """embeddings、files、batches等其他接口固定使用第一个端点"""
+        if name == "endpoints":
+            raise AttributeError(name)
+        return getattr(self.endpoints[0].client, name)
+
+    def with_options(self, **options):
+        """返回一个所有端点都应用了options的新路由器"""
+        return type(self)([e.client.with_options(**options) for e in self.endpoints], **self._options)
+
+    def close(self):
+        """释放路由器自己持有的资源，端点客户端由调用方管理"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ranked(self, kind):
+        """按可用性和EWMA延迟排序端点：未测量过的端点优先探测，冷却中的端点排在最后"""
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                self.endpoints,
+                key=lambda e: (e.cooldown_until > now, e.ewma[kind] if e.ewma[kind] is not None else 0.0)
+            )
+
+    def record_success(self, endpoint, kind, elapsed):
+        with self._lock:
+            previous = endpoint.ewma[kind]
+            endpoint.ewma[kind] = elapsed if previous is None else (
+                self.alpha * elapsed + (1 - self.alpha) * previous
+            )
+            endpoint.samples[kind].append(elapsed)
+            endpoint.failures = 0
+            endpoint.cooldown_until = 0.0
+            endpoint.requests += 1
+
+    def record_censored(self, endpoint, kind, elapsed):
+        """记录对冲中被放弃的请求：只知道它至少需要elapsed秒，比当前估计慢时才更新延迟统计
+
+        否则首选端点变慢后一直输给备用端点，延迟统计却停留在变慢之前，路由永远不会避开它
+        """
+        with self._lock:
+            previous = endpoint.ewma[kind]
+            if previous is None or elapsed > previous:
+                endpoint.ewma[kind] = elapsed if previous is None else (
+                    self.alpha * elapsed + (1 - self.alpha) * previous
+                )
+                endpoint.samples[kind].append(elapsed)
+            endpoint.requests += 1
+
+    def _record_losers(self, losers, started, kind):
+        """记录对冲中没有胜出的请求：已完成的按实际结果记录，未完成的按已等待的时间记录"""
+        now = time.perf_counter()
+        for future, endpoint in losers:
+            if not future.done() or future.cancelled():
+                self.record_censored(endpoint, kind, now - started[endpoint])
+            elif future.exception() is None:
+                self.record_success(endpoint, kind, future.result()[2])
+            else:
+                self.record_failure(endpoint)
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.requests += 1
+            delay = min(self.max_cooldown, self.cooldown * 2 ** (endpoint.failures - 1))
+            endpoint.cooldown_until = time.monotonic() + delay
+
+    def hedge_delay(self, endpoint, kind):
+        """对冲等待时间：首选端点最近延迟的p95"""
+        with self._lock:
+            samples = sorted(endpoint.samples[kind])
+        if len(samples) < self.min_hedge_samples:
+            return self.default_hedge_delay
+        index = min(len(samples) - 1, int(self.hedge_quantile * len(samples)))
+        return max(self.min_hedge_delay, samples[index])
+
+    def stats(self):
+        """各端点的延迟和健康状况"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "base_url": e.base_url,
+                    "ewma_ttft": e.ewma["stream"],
+                    "ewma_latency": e.ewma["complete"],
+                    "requests": e.requests,
+                    "failures": e.failures,
+                    "cooling_down": e.cooldown_until > now,
+                    "hedged_wins": e.hedged_wins,
+                }
+                for e in self.endpoints
+            ]
+
+class EndpointRouter(_RouterBase):
+    """同步OpenAI客户端的多端点路由器"""
+
+    def __init__(self, clients, max_hedge_workers=64, executor=None, **options):
+        """
+        Args:
+            max_hedge_workers: 对冲请求线程池的大小
+            executor: 共用的线程池，由创建它的路由器负责关闭
+            其余参数见_RouterBase
+        """
+        super().__init__(clients, **options)
+        self._owns_executor = executor is None and self.hedge
+        if executor is None and self.hedge:
+            executor = ThreadPoolExecutor(max_workers=max_hedge_workers)
+        self._executor = executor
+
+    def with_options(self, **options):
+        """返回一个所有端点都应用了options的新路由器，与当前路由器共用线程池"""
+        return type(self)([e.client.with_options(**options) for e in self.endpoints],
+                          executor=self._executor, **self._options)
+
+    def close(self):
+        """关闭对冲请求的线程池，不等待仍在进行的请求"""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    def _attempt(self, endpoint, kwargs):
+        """向一个端点发起请求；流式请求会等到第一个chunk到达再返回"""
+        start = time.perf_counter()
+        response = endpoint.client.chat.completions.create(**kwargs)
+        if not kwargs.get("stream"):
+            return response, None, time.perf_counter() - start
+        iterator = iter(response)
+        first = next(iterator, None)
+        return response, (first, iterator), time.perf_counter() - start
+
+    def _hedged_attempt(self, primary, backup, kwargs, kind, tried):
+        """先请求primary，超过p95仍未返回时再请求backup，取先成功的结果
+
+        实际发出请求的端点会追加到tried中；全部失败时抛出最后一个错误
+        """
+        started = {primary: time.perf_counter()}
+        futures = {self._executor.submit(self._attempt, primary, kwargs): primary}
+        done, _ = wait(futures, timeout=self.hedge_delay(primary, kind))
+        if not done:
+            started[backup] = time.perf_counter()
+            futures[self._executor.submit(self._attempt, backup, kwargs)] = backup
+            tried.append(backup)
+        pending = set(futures)
+        failed, error = set(), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed.add(future)
+                    error = e
+                    continue
+                losers = (done | pending) - {future} - failed
+                self._record_losers([(loser, futures[loser]) for loser in losers], started, kind)
+                # 两个请求可能同时完成，没有胜出的响应也要关闭；
+                # 较慢的请求无法中途打断，等它返回后立即关闭连接
+                for loser in losers:
+                    loser.add_done_callback(_close_when_done)
+                for failure in failed:
+                    self.record_failure(futures[failure])
+                winner = futures[future]
+                if len(futures) > 1:
+                    winner.hedged_wins += 1
+                return winner, result
+        raise error
+
+    def create(self, **kwargs):
+        """与client.chat.completions.create相同的调用方式"""
+        kind = "stream" if kwargs.get("stream") else "complete"
+        candidates = self.ranked(kind)
+        error = None
+        while candidates:
+            endpoint = candidates.pop(0)
+            tried = [endpoint]
+            try:
+                if self.hedge and candidates:
+                    endpoint, (response, head, elapsed) = self._hedged_attempt(
+                        endpoint, candidates[0], kwargs, kind, tried
+                    )
+                else:
+                    response, head, elapsed = self._attempt(endpoint, kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                for failed in tried:
+                    self.record_failure(failed)
+                candidates = [c for c in candidates if c not in tried]
+                error = e
+                continue
+            self.record_success(endpoint, kind, elapsed)
+            if head is None:
+                return response
+            return _ResumedStream(response, *head)
+        raise error
+
+def _close_when_done(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result()[0], "close", None)
+    if close is not None:
+        close()
+
+def _aclose_when_done(task):
+    if task.cancelled() or task.exception() is not None:
+        return
+    close = getattr(task.result()[0], "close", None)
+    if close is not None:
+        asyncio.ensure_future(close())
+
+class _ResumedStream:
+    """把已经读出的第一个chunk接回流的开头"""
+
+    def __init__(self, response, first, iterator):
+        self.response = response
+        self.first = first
+        self.iterator = iterator
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+        yield from self.iterator
+
+    def close(self):
+        self.response.close()
+
+class AsyncEndpointRouter(_RouterBase):
+    """异步OpenAI客户端的多端点路由器，对冲时会真正取消较慢的请求"""
+
+    async def _attempt(self, endpoint, kwargs):
+        start = time.perf_counter()
+        response = await endpoint.client.chat.completions.create(**kwargs)
+        if not kwargs.get("stream"):
+            return response, None, time.perf_counter() - start
+        iterator = response.__aiter__()
+        try:
+            first = await iterator.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await response.close()
+            raise
+        return response, (first, iterator), time.perf_counter() - start
+
+    async def _hedged_attempt(self, primary, backup, kwargs, kind, tried):
+        started = {primary: time.perf_counter()}
+        tasks = {asyncio.ensure_future(self._attempt(primary, kwargs)): primary}
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary, kind))
+        if not done:
+            started[backup] = time.perf_counter()
+            tasks[asyncio.ensure_future(self._attempt(backup, kwargs))] = backup
+            tried.append(backup)
+        pending = set(tasks)
+        failed, error = set(), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    result = task.result()
+                except Exception as e:
+                    failed.add(task)
+                    error = e
+                    continue
+                losers = (done | pending) - {task} - failed
+                self._record_losers([(loser, tasks[loser]) for loser in losers], started, kind)
+                # 未完成的请求直接取消；已经完成（包括取消前刚好完成）但没有胜出的响应要关闭
+                for loser in losers:
+                    loser.cancel()
+                    loser.add_done_callback(_aclose_when_done)
+                for failure in failed:
+                    self.record_failure(tasks[failure])
+                winner = tasks[task]
+                if len(tasks) > 1:
+                    winner.hedged_wins += 1
+                return winner, result
+        raise error
+
+    async def create(self, **kwargs):
+        """与await client.chat.completions.create相同的调用方式"""
+        kind = "stream" if kwargs.get("stream") else "complete"
+        candidates = self.ranked(kind)
+        error = None
+        while candidates:
+            endpoint = candidates.pop(0)
+            tried = [endpoint]
+            try:
+                if self.hedge and candidates:
+                    endpoint, (response, head, elapsed) = await self._hedged_attempt(
+                        endpoint, candidates[0], kwargs, kind, tried
+                    )
+                else:
+                    response, head, elapsed = await self._attempt(endpoint, kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                for failed in tried:
+                    self.record_failure(failed)
+                candidates = [c for c in candidates if c not in tried]
+                error = e
+                continue
+            self.record_success(endpoint, kind, elapsed)
+            if head is None:
+                return response
+            return _AsyncResumedStream(response, *head)
+        raise error
+
+class _AsyncResumedStream:
+    def __init__(self, response, first, iterator):
+        self.response = response
+        self.first = first
+        self.iterator = iterator
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def close(self):
+        await self.response.close()
@@ -0,0 +1,134 @@
+import threading
+import time
+import numpy as np
+
+def openai_embedder(client, model="text-embedding-ada-002"):
+    """创建一个使用OpenAI Embedding接口的向量化函数"""
+    def embed(text):
+        response = client.embeddings.create(model=model, input=text)
+        return response.data[0].embedding
+    return embed
+
+class _Namespace:
+    """单个命名空间（通常对应一个模型）内的向量索引"""
+
+    def __init__(self, dim, capacity=64):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.prompts = []
+        self.answers = []
+        self.last_used = []
+        self.size = 0
+
+    def add(self, vector, prompt, answer):
+        if self.size == len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size] = vector
+        self.prompts.append(prompt)
+        self.answers.append(answer)
+        self.last_used.append(time.monotonic())
+        self.size += 1
+
+    def remove(self, index):
+        """用最后一行覆盖被删除的行，保持矩阵紧凑"""
+        last = self.size - 1
+        if index != last:
+            self.vectors[index] = self.vectors[last]
+            self.prompts[index] = self.prompts[last]
+            self.answers[index] = self.answers[last]
+            self.last_used[index] = self.last_used[last]
+        self.prompts.pop()
+        self.answers.pop()
+        self.last_used.pop()
+        self.size -= 1
+
+class SemanticCache:
+    """语义缓存：意思相近的问题直接复用之前的回答
+
+    把问题向量化后在历史问题的向量索引中查找，余弦相似度超过阈值就返回已保存的回答。
+    不同模型（或不同的system提示）使用独立的命名空间，互不干扰。
+    每个命名空间的条目数超过上限时，淘汰最久未被命中的条目。
+    """
+
+    def __init__(self, embed_fn, threshold=0.92, max_entries=1000, deterministic_only=True):
+        """
+        Args:
+            embed_fn: 把文本转换为向量的函数，例如openai_embedder(client)
+            threshold: 判定为命中的最小余弦相似度
+            max_entries: 每个命名空间最多保存的条目数
+            deterministic_only: 为True时只用于temperature为0的请求
+        """
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.deterministic_only = deterministic_only
+        self.hits = 0
+        self.misses = 0
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def cacheable(self, temperature):
+        """判断某个temperature下的请求是否应该使用缓存，与ResponseCache相同"""
+        return not self.deterministic_only or temperature == 0
+
+    def embed(self, text):
+        """向量化并归一化，之后的相似度计算只需要一次点积"""
+        vector = np.asarray(self.embed_fn(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, namespace, prompt):
+        """查找语义相近的历史问题
+
+        Returns:
+            (answer, similarity, vector)：未命中时answer为None；
+            vector是问题的向量，可以传给add避免重复向量化
+        """
+        vector = self.embed(prompt)
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None or ns.size == 0:
+                self.misses += 1
+                return None, 0.0, vector
+            similarities = ns.vectors[:ns.size] @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity, vector
+            ns.last_used[best] = time.monotonic()
+            self.hits += 1
+            return ns.answers[best], similarity, vector
+
+    def add(self, namespace, prompt, answer, vector=None):
+        """保存一条问答，必要时按LRU淘汰旧条目"""
+        if vector is None:
+            vector = self.embed(prompt)
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                ns = self._namespaces[namespace] = _Namespace(len(vector))
+            while ns.size >= self.max_entries:
+                ns.remove(int(np.argmin(ns.last_used)))
+            ns.add(vector, prompt, answer)
+
+    def clear(self, namespace=None):
+        """清空某个命名空间，namespace为None时清空全部"""
+        with self._lock:
+            if namespace is None:
+                self._namespaces.clear()
+            else:
+                self._namespaces.pop(namespace, None)
+
+    def stats(self):
+        """返回命中率和各命名空间的条目数"""
+        lookups = self.hits + self.misses
+        with self._lock:
+            sizes = {name: ns.size for name, ns in self._namespaces.items()}
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": sizes,
+        }
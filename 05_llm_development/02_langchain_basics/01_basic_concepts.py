@@ -1,7 +1,10 @@
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from dotenv import load_dotenv
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_openai_basics"))
+from openai_chat import create_chat_model
 
 """
 LangChain基础概念示例
@@ -22,10 +25,9 @@ load_dotenv()
 def demonstrate_chat_model():
     """演示ChatModel的基本使用"""
     # 初始化ChatOpenAI，设置模型和温度
-    chat = ChatOpenAI(
+    chat = create_chat_model(
         model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-        temperature=0.7,
-        base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        temperature=0.7
     )
 
     # 构建消息列表
@@ -71,10 +73,9 @@ def demonstrate_output_parsing():
     )
 
     # 使用ChatModel和解析器
-    chat = ChatOpenAI(
+    chat = create_chat_model(
         temperature=0,
-        model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-        base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
     )
     response = chat([HumanMessage(content=prompt.format())])
     
@@ -1,7 +1,11 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from dotenv import load_dotenv
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_openai_basics"))
+from openai_chat import create_chat_model
 
 """
 LangChain中的LLMChain示例
@@ -14,6 +18,9 @@ LangChain中的LLMChain示例
 确保在运行前：
 1. 已安装必要的包：pip install langchain langchain-openai python-dotenv
 2. 在.env文件中设置了OPENAI_API_KEY
+
+所有ChatOpenAI实例都通过create_chat_model创建，共享01_openai_basics中的连接池和限流调度器
+（额度由环境变量OPENAI_RPM/OPENAI_TPM设置）
 """
 
 # 加载环境变量
@@ -28,10 +35,9 @@ def demonstrate_basic_chain():
     )
 
     # 初始化语言模型
-    llm = ChatOpenAI(
+    llm = create_chat_model(
         model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-        temperature=0.7,
-        base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        temperature=0.7
         )
 
     # 创建chain
@@ -50,7 +56,7 @@ def demonstrate_chain_composition():
         template="给我一道{topic}的编程练习题。"
     )
     exercise_chain = LLMChain(
-        llm=ChatOpenAI(temperature=0.7),
+        llm=create_chat_model(temperature=0.7),
         prompt=exercise_prompt
     )
 
@@ -60,7 +66,7 @@ def demonstrate_chain_composition():
         template="为下面的编程题目提供详细的Python解决方案：\n{question}"
     )
     solution_chain = LLMChain(
-        llm=ChatOpenAI(temperature=0.3),
+        llm=create_chat_model(temperature=0.3),
         prompt=solution_prompt
     )
 
@@ -80,7 +86,7 @@ def demonstrate_batch_processing():
         template="用一句话解释{concept}这个Python概念。"
     )
     explain_chain = LLMChain(
-        llm=ChatOpenAI(temperature=0.5),
+        llm=create_chat_model(temperature=0.5),
         prompt=explain_prompt
     )
 
@@ -1,7 +1,11 @@
-from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
 from langchain.chains import ConversationChain
 from dotenv import load_dotenv
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_openai_basics"))
+from openai_chat import create_chat_model
 
 """
 LangChain对话历史管理示例
@@ -23,7 +27,7 @@ def demonstrate_basic_memory():
     """演示基本的对话历史管理"""
     # 创建带有记忆的对话链
     conversation = ConversationChain(
-        llm=ChatOpenAI(temperature=0.7),
+        llm=create_chat_model(temperature=0.7),
         memory=ConversationBufferMemory()
     )
 
@@ -45,7 +49,7 @@ def demonstrate_window_memory():
     """演示滑动窗口记忆"""
     # 创建只记住最近2轮对话的对话链
     conversation = ConversationChain(
-        llm=ChatOpenAI(temperature=0.7),
+        llm=create_chat_model(temperature=0.7),
         memory=ConversationBufferWindowMemory(k=2)
     )
 
@@ -71,12 +75,12 @@ def demonstrate_custom_memory():
 
     # 创建组合记忆：使用对话缓冲和对话摘要
     buffer_memory = ConversationBufferMemory()
-    summary_memory = ConversationSummaryMemory(llm=ChatOpenAI())
+    summary_memory = ConversationSummaryMemory(llm=create_chat_model())
     combined_memory = CombinedMemory(memories=[buffer_memory, summary_memory])
 
     # 创建使用组合记忆的对话链
     conversation = ConversationChain(
-        llm=ChatOpenAI(temperature=0.7),
+        llm=create_chat_model(temperature=0.7),
         memory=combined_memory
     )
 
@@ -1,9 +1,13 @@
-from langchain_openai import ChatOpenAI
 from langchain.agents import load_tools, initialize_agent, AgentType
 from langchain.tools import Tool
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_openai_basics"))
+from openai_chat import create_chat_model
 
 """
 LangChain工具和Agent示例
@@ -24,7 +28,7 @@ load_dotenv()
 def demonstrate_built_in_tools():
     """演示内置工具的使用"""
     # 初始化语言模型
-    llm = ChatOpenAI(temperature=0)
+    llm = create_chat_model(temperature=0)
 
     # 加载内置工具
     tools = load_tools(
@@ -56,7 +60,7 @@ def create_custom_tool():
 
     # 创建用于生成代码的Chain
     code_chain = LLMChain(
-        llm=ChatOpenAI(temperature=0),
+        llm=create_chat_model(temperature=0),
         prompt=prompt
     )
 
@@ -76,7 +80,7 @@ def demonstrate_custom_tools():
     # 初始化Agent
     agent = initialize_agent(
         [code_generator],
-        ChatOpenAI(temperature=0),
+        create_chat_model(temperature=0),
         agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
         verbose=True
     )
@@ -90,7 +94,7 @@ def demonstrate_custom_tools():
 def demonstrate_agent_configuration():
     """演示Agent的高级配置"""
     # 初始化语言模型
-    llm = ChatOpenAI(temperature=0)
+    llm = create_chat_model(temperature=0)
 
     # 加载多个工具
     tools = [
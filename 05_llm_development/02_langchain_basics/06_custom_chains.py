@@ -5,6 +5,11 @@ from langchain.chains.base import Chain
 from typing import Dict, List
 from dotenv import load_dotenv
 import time
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_openai_basics"))
+from openai_chat import create_chat_model
 
 """
 LangChain自定义Chain示例
@@ -89,7 +94,7 @@ def demonstrate_custom_chain():
     
     # 创建自定义Chain
     code_review_chain = CodeReviewChain(
-        llm=ChatOpenAI(temperature=0),
+        llm=create_chat_model(temperature=0),
         code_review_prompt=code_review_prompt,
         suggestion_prompt=suggestion_prompt
     )
@@ -119,7 +124,7 @@ def demonstrate_retry_chain():
         template="请回答以下问题：{query}"
     )
     unstable_chain = LLMChain(
-        llm=ChatOpenAI(temperature=0.7),
+        llm=create_chat_model(temperature=0.7),
         prompt=unstable_prompt
     )
     
@@ -153,7 +158,7 @@ def demonstrate_chain_optimization():
         template="请用一句话解释{concept}这个编程概念。"
     )
     chain = LLMChain(
-        llm=ChatOpenAI(temperature=0),
+        llm=create_chat_model(temperature=0),
         prompt=prompt
     )
     
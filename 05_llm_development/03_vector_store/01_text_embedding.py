@@ -1,45 +1,360 @@
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import tiktoken
 from typing import List
+import json
 import os
+import time
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache, model_key
+from embedding_matrix import EmbeddingMatrix
+from ann_index import AnnIndex
+from quantization import QuantizedIndex
+from embedding_providers import EmbeddingProvider, provider_from_env
+from bulk_embedding import BulkEmbeddingJob
+from dimension_reduction import Projection
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from minhash_dedup import MinHashDeduplicator
 
 # 加载环境变量
 load_dotenv()
 
-# 初始化OpenAI客户端
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# 默认的向量化后端，由环境变量EMBEDDING_PROVIDER选择，None表示使用OpenAI接口；
+# 各函数也可以通过provider参数单独指定
+default_provider = provider_from_env()
 
-def get_embedding(text: str, model="text-embedding-ada-002") -> List[float]:
-    """使用OpenAI API获取文本的向量表示"""
+# 初始化OpenAI客户端，使用本地后端时不需要API key
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY')) if default_provider is None else None
+
+def get_embedding(text: str, model="text-embedding-ada-002",
+                  cache: EmbeddingCache = None,
+                  provider: EmbeddingProvider = None,
+                  dimensions: int = None) -> List[float]:
+    """使用OpenAI API（或provider指定的本地后端）获取文本的向量表示，传入cache时优先从缓存读取
+
+    dimensions只有text-embedding-3及更新的模型支持，由接口直接返回降维后的向量
+    """
+    if cache is not None or (provider or default_provider) is not None:
+        return get_embeddings([text], model, cache=cache, provider=provider,
+                              dimensions=dimensions)[0].tolist()
     response = client.embeddings.create(
         model=model,
-        input=text
+        input=text,
+        **_dimensions_option(dimensions)
     )
     return response.data[0].embedding
 
+def _dimensions_option(dimensions):
+    # 不支持dimensions的旧模型会拒绝该参数，未指定时不发送
+    return {} if dimensions is None else {"dimensions": dimensions}
+
+# Embeddings接口单次请求的限制：最多2048条输入，输入合计不超过300000个token
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_TOKENS = 300000
+
+def _count_tokens(texts: List[str], model: str) -> List[int]:
+    """用tiktoken计算每条文本的token数"""
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+def make_batches(texts: List[str], model="text-embedding-ada-002",
+                 max_items: int = MAX_BATCH_ITEMS,
+                 max_tokens: int = MAX_BATCH_TOKENS) -> List[List[int]]:
+    """把文本按条数和token数上限分批，返回每批文本在原列表中的下标"""
+    batches, current, current_tokens = [], [], 0
+    for i, tokens in enumerate(_count_tokens(texts, model)):
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def get_embeddings(texts: List[str], model="text-embedding-ada-002",
+                   max_items: int = MAX_BATCH_ITEMS,
+                   max_tokens: int = MAX_BATCH_TOKENS,
+                   max_workers: int = 8,
+                   cache: EmbeddingCache = None,
+                   provider: EmbeddingProvider = None,
+                   dimensions: int = None) -> np.ndarray:
+    """批量获取文本向量
+
+    把文本打包成尽量少的请求（同时满足条数和token数上限），多个批次并发请求，
+    结果按输入顺序返回
+
+    Args:
+        texts: 文本列表
+        model: Embedding模型
+        max_items: 每个请求最多包含的文本条数
+        max_tokens: 每个请求最多包含的token数
+        max_workers: 同时进行的请求数
+        cache: 可选的EmbeddingCache，只为缓存中没有的文本请求接口
+        provider: 向量化后端，默认使用default_provider；本地后端忽略model、分批参数和dimensions
+        dimensions: 让接口返回的向量维度（text-embedding-3及更新的模型），
+            使用cache时缓存的模型名必须包含维度：EmbeddingCache(model=model_key(model, dimensions))
+
+    Returns:
+        形状为(len(texts), 向量维度)的float32矩阵，第i行对应texts[i]
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    provider = provider or default_provider
+    if provider is not None:
+        if cache is not None:
+            if cache.model != provider.model:
+                raise ValueError(f"缓存的模型{cache.model}与后端{provider.model}不一致")
+            return cache.get_or_compute(texts, provider.embed)
+        return provider.embed(texts)
+    if cache is not None:
+        if cache.model != model_key(model, dimensions):
+            raise ValueError(f"缓存的模型{cache.model}与请求的{model_key(model, dimensions)}不一致")
+        return cache.get_or_compute(
+            texts, lambda missing: get_embeddings(missing, model, max_items, max_tokens, max_workers,
+                                                  dimensions=dimensions)
+        )
+    # 接口不接受空字符串
+    texts = [text if text else " " for text in texts]
+
+    def embed_batch(indices):
+        response = client.embeddings.create(model=model, input=[texts[i] for i in indices],
+                                            **_dimensions_option(dimensions))
+        # 返回的data带有index字段，按它对齐而不是依赖返回顺序
+        return indices, sorted(response.data, key=lambda item: item.index)
+
+    batches = make_batches(texts, model, max_items, max_tokens)
+    embeddings = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for indices, data in executor.map(embed_batch, batches):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), len(data[0].embedding)), dtype=np.float32)
+            embeddings[indices] = [item.embedding for item in data]
+    return embeddings
+
+def embed_deduplicated(texts: List[str], dedup: MinHashDeduplicator, model="text-embedding-ada-002",
+                       ids: List = None, cache: EmbeddingCache = None,
+                       provider: EmbeddingProvider = None):
+    """先用MinHash过滤近似重复的文本，只为保留下来的文本获取向量
+
+    与dedup中之前导入的文本或本批中更靠前的文本重复的都会被去掉；保留的文本在向量化成功后才加入dedup，
+    向量化失败时重试不会把它们当成重复
+
+    Returns:
+        (保留的文本下标列表, 对应的向量矩阵, {被去掉的下标: 与之重复的已有id})
+    """
+    kept, duplicates = dedup.filter(texts, ids, add=False)
+    embeddings = get_embeddings([texts[i] for i in kept], model, cache=cache, provider=provider)
+    dedup.add([texts[i] for i in kept], None if ids is None else [ids[i] for i in kept])
+    return kept, embeddings, duplicates
+
+def embed_corpus(input_path: str, output_dir: str, model="text-embedding-ada-002",
+                 text_field: str = "text", id_field: str = "id",
+                 batch_size: int = 1024, max_in_flight: int = 4, shard_size: int = 100000,
+                 cache: EmbeddingCache = None, provider: EmbeddingProvider = None,
+                 sink=None) -> dict:
+    """把JSONL/Parquet语料批量向量化到output_dir中的分片文件，中途退出后再次调用会从检查点继续
+
+    每个批次调用一次get_embeddings，最多max_in_flight个批次同时请求，详见bulk_embedding.py
+
+    Returns:
+        统计信息：记录数、分片数和耗时
+    """
+    def embed_fn(texts):
+        return get_embeddings(texts, model, max_workers=1, cache=cache, provider=provider)
+
+    job = BulkEmbeddingJob(input_path, output_dir, embed_fn, text_field=text_field, id_field=id_field,
+                           batch_size=batch_size, max_in_flight=max_in_flight,
+                           shard_size=shard_size, sink=sink)
+    return job.run()
+
 def cosine_similarity(v1: List[float], v2: List[float]) -> float:
     """计算两个向量之间的余弦相似度"""
     v1_np = np.array(v1)
     v2_np = np.array(v2)
     return np.dot(v1_np, v2_np) / (np.linalg.norm(v1_np) * np.linalg.norm(v2_np))
 
-def find_most_similar(query: str, texts: List[str]) -> tuple[str, float]:
+def normalize(vectors) -> np.ndarray:
+    """把向量按行归一化为float32单位向量，归一化后内积即为余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def top_k(query_vecs, matrix: np.ndarray, k: int = 5, block_size: int = 65536,
+          valid: np.ndarray = None):
+    """在已归一化的float32矩阵中为多个查询同时找出最相似的k行
+
+    每个分块只做一次矩阵乘法，用argpartition取出分块内的前k个候选，
+    再与之前的候选合并，内存占用只与block_size有关
+
+    Args:
+        query_vecs: 已归一化的查询向量，形状为(维度,)或(查询数, 维度)
+        matrix: 已归一化的向量矩阵，形状为(行数, 维度)，可以是np.memmap
+        k: 每个查询返回的结果数
+        block_size: 每次参与矩阵乘法的行数
+        valid: 可选的布尔数组，False的行不参与排序（相似度记为-inf）
+
+    Returns:
+        (行号, 相似度)，形状均为(查询数, k)，按相似度从高到低排列；
+        query_vecs为一维时返回一维数组
+    """
+    queries = np.asarray(query_vecs, dtype=np.float32)
+    single = queries.ndim == 1
+    queries = np.atleast_2d(queries)
+    k = max(0, min(k, matrix.shape[0]))
+    best_scores = np.full((queries.shape[0], 0), -np.inf, dtype=np.float32)
+    best_indices = np.zeros((queries.shape[0], 0), dtype=np.int64)
+    # k为0时[:, -0:]会取出整个分块，直接返回空结果
+    rows = matrix.shape[0] if k > 0 else 0
+    for start in range(0, rows, block_size):
+        scores = queries @ matrix[start:start + block_size].T
+        if valid is not None:
+            scores[:, ~valid[start:start + block_size]] = -np.inf
+        if scores.shape[1] > k:
+            candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+            scores = np.take_along_axis(scores, candidates, axis=1)
+        else:
+            candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        indices = np.concatenate([best_indices, candidates + start], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(scores, -k, axis=1)[:, -k:]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            indices = np.take_along_axis(indices, keep, axis=1)
+        best_scores, best_indices = scores, indices
+    order = np.argsort(-best_scores, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_indices = np.take_along_axis(best_indices, order, axis=1)
+    if single:
+        return best_indices[0], best_scores[0]
+    return best_indices, best_scores
+
+def search_matrix(query_vecs, store: EmbeddingMatrix, k: int = 5) -> List[List[tuple]]:
+    """在EmbeddingMatrix中检索，直接使用它的内存映射视图，不复制向量
+
+    Returns:
+        每个查询一个[(id, 相似度), ...]列表，已删除的行不会出现
+    """
+    queries = np.atleast_2d(normalize(query_vecs))
+    indices, scores = top_k(queries, store.view(), k, valid=store.alive)
+    return [
+        [(id_, float(score)) for id_, score in zip(store.ids_for(row_indices), row_scores)
+         if score > -np.inf]
+        for row_indices, row_scores in zip(indices, scores)
+    ]
+
+def search_quantized(query_vecs, store: EmbeddingMatrix, quantized: QuantizedIndex,
+                     k: int = 5, rerank: int = 10) -> List[List[tuple]]:
+    """在EmbeddingMatrix的量化编码上粗排，再用store中内存映射的原始向量精排
+
+    quantized需由QuantizedIndex(...).build(store.view())建立，行号与store一致
+
+    Returns:
+        每个查询一个[(id, 相似度), ...]列表，已删除的行不会出现
+    """
+    queries = np.atleast_2d(normalize(query_vecs))
+    quantized.originals = store.view()
+    # 多取一些候选，过滤已删除的行后仍有k个结果
+    rows, scores = quantized.search(queries, k + store.deleted_count, rerank=rerank)
+    return [
+        [(id_, float(score)) for id_, score in zip(store.ids_for(row_indices), row_scores)
+         if id_ is not None][:k]
+        for row_indices, row_scores in zip(rows, scores)
+    ]
+
+def build_text_index(texts: List[str], kind: str = "hnsw",
+                     cache: EmbeddingCache = None, provider: EmbeddingProvider = None,
+                     projection: Projection = None, **options) -> AnnIndex:
+    """为文本列表建立ANN索引，索引中的id就是文本在列表中的下标
+
+    传入未拟合的Projection（例如Projection("pca", 256)）时先在这批向量上拟合，
+    索引中保存降维后的向量，查询时自动经过同一个投影
+    """
+    embeddings = get_embeddings(texts, cache=cache, provider=provider)
+    dim = embeddings.shape[1]
+    if projection is not None:
+        if projection.input_dim is None:
+            projection.fit(embeddings)
+        dim = projection.dim
+    return AnnIndex(dim, kind, projection=projection, **options).build(embeddings)
+
+def find_top_k(query: str, texts: List[str], k: int = 3,
+               cache: EmbeddingCache = None, index: AnnIndex = None,
+               provider: EmbeddingProvider = None) -> List[tuple[str, float]]:
+    """在文本列表中找到与查询最相似的k个文本
+
+    传入build_text_index建立的索引时只需要为查询请求向量，检索由索引完成；
+    否则对所有文本做精确检索；建立索引和查询时应使用同一个provider
+    """
+    if index is not None:
+        ids, scores = index.search(get_embedding(query, cache=cache, provider=provider), k)
+        return [(texts[i], float(score)) for i, score in zip(ids[0], scores[0]) if i >= 0]
+    # 查询和所有文本一起批量获取向量表示
+    embeddings = normalize(get_embeddings([query] + texts, cache=cache, provider=provider))
+    indices, scores = top_k(embeddings[0], embeddings[1:], k)
+    return [(texts[i], float(score)) for i, score in zip(indices, scores)]
+
+def find_most_similar(query: str, texts: List[str], cache: EmbeddingCache = None,
+                      index: AnnIndex = None, provider: EmbeddingProvider = None) -> tuple[str, float]:
     """在文本列表中找到与查询最相似的文本"""
-    # 获取查询文本的向量表示
-    query_embedding = get_embedding(query)
-    
-    # 获取所有文本的向量表示
-    text_embeddings = [get_embedding(text) for text in texts]
-    
-    # 计算相似度并找到最相似的文本
-    similarities = [cosine_similarity(query_embedding, text_embedding) 
-                   for text_embedding in text_embeddings]
-    max_similarity_idx = np.argmax(similarities)
-    
-    return texts[max_similarity_idx], similarities[max_similarity_idx]
+    return find_top_k(query, texts, k=1, cache=cache, index=index, provider=provider)[0]
+
+def hybrid_search(query: str, texts: List[str], k: int = 3, bm25: BM25Index = None,
+                  mode: str = "rrf", candidates: int = 100, embeddings: np.ndarray = None,
+                  cache: EmbeddingCache = None, index: AnnIndex = None,
+                  provider: EmbeddingProvider = None) -> List[tuple[str, float]]:
+    """BM25关键词检索与向量检索的混合检索
+
+    mode为"rrf"时两路各取candidates个结果，用倒数排名融合，返回(文本, RRF分数)；
+    mode为"prune"时只对BM25的前candidates个候选计算向量相似度，返回(文本, 相似度)，
+    候选不足k个（关键词几乎没有命中）时退回全量向量检索
+
+    Args:
+        bm25: 在texts上建立的BM25Index，行号与texts的下标一致，默认现场建立
+        embeddings: 与texts逐行对应的已归一化向量，默认通过get_embeddings获取
+        index: 可选的ANN索引（例如build_text_index的结果），用于向量一路的检索
+    """
+    if mode not in ("rrf", "prune"):
+        raise ValueError(f"不支持的混合检索模式: {mode}，可选: ('rrf', 'prune')")
+    if bm25 is None:
+        bm25 = BM25Index().add(texts)
+    keyword_rows, _ = bm25.search(query, candidates)
+    query_vec = normalize(get_embedding(query, cache=cache, provider=provider))
+    if mode == "prune" and len(keyword_rows) >= k:
+        if embeddings is not None:
+            candidate_vecs = embeddings[keyword_rows]
+        else:
+            candidate_texts = [texts[i] for i in keyword_rows]
+            candidate_vecs = normalize(get_embeddings(candidate_texts, cache=cache, provider=provider))
+        indices, scores = top_k(query_vec, candidate_vecs, k)
+        return [(texts[keyword_rows[i]], float(score)) for i, score in zip(indices, scores)]
+
+    if index is not None:
+        ids, scores = index.search(query_vec, candidates)
+        dense = [(int(i), float(score)) for i, score in zip(ids[0], scores[0]) if i >= 0]
+    else:
+        if embeddings is None:
+            embeddings = normalize(get_embeddings(texts, cache=cache, provider=provider))
+        indices, scores = top_k(query_vec, embeddings, candidates)
+        dense = [(int(i), float(score)) for i, score in zip(indices, scores)]
+    if mode == "prune":
+        return [(texts[i], score) for i, score in dense[:k]]
+    fused = reciprocal_rank_fusion([[int(i) for i in keyword_rows], [i for i, _ in dense]])
+    return [(texts[i], score) for i, score in fused[:k]]
 
 def main():
+    # 向量缓存：再次运行时相同的文本不再请求接口
+    # 设置环境变量EMBEDDING_PROVIDER=hashing可以完全离线运行全部示例
+    if default_provider is None:
+        cache = EmbeddingCache("embedding_cache")
+    else:
+        cache = EmbeddingCache("embedding_cache", model=default_provider.model)
+
     # 示例文本
     texts = [
         "机器学习是人工智能的一个子领域",
@@ -51,7 +366,7 @@ def main():
     # 示例1：获取文本向量
     print("\n示例1：文本向量化")
     text = texts[0]
-    embedding = get_embedding(text)
+    embedding = get_embedding(text, cache=cache)
     print(f"文本: {text}")
     print(f"向量维度: {len(embedding)}")
     print(f"向量前5个维度: {embedding[:5]}")
@@ -60,8 +375,8 @@ def main():
     print("\n示例2：文本相似度计算")
     text1 = "机器学习和深度学习"
     text2 = "深度学习是机器学习的一种方法"
-    embedding1 = get_embedding(text1)
-    embedding2 = get_embedding(text2)
+    embedding1 = get_embedding(text1, cache=cache)
+    embedding2 = get_embedding(text2, cache=cache)
     similarity = cosine_similarity(embedding1, embedding2)
     print(f"文本1: {text1}")
     print(f"文本2: {text2}")
@@ -70,10 +385,103 @@ def main():
     # 示例3：相似文本检索
     print("\n示例3：相似文本检索")
     query = "什么是机器学习？"
-    most_similar_text, similarity = find_most_similar(query, texts)
+    most_similar_text, similarity = find_most_similar(query, texts, cache=cache)
     print(f"查询: {query}")
     print(f"最相似的文本: {most_similar_text}")
     print(f"相似度: {similarity:.4f}")
 
+    # 示例4：批量向量化
+    print("\n示例4：批量向量化")
+    corpus = [f"{text}（第{i}段）" for i in range(250) for text in texts]
+    start = time.perf_counter()
+    embeddings = get_embeddings(corpus, max_items=256, cache=cache)
+    print(f"向量化 {len(corpus)} 条文本，耗时 {time.perf_counter() - start:.2f}s，矩阵形状: {embeddings.shape}")
+
+    # 示例5：批量检索，多个查询一次矩阵乘法完成
+    print("\n示例5：批量Top-K检索")
+    rng = np.random.default_rng(0)
+    matrix = normalize(rng.standard_normal((200000, 256), dtype=np.float32))
+    queries = normalize(rng.standard_normal((32, 256), dtype=np.float32))
+    start = time.perf_counter()
+    indices, scores = top_k(queries, matrix, k=10)
+    elapsed = time.perf_counter() - start
+    print(f"{len(queries)}个查询 x {len(matrix)}个向量，耗时 {elapsed * 1000:.1f}ms，"
+          f"第1个查询的结果: {indices[0][:3]}, {scores[0][:3]}")
+    for text, score in find_top_k(query, texts, k=3, cache=cache):
+        print(f"{score:.4f}  {text}")
+
+    # 示例6：内存映射的向量矩阵，按id增删，检索时不复制向量
+    print("\n示例6：向量矩阵存储")
+    store = EmbeddingMatrix("embedding_matrix", dim=embeddings.shape[1])
+    store.add(corpus, embeddings)
+    store.delete(corpus[:10])
+    for id_, score in search_matrix(get_embedding(query, cache=cache), store, k=3)[0]:
+        print(f"{score:.4f}  {id_}")
+    print(f"存储统计: {store.stats()}")
+
+    # 示例7：ANN索引，语料较大时先建索引，之后每次查询只需向量化查询文本
+    print("\n示例7：ANN索引检索")
+    index = build_text_index(corpus, kind="hnsw", cache=cache)
+    most_similar_text, similarity = find_most_similar(query, corpus, cache=cache, index=index)
+    print(f"最相似的文本: {most_similar_text}，相似度: {similarity:.4f}")
+
+    # 示例8：向量缓存
+    print("\n示例8：向量缓存")
+    start = time.perf_counter()
+    get_embeddings(corpus, max_items=256, cache=cache)
+    print(f"再次向量化耗时 {time.perf_counter() - start:.3f}s，缓存统计: {cache.stats()}")
+    # 只保留本次用到的文本，回收其余的行
+    print(f"回收了 {cache.gc(texts + corpus + [text1, text2, query])} 行")
+
+    # 示例9：量化存储，在int8编码上粗排，再用示例6中内存映射的原始向量精排
+    print("\n示例9：量化检索")
+    quantized = QuantizedIndex("int8").build(store.view())
+    print(f"原始向量 {store.view().nbytes} 字节，int8编码 {quantized.memory_bytes} 字节")
+    for id_, score in search_quantized(get_embedding(query, cache=cache), store, quantized, k=3)[0]:
+        print(f"{score:.4f}  {id_}")
+
+    # 示例10：批量向量化任务，结果写入分片文件，可断点续跑
+    print("\n示例10：批量向量化任务")
+    os.makedirs("bulk_embedding", exist_ok=True)
+    with open("bulk_embedding/corpus.jsonl", "w", encoding="utf-8") as f:
+        for i, text in enumerate(corpus):
+            f.write(json.dumps({"id": f"doc-{i}", "text": text}, ensure_ascii=False) + "\n")
+    stats = embed_corpus("bulk_embedding/corpus.jsonl", "bulk_embedding/output",
+                         batch_size=100, shard_size=300, cache=cache)
+    print(f"任务统计: {stats}")
+
+    # 示例11：降维，用PCA把向量降到一半维度，投影与索引一起保存和加载
+    # text-embedding-3模型也可以直接请求低维向量：get_embedding(text, model="text-embedding-3-small", dimensions=256)
+    # 配合缓存时缓存名要包含维度：EmbeddingCache(model=model_key("text-embedding-3-small", 256))
+    print("\n示例11：降维检索")
+    projection = Projection("pca", embeddings.shape[1] // 2)
+    build_text_index(corpus, kind="flat", cache=cache, projection=projection).save("ann_index/pca")
+    index = AnnIndex.load("ann_index/pca")
+    most_similar_text, similarity = find_most_similar(query, corpus, cache=cache, index=index)
+    print(f"{index.dim}维索引中最相似的文本: {most_similar_text}，相似度: {similarity:.4f}")
+
+    # 示例12：混合检索，编号这类关键词向量检索不擅长，BM25可以精确命中
+    print("\n示例12：混合检索")
+    bm25 = BM25Index().add(corpus)
+    print(f"BM25索引: {bm25.stats()}")
+    keyword_query = "第42段讲了什么机器学习方法"
+    for mode in ("rrf", "prune"):
+        print(f"模式: {mode}")
+        for text, score in hybrid_search(keyword_query, corpus, k=3, bm25=bm25, mode=mode, cache=cache):
+            print(f"{score:.4f}  {text}")
+
+    # 示例13：近似重复过滤，转载、模板化的文本不再重复向量化
+    print("\n示例13：近似重复过滤")
+    dedup = MinHashDeduplicator("minhash_index", threshold=0.8)
+    pages = [
+        "向量数据库是一种专门用于存储和检索向量的数据库系统，广泛应用于语义搜索和推荐系统。",
+        "向量数据库是一种专门用于存储和检索向量的数据库系统，广泛应用于语义搜索和推荐系统！",
+        "转载：向量数据库是一种专门用于存储和检索向量的数据库系统，广泛应用于语义搜索和推荐系统。",
+        "倒排索引是关键词检索的核心数据结构，记录每个词出现在哪些文档中。",
+    ]
+    kept, page_embeddings, duplicates = embed_deduplicated(pages, dedup, cache=cache)
+    print(f"保留 {len(kept)} 条，向量矩阵形状: {page_embeddings.shape}，重复: {duplicates}")
+    print(f"签名索引: {dedup.stats()}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,44 +1,150 @@
 import chromadb
+from chromadb.utils import embedding_functions
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
+import time
 from dotenv import load_dotenv
 from typing import List, Dict
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from embedding_cache import text_digest
+from minhash_dedup import MinHashDeduplicator
 
 # 加载环境变量
 load_dotenv()
 
+def content_id(document: str) -> str:
+    """由文档内容生成的id（sha256），同样的文档无论导入多少次都对应同一个id"""
+    return text_digest(document).hex()
+
 class ChromaDBManager:
-    def __init__(self, persist_directory: str = "chroma_db"):
-        """初始化ChromaDB客户端"""
+    def __init__(self, persist_directory: str = "chroma_db", embedding_function=None):
+        """初始化ChromaDB客户端
+
+        embedding_function默认为Chroma自带的向量化函数；add_documents会在多个线程中调用它，
+        集合也使用同一个函数向量化查询
+        """
         self.client = chromadb.PersistentClient(path=persist_directory)
+        self.embedding_function = embedding_function or embedding_functions.DefaultEmbeddingFunction()
+        # 每个集合一个进程内的BM25索引，用于混合检索
+        self.bm25_indexes: Dict[str, BM25Index] = {}
 
     def create_collection(self, collection_name: str) -> chromadb.Collection:
         """创建或获取已存在的集合"""
         try:
             # 尝试创建新集合
-            collection = self.client.create_collection(name=collection_name)
+            collection = self.client.create_collection(name=collection_name,
+                                                       embedding_function=self.embedding_function)
             print(f"创建新集合：{collection_name}")
         except ValueError:
             # 如果集合已存在，则获取它
-            collection = self.client.get_collection(name=collection_name)
+            collection = self.client.get_collection(name=collection_name,
+                                                    embedding_function=self.embedding_function)
             print(f"获取已存在的集合：{collection_name}")
         return collection
 
+    def _max_batch_size(self) -> int:
+        """Chroma单次写入的最大条数，与SQLite的变量数上限有关，不同版本的接口不同"""
+        if hasattr(self.client, "get_max_batch_size"):
+            return self.client.get_max_batch_size()
+        return getattr(self.client, "max_batch_size", 5461)
+
     def add_documents(self, collection: chromadb.Collection,
                      documents: List[str],
                      metadatas: List[Dict] = None,
-                     ids: List[str] = None) -> None:
-        """向集合中添加文档"""
-        if ids is None:
-            ids = [str(i) for i in range(len(documents))]
+                     ids: List[str] = None,
+                     dedup: MinHashDeduplicator = None,
+                     batch_size: int = 1000,
+                     max_workers: int = 4) -> Dict:
+        """分批、并发向量化后按id写入（upsert）集合
+
+        ids默认由文档内容生成（content_id），同样的文档重复导入只会覆盖自身，不会与其他调用冲突；
+        输入中重复的id只保留第一个。最多max_workers个批次同时向量化，按顺序写入集合
+
+        Args:
+            dedup: 可选的MinHashDeduplicator，先过滤与之前导入的文档或本批中更靠前的文档近似重复的文档；
+                每个批次写入成功后才把它的文档加入dedup，失败的批次重试时不会被当成重复
+            batch_size: 每批的文档数，不超过Chroma的最大批次
+            max_workers: 同时向量化的批次数
+
+        Returns:
+            统计信息：写入的文档数、批次数、耗时和每秒文档数
+        """
+        derived_ids = ids is None
+        if derived_ids:
+            ids = [content_id(document) for document in documents]
         if metadatas is None:
             metadatas = [{} for _ in documents]
+        # Chroma不允许一次写入中出现重复的id
+        first = {}
+        for i, id_ in enumerate(ids):
+            first.setdefault(id_, i)
+        if len(first) < len(ids):
+            keep = sorted(first.values())
+            documents = [documents[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            ids = [ids[i] for i in keep]
+        if dedup is not None:
+            kept, duplicates = dedup.filter(documents, ids, add=False)
+            if duplicates:
+                print(f"跳过 {len(duplicates)} 个近似重复的文档")
+            documents = [documents[i] for i in kept]
+            metadatas = [metadatas[i] for i in kept]
+            ids = [ids[i] for i in kept]
+        stats = {"documents": len(documents), "batches": 0, "seconds": 0.0, "docs_per_second": 0.0}
+        if not documents:
+            return stats
 
-        collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
-        print(f"添加了 {len(documents)} 个文档到集合中")
+        # 先取得（必要时重建）BM25索引，再写入新文档，避免新文档被索引两次
+        bm25 = self.get_bm25_index(collection)
+        batch_size = min(batch_size, self._max_batch_size())
+        batches = [range(start, min(start + batch_size, len(documents)))
+                   for start in range(0, len(documents), batch_size)]
+        start = last_report = time.perf_counter()
+        written = 0
+
+        def write():
+            nonlocal written, last_report
+            batch, future = pending.popleft()
+            collection.upsert(
+                ids=[ids[i] for i in batch],
+                documents=[documents[i] for i in batch],
+                metadatas=[metadatas[i] for i in batch],
+                embeddings=np.asarray(future.result(), dtype=np.float32).tolist()
+            )
+            if dedup is not None:
+                dedup.add([documents[i] for i in batch], [ids[i] for i in batch])
+            # 内容生成的id相同就意味着内容相同，BM25索引中已有的不必再加入；
+            # 每个批次写入后立即加入，之后的批次失败时已写入的文档也能被关键词检索到
+            new = [i for i in batch if not (derived_ids and ids[i] in bm25)]
+            bm25.add([documents[i] for i in new], [ids[i] for i in new])
+            written += len(batch)
+            if time.perf_counter() - last_report >= 5.0:
+                last_report = time.perf_counter()
+                print(f"已写入 {written}/{len(documents)} 个文档，{written / (last_report - start):.0f} 文档/秒")
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                for batch in batches:
+                    pending.append((batch, executor.submit(self.embedding_function,
+                                                           [documents[i] for i in batch])))
+                    # 在途的批次已满时先写入最早的批次，向量化的结果不会无限堆积
+                    while len(pending) >= max_workers:
+                        write()
+                while pending:
+                    write()
+            except BaseException:
+                for _, future in pending:
+                    future.cancel()
+                raise
+
+        elapsed = time.perf_counter() - start
+        stats.update(batches=len(batches), seconds=elapsed, docs_per_second=len(documents) / elapsed)
+        print(f"添加了 {len(documents)} 个文档到集合中，{len(batches)} 批，"
+              f"耗时 {elapsed:.2f}s，{stats['docs_per_second']:.0f} 文档/秒")
+        return stats
 
     def query_documents(self, collection: chromadb.Collection,
                        query_texts: List[str],
@@ -51,6 +157,48 @@ class ChromaDBManager:
             where=where
         )
 
+    def get_bm25_index(self, collection: chromadb.Collection) -> BM25Index:
+        """获取集合的BM25索引；进程重启后第一次使用时从集合中已有的文档重建"""
+        bm25 = self.bm25_indexes.get(collection.name)
+        if bm25 is None:
+            existing = collection.get(include=["documents"])
+            bm25 = BM25Index().add(existing["documents"], existing["ids"])
+            self.bm25_indexes[collection.name] = bm25
+        return bm25
+
+    def hybrid_query(self, collection: chromadb.Collection,
+                     query_texts: List[str],
+                     n_results: int = 2,
+                     where: Dict = None,
+                     candidates: int = 20) -> Dict:
+        """混合查询：向量检索和BM25各取candidates个结果，用倒数排名融合
+
+        Returns:
+            与query_documents相同结构的ids、documents、metadatas，
+            distances换成RRF分数scores（越大越相关）
+        """
+        dense = collection.query(query_texts=query_texts, n_results=candidates, where=where)
+        bm25 = self.get_bm25_index(collection)
+        results = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        for query, dense_ids in zip(query_texts, dense["ids"]):
+            keyword_ids = [id_ for id_, _ in bm25.search_ids(query, candidates)]
+            if where is not None and keyword_ids:
+                # BM25索引不含元数据，用集合过滤一遍关键词命中的文档
+                allowed = set(collection.get(ids=keyword_ids, where=where, include=[])["ids"])
+                keyword_ids = [id_ for id_ in keyword_ids if id_ in allowed]
+            fused = reciprocal_rank_fusion([dense_ids, keyword_ids])[:n_results]
+            ids = [id_ for id_, _ in fused]
+            fetched = collection.get(ids=ids, include=["documents", "metadatas"]) if ids else None
+            by_id = {} if fetched is None else {
+                id_: (document, metadata)
+                for id_, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+            }
+            results["ids"].append(ids)
+            results["documents"].append([by_id[id_][0] for id_ in ids])
+            results["metadatas"].append([by_id[id_][1] for id_ in ids])
+            results["scores"].append([score for _, score in fused])
+        return results
+
 def main():
     # 创建ChromaDB管理器实例
     db_manager = ChromaDBManager()
@@ -97,5 +245,27 @@ def main():
         print(f"文档 {i+1}: {doc}")
         print(f"元数据: {filtered_results['metadatas'][0][i]}")
 
+    # 示例5：混合查询，向量检索与BM25关键词检索的结果按排名融合
+    print("\n示例5：混合查询")
+    hybrid_results = db_manager.hybrid_query(collection, query_texts=["ChromaDB 开源"])
+    for doc, score in zip(hybrid_results['documents'][0], hybrid_results['scores'][0]):
+        print(f"{score:.4f}  {doc}")
+
+    # 示例6：去重后添加，签名索引保存在目录中，之后的导入也会与之前的文档比较
+    print("\n示例6：近似重复过滤")
+    dedup = MinHashDeduplicator("minhash_index/tutorial_collection", threshold=0.8)
+    pages = [
+        "向量检索可以用于文本相似度搜索、推荐系统和问答系统",
+        "向量检索可以用于文本相似度搜索、推荐系统和问答系统。",
+        "相似度度量常用余弦相似度、内积和欧氏距离",
+    ]
+    db_manager.add_documents(collection, pages, ids=["page-1", "page-2", "page-3"], dedup=dedup)
+
+    # 示例7：批量导入，分批并发向量化，id由内容生成，重复运行只会覆盖同样的文档
+    print("\n示例7：批量导入")
+    chunks = [f"第{i}个文本块：向量数据库按批次写入，每批并发向量化" for i in range(2000)]
+    db_manager.add_documents(collection, chunks, batch_size=500)
+    print(f"集合中共有 {collection.count()} 个文档")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,4 +1,3 @@
-from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import Chroma
 from langchain.chains import ConversationalRetrievalChain
@@ -6,6 +5,10 @@ from langchain.memory import ConversationBufferMemory
 from typing import List, Dict
 import os
 from dotenv import load_dotenv
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_openai_basics"))
+from openai_chat import create_chat_model
 
 # 加载环境变量
 load_dotenv()
@@ -13,7 +16,7 @@ load_dotenv()
 class QASystem:
     def __init__(self, persist_directory: str = "qa_system_db"):
         """初始化问答系统"""
-        self.llm = ChatOpenAI()
+        self.llm = create_chat_model()
         self.embeddings = OpenAIEmbeddings()
         self.memory = ConversationBufferMemory(
             memory_key="chat_history",
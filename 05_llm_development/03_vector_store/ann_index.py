@@ -0,0 +1,223 @@
+"""
+基于FAISS的近似最近邻（ANN）索引
+
+统一封装三种索引，向量在写入和查询时都会归一化，内积即为余弦相似度：
+1. flat：精确检索，暴力计算所有内积，作为召回率的基准
+2. ivf：倒排索引，先把向量聚类到nlist个桶，查询时只扫描最近的nprobe个桶
+3. hnsw：分层小世界图，查询时efSearch越大越准、越慢；不需要训练
+
+nprobe和efSearch可以在每次查询时单独指定，便于在召回率和速度之间权衡。
+传入projection时，写入和查询的向量都先降维，投影与索引一起保存和加载。
+"""
+
+import json
+import os
+import time
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from dimension_reduction import Projection
+
+KINDS = ("flat", "ivf", "hnsw")
+
+class AnnIndex:
+    """Flat/IVF/HNSW索引的统一封装，id为int64"""
+
+    def __init__(self, dim: int, kind: str = "hnsw", nlist: int = None,
+                 hnsw_m: int = 32, ef_construction: int = 200,
+                 nprobe: int = 8, ef_search: int = 64, projection: Projection = None):
+        """
+        Args:
+            dim: 向量维度
+            kind: 索引类型，flat、ivf或hnsw
+            nlist: IVF的聚类数，默认在build时按4*sqrt(向量数)计算
+            hnsw_m: HNSW每个节点的邻居数，越大越准、占用内存越多
+            ef_construction: HNSW建图时的候选数
+            nprobe: IVF查询时默认扫描的桶数
+            ef_search: HNSW查询时默认的候选数
+            projection: 可选的已拟合的降维投影，此时dim应为降维后的维度
+        """
+        if kind not in KINDS:
+            raise ValueError(f"不支持的索引类型: {kind}，可选: {KINDS}")
+        if projection is not None and projection.dim != dim:
+            raise ValueError(f"投影的输出维度{projection.dim}与索引维度{dim}不一致")
+        self.dim = dim
+        self.projection = projection
+        self.kind = kind
+        self.nlist = nlist
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.index = None
+        self._next_id = 0
+
+    def _create(self, n_train):
+        if self.kind == "flat":
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+        if self.kind == "ivf":
+            self.nlist = self.nlist or max(1, min(n_train // 39, int(4 * np.sqrt(n_train))))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            return faiss.IndexIVFFlat(quantizer, self.dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+        hnsw = faiss.IndexHNSWFlat(self.dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = self.ef_construction
+        return faiss.IndexIDMap2(hnsw)
+
+    def _prepare(self, vectors):
+        if self.projection is not None:
+            vectors = self.projection.transform(np.atleast_2d(vectors))
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32).copy()
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def __len__(self):
+        return 0 if self.index is None else self.index.ntotal
+
+    def build(self, vectors, ids=None, train_size: int = 100000):
+        """用vectors新建索引；IVF会先用最多train_size条样本训练聚类中心"""
+        vectors = self._prepare(vectors)
+        self.index = self._create(len(vectors))
+        if not self.index.is_trained:
+            sample = vectors
+            if len(vectors) > train_size:
+                rng = np.random.default_rng(0)
+                sample = vectors[rng.choice(len(vectors), train_size, replace=False)]
+            self.index.train(sample)
+        self._next_id = 0
+        self._add_prepared(vectors, ids)
+        return self
+
+    def add(self, vectors, ids=None):
+        """增量添加向量；索引尚未建立时等同于build"""
+        if self.index is None:
+            return self.build(vectors, ids)
+        self._add_prepared(self._prepare(vectors), ids)
+        return self
+
+    def _add_prepared(self, vectors, ids):
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + len(vectors), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        self.index.add_with_ids(vectors, ids)
+        if len(ids):
+            self._next_id = max(self._next_id, int(ids.max()) + 1)
+
+    def _search_params(self, nprobe, ef_search):
+        if self.kind == "ivf":
+            return faiss.SearchParametersIVF(nprobe=nprobe or self.nprobe)
+        if self.kind == "hnsw":
+            return faiss.SearchParametersHNSW(efSearch=ef_search or self.ef_search)
+        return None
+
+    def search(self, queries, k: int = 5, nprobe: int = None, ef_search: int = None):
+        """检索最相似的k个向量
+
+        Args:
+            queries: 查询向量，形状为(维度,)或(查询数, 维度)
+            k: 返回的结果数
+            nprobe: 本次查询IVF扫描的桶数，默认使用构造时的设置
+            ef_search: 本次查询HNSW的候选数，默认使用构造时的设置
+
+        Returns:
+            (ids, 相似度)，形状均为(查询数, k)；结果不足k个时id为-1
+        """
+        params = self._search_params(nprobe, ef_search)
+        scores, ids = self.index.search(self._prepare(queries), k, params=params)
+        return ids, scores
+
+    def save(self, path: str):
+        """保存索引到{path}.faiss，配置保存到{path}.json，投影保存到{path}.projection.npz"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        faiss.write_index(self.index, path + ".faiss")
+        config = {key: getattr(self, key) for key in
+                  ("dim", "kind", "nlist", "hnsw_m", "ef_construction", "nprobe", "ef_search")}
+        config["next_id"] = self._next_id
+        config["projection"] = self.projection is not None
+        if self.projection is not None:
+            self.projection.save(path + ".projection")
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump(config, f)
+
+    @classmethod
+    def load(cls, path: str) -> "AnnIndex":
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+        next_id = config.pop("next_id")
+        if config.pop("projection", False):
+            config["projection"] = Projection.load(path + ".projection")
+        instance = cls(**config)
+        instance.index = faiss.read_index(path + ".faiss")
+        instance._next_id = next_id
+        return instance
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    """近似结果中命中精确前k个结果的比例"""
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx_ids, exact_ids))
+    return hits / exact_ids.size
+
+def benchmark(vectors, queries, k: int = 10, configs: List[Dict] = None) -> List[Dict]:
+    """对比各种索引和查询参数的召回率（以flat精确检索为基准）和QPS
+
+    Args:
+        vectors: 被检索的向量
+        queries: 查询向量
+        k: 计算recall@k的k
+        configs: 每项包含kind以及可选的构造参数和nprobe/ef_search查询参数
+
+    Returns:
+        每个配置一行结果
+    """
+    if configs is None:
+        configs = [{"kind": "flat"}]
+        configs += [{"kind": "ivf", "nprobe": n} for n in (1, 4, 16, 64)]
+        configs += [{"kind": "hnsw", "ef_search": ef} for ef in (16, 64, 256)]
+    exact = AnnIndex(vectors.shape[1], "flat").build(vectors)
+    exact_ids, _ = exact.search(queries, k)
+    built, rows = {}, []
+    for config in configs:
+        config = dict(config)
+        query_args = {key: config.pop(key) for key in ("nprobe", "ef_search") if key in config}
+        key = json.dumps(config, sort_keys=True)
+        build_seconds = 0.0
+        if key not in built:
+            start = time.perf_counter()
+            built[key] = AnnIndex(vectors.shape[1], **config).build(vectors)
+            build_seconds = time.perf_counter() - start
+        index = built[key]
+        start = time.perf_counter()
+        ids, _ = index.search(queries, k, **query_args)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "config": {**config, **query_args},
+            "recall": recall_at_k(ids, exact_ids),
+            "qps": len(queries) / elapsed if elapsed > 0 else float("inf"),
+            "build_seconds": build_seconds,
+        })
+    return rows
+
+def main():
+    # 用高斯混合生成有聚类结构的向量，比均匀随机数据更接近真实的文本向量
+    n, dim, n_queries = 100000, 128, 1000
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((1000, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim), dtype=np.float32)
+    queries = centers[rng.integers(0, len(centers), n_queries)] + 0.5 * rng.standard_normal((n_queries, dim), dtype=np.float32)
+
+    print(f"{n}个{dim}维向量，{n_queries}个查询")
+    print(f"{'配置':<40}{'recall@10':>10}{'QPS':>12}{'建索引(s)':>12}")
+    for row in benchmark(vectors, queries, k=10):
+        print(f"{json.dumps(row['config']):<40}{row['recall']:>10.3f}{row['qps']:>12.0f}{row['build_seconds']:>12.2f}")
+
+    # 保存和加载
+    index = AnnIndex(dim, "hnsw").build(vectors[:10000])
+    index.save("ann_index/demo")
+    loaded = AnnIndex.load("ann_index/demo")
+    loaded.add(vectors[10000:11000])
+    print(f"加载后增量添加，共{len(loaded)}个向量")
+
+if __name__ == "__main__":
+    main()
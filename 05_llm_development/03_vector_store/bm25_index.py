@@ -0,0 +1,198 @@
+"""
+进程内的BM25倒排索引与倒数排名融合（RRF）
+
+关键词检索与向量检索互补：向量检索擅长语义相近的表达，BM25擅长型号、专有名词等必须字面命中的词。
+1. 分词：英文和数字按单词切分；中文没有空格，默认切成单字和相邻两字（bigram），
+   不需要词典；安装了jieba时可以改用jieba_tokenize
+2. 倒排表采用紧凑的CSR布局：所有词的倒排表首尾相接存放在两个数组中，
+   文档号为uint32、词频为uint16，每个词的倒排表由offsets数组中的起止位置确定
+3. reciprocal_rank_fusion按名次融合多路检索结果，不需要对BM25分数和余弦相似度做归一化
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Sequence
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+
+def tokenize(text: str) -> List[str]:
+    """英文和数字按单词切分，中文切成单字和bigram"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if run.isascii():
+            tokens.append(run)
+        else:
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def jieba_tokenize(text: str) -> List[str]:
+    """用jieba的搜索引擎模式切分中文，需要安装jieba"""
+    try:
+        import jieba
+    except ImportError:
+        raise ImportError("jieba_tokenize需要安装jieba: pip install jieba")
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.extend([run] if run.isascii() else jieba.lcut_for_search(run))
+    return tokens
+
+class BM25Index:
+    """BM25倒排索引，文档按加入顺序编号（行号），可以附带任意id；再次加入已有的id时替换旧文档"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75,
+                 tokenizer: Callable[[str], List[str]] = tokenize):
+        """
+        Args:
+            k1: 词频饱和参数，越大词频的影响越大
+            b: 文档长度归一化的程度，0表示不考虑长度
+            tokenizer: 分词函数，建索引和查询必须使用同一个
+        """
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self.vocab: Dict[str, int] = {}
+        self.ids: List = []
+        # id到最新行号的映射；被替换的旧行不再参与排序
+        self._rows: Dict = {}
+        self._replaced = set()
+        self.doc_lens = np.zeros(0, dtype=np.uint32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.zeros(0, dtype=np.uint32)
+        self._tfs = np.zeros(0, dtype=np.uint16)
+        # 有效行的掩码和平均文档长度，合并倒排表时更新；被替换的行不计入文档数、词的文档频率和平均长度
+        self._live = np.zeros(0, dtype=bool)
+        self._avgdl = 0.0
+        # 新加入的文档先记在列表里，下次查询前一次性合并进倒排表
+        self._pending_terms, self._pending_docs, self._pending_tfs, self._pending_lens = [], [], [], []
+
+    def __len__(self):
+        """有效（未被替换）的文档数"""
+        return len(self._rows)
+
+    def __contains__(self, id_):
+        return id_ in self._rows
+
+    def add(self, texts: Iterable[str], ids: Iterable = None) -> "BM25Index":
+        """加入文档；ids默认为行号，已有的id会被替换"""
+        texts = list(texts)
+        ids = list(range(len(self.ids), len(self.ids) + len(texts))) if ids is None else list(ids)
+        if len(ids) != len(texts):
+            raise ValueError("ids和texts的数量不一致")
+        for doc, (id_, text) in enumerate(zip(ids, texts), len(self.ids)):
+            tokens = self.tokenizer(text)
+            for term, tf in Counter(tokens).items():
+                self._pending_terms.append(self.vocab.setdefault(term, len(self.vocab)))
+                self._pending_docs.append(doc)
+                self._pending_tfs.append(min(tf, 65535))
+            self._pending_lens.append(len(tokens))
+            if id_ in self._rows:
+                self._replaced.add(self._rows[id_])
+            self._rows[id_] = doc
+        self.ids.extend(ids)
+        return self
+
+    def _merge(self):
+        """把新加入的文档合并进CSR倒排表"""
+        if not self._pending_lens:
+            return
+        old_terms = np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))
+        terms = np.concatenate([old_terms, np.array(self._pending_terms, dtype=np.int64)])
+        docs = np.concatenate([self._docs, np.array(self._pending_docs, dtype=np.uint32)])
+        tfs = np.concatenate([self._tfs, np.array(self._pending_tfs, dtype=np.uint16)])
+        order = np.lexsort((docs, terms))
+        self._docs, self._tfs = docs[order], tfs[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(self.vocab)))])
+        self.doc_lens = np.concatenate([self.doc_lens, np.array(self._pending_lens, dtype=np.uint32)])
+        self._pending_terms, self._pending_docs, self._pending_tfs, self._pending_lens = [], [], [], []
+        self._update_live()
+
+    def _update_live(self):
+        self._live = np.ones(len(self.ids), dtype=bool)
+        self._live[list(self._replaced)] = False
+        self._avgdl = float(self.doc_lens[self._live].mean()) if self._live.any() else 0.0
+
+    def scores(self, query: str) -> np.ndarray:
+        """query对每个文档的BM25分数，未命中任何词的文档为0"""
+        self._merge()
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        if not len(self.ids):
+            return scores
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_lens / max(self._avgdl, 1e-9))
+        terms = Counter(self.vocab[t] for t in self.tokenizer(query) if t in self.vocab)
+        for term, query_tf in terms.items():
+            start, end = self._offsets[term], self._offsets[term + 1]
+            docs = self._docs[start:end]
+            tfs = self._tfs[start:end].astype(np.float32)
+            df = int(np.count_nonzero(self._live[docs])) if self._replaced else end - start
+            idf = math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+            # 同一个词的倒排表中每个文档只出现一次，可以直接按下标累加
+            scores[docs] += query_tf * idf * tfs * (self.k1 + 1) / (tfs + length_norm[docs])
+        if self._replaced:
+            scores[list(self._replaced)] = 0.0
+        return scores
+
+    def search(self, query: str, k: int = 10):
+        """返回BM25分数最高的k个文档的(行号, 分数)，只包含至少命中一个词的文档"""
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(scores[hits], -k)[-k:]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return hits, scores[hits]
+
+    def search_ids(self, query: str, k: int = 10) -> List[tuple]:
+        """返回[(id, 分数), ...]"""
+        rows, scores = self.search(query, k)
+        return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+
+    def stats(self):
+        self._merge()
+        return {"documents": len(self), "replaced": len(self._replaced), "terms": len(self.vocab), "postings": len(self._docs),
+                "bytes": self._docs.nbytes + self._tfs.nbytes + self._offsets.nbytes + self.doc_lens.nbytes}
+
+    def save(self, path: str):
+        """保存到{path}.npz；分词函数不保存，加载时需要传入同一个"""
+        self._merge()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        meta = {"k1": self.k1, "b": self.b, "vocab": list(self.vocab), "ids": self.ids,
+                "replaced": sorted(self._replaced)}
+        np.savez(path + ".npz", offsets=self._offsets, docs=self._docs, tfs=self._tfs,
+                 doc_lens=self.doc_lens, meta=json.dumps(meta, ensure_ascii=False))
+
+    @classmethod
+    def load(cls, path: str, tokenizer: Callable[[str], List[str]] = tokenize) -> "BM25Index":
+        data = np.load(path + ".npz")
+        meta = json.loads(str(data["meta"]))
+        instance = cls(meta["k1"], meta["b"], tokenizer)
+        instance.vocab = {term: i for i, term in enumerate(meta["vocab"])}
+        instance.ids = meta["ids"]
+        instance._replaced = set(meta.get("replaced", []))
+        instance._rows = {id_: row for row, id_ in enumerate(instance.ids) if row not in instance._replaced}
+        instance._offsets, instance._docs, instance._tfs = data["offsets"], data["docs"], data["tfs"]
+        instance.doc_lens = data["doc_lens"]
+        instance._update_live()
+        return instance
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence], k: int = 60,
+                           weights: Sequence[float] = None) -> List[tuple]:
+    """倒数排名融合：每路结果中排第r名的id得到weight/(k+r)分，按总分从高到低返回[(id, 分数), ...]
+
+    Args:
+        rankings: 多路检索结果，每路是按相关度从高到低排列的id列表
+        k: 平滑常数，越大排名靠后的结果与靠前的差距越小，通常取60
+        weights: 每路结果的权重，默认都为1
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, id_ in enumerate(ranking, 1):
+            fused[id_] = fused.get(id_, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
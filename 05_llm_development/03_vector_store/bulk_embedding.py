@@ -0,0 +1,255 @@
+"""
+可断点续跑的批量向量化任务
+
+适用于远大于内存的语料，流程是一条流水线：
+1. 从JSONL或Parquet文件流式读取记录，攒成批次
+2. 最多max_in_flight个批次同时在请求向量，写入跟不上时不再读取和提交新的批次（背压）
+3. 按输入顺序把向量写入编号的分片文件：vectors.{编号}.npy和ids.{编号}.jsonl，
+   每个分片最多shard_size行，.npy文件头随写入更新，任何时候都可以直接np.load
+4. 每写完一个批次就原子地更新checkpoint.json，记录已处理的记录数和输入文件中的位置；
+   进程中途退出后重新运行同一个任务，会截掉检查点之后写入的部分，从检查点继续
+"""
+
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Tuple
+
+import numpy as np
+
+from embedding_matrix import HEADER_SIZE, write_npy_header
+
+def iter_jsonl(path: str, position: int = 0) -> Iterator[Tuple[int, dict]]:
+    """从字节偏移position开始读取JSONL，产出(该记录之后的偏移, 记录)，跳过空行"""
+    with open(path, "rb") as f:
+        f.seek(position)
+        for line in f:
+            position += len(line)
+            if line.strip():
+                yield position, json.loads(line)
+
+def iter_parquet(path: str, position: int = 0, columns: List[str] = None,
+                 batch_rows: int = 8192) -> Iterator[Tuple[int, dict]]:
+    """从第position行开始读取Parquet，产出(该记录之后的行号, 记录)；整行组跳过已处理的部分"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("读取Parquet文件需要安装pyarrow: pip install pyarrow")
+    parquet = pq.ParquetFile(path)
+    group, skip = 0, position
+    while group < parquet.num_row_groups and skip >= parquet.metadata.row_group(group).num_rows:
+        skip -= parquet.metadata.row_group(group).num_rows
+        group += 1
+    row = position - skip
+    if columns is not None:
+        columns = [name for name in columns if name in parquet.schema_arrow.names]
+    for batch in parquet.iter_batches(batch_size=batch_rows, row_groups=range(group, parquet.num_row_groups),
+                                      columns=columns):
+        for record in batch.to_pylist():
+            row += 1
+            if skip:
+                skip -= 1
+                continue
+            yield row, record
+
+def _is_parquet(path):
+    return path.endswith((".parquet", ".pq"))
+
+def _input_size(path):
+    """输入的总量，与iter_*产出的位置同一单位：JSONL为字节数，Parquet为行数"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return os.path.getsize(path)
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+class BulkEmbeddingJob:
+    """把一个JSONL/Parquet文件中的文本向量化到分片文件，支持断点续跑"""
+
+    def __init__(self, input_path: str, output_dir: str,
+                 embed_fn: Callable[[List[str]], np.ndarray],
+                 text_field: str = "text", id_field: str = "id",
+                 batch_size: int = 1024, max_in_flight: int = 4,
+                 shard_size: int = 100000, report_interval: float = 10.0,
+                 sink: Callable[[List, np.ndarray], None] = None):
+        """
+        Args:
+            input_path: 输入文件，.parquet/.pq按Parquet读取，其余按JSONL读取
+            output_dir: 分片文件和检查点所在的目录
+            embed_fn: 批量向量化函数，输入文本列表，返回按顺序排列的向量矩阵
+            text_field: 记录中文本的字段名
+            id_field: 记录中id的字段名，缺失时使用记录的序号
+            batch_size: 每次调用embed_fn的文本数
+            max_in_flight: 同时在向量化的批次数
+            shard_size: 每个分片的最大行数
+            report_interval: 输出进度的间隔秒数
+            sink: 可选的下游处理函数，每个批次写入分片后按顺序调用，
+                  它处理得慢时流水线会随之放慢；续跑时最后一个批次可能被重复传入
+        """
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.embed_fn = embed_fn
+        self.text_field = text_field
+        self.id_field = id_field
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.shard_size = shard_size
+        self.report_interval = report_interval
+        self.sink = sink
+        self.checkpoint_path = os.path.join(output_dir, "checkpoint.json")
+        os.makedirs(output_dir, exist_ok=True)
+
+    def vectors_path(self, shard):
+        return os.path.join(self.output_dir, f"vectors.{shard:05d}.npy")
+
+    def ids_path(self, shard):
+        return os.path.join(self.output_dir, f"ids.{shard:05d}.jsonl")
+
+    def _save_checkpoint(self, state):
+        with open(self.checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def _load_checkpoint(self):
+        """读取检查点，并把分片文件恢复到检查点时的状态"""
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state["input"] != os.path.abspath(self.input_path):
+                raise ValueError(f"{self.output_dir}中的检查点属于另一个输入文件: {state['input']}")
+        else:
+            state = {"input": os.path.abspath(self.input_path), "position": 0, "records": 0,
+                     "shard": 0, "shard_rows": 0, "dim": None, "done": False}
+        shard, rows = state["shard"], state["shard_rows"]
+        if state["dim"] is None:
+            # 还没有批次写入检查点，之前留下的分片全部作废
+            shard -= 1
+        elif os.path.exists(self.vectors_path(shard)):
+            with open(self.vectors_path(shard), "r+b") as f:
+                write_npy_header(f, rows, state["dim"])
+                f.truncate(HEADER_SIZE + rows * state["dim"] * 4)
+            lines = []
+            if os.path.exists(self.ids_path(shard)):
+                with open(self.ids_path(shard), "r", encoding="utf-8") as f:
+                    lines = f.readlines()[:rows]
+            with open(self.ids_path(shard) + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(self.ids_path(shard) + ".tmp", self.ids_path(shard))
+        # 检查点之后新建的分片
+        while os.path.exists(self.vectors_path(shard + 1)) or os.path.exists(self.ids_path(shard + 1)):
+            shard += 1
+            for path in (self.vectors_path(shard), self.ids_path(shard)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return state
+
+    def _batches(self, state):
+        """把记录攒成批次，产出(批次之后的输入位置, ids, 文本)"""
+        if _is_parquet(self.input_path):
+            records = iter_parquet(self.input_path, state["position"], [self.text_field, self.id_field])
+        else:
+            records = iter_jsonl(self.input_path, state["position"])
+        index = state["records"]
+        ids, texts, position = [], [], state["position"]
+        for position, record in records:
+            ids.append(record.get(self.id_field, index))
+            texts.append(record.get(self.text_field) or "")
+            index += 1
+            if len(texts) >= self.batch_size:
+                yield position, ids, texts
+                ids, texts = [], []
+        if texts:
+            yield position, ids, texts
+
+    def _write(self, state, position, ids, vectors):
+        """把一个批次追加到分片文件，然后更新检查点"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if state["dim"] is None:
+            state["dim"] = vectors.shape[1]
+        dim, offset = state["dim"], 0
+        while offset < len(ids):
+            if state["shard_rows"] == self.shard_size:
+                state["shard"] += 1
+                state["shard_rows"] = 0
+            shard, rows = state["shard"], state["shard_rows"]
+            take = min(len(ids) - offset, self.shard_size - rows)
+            mode = "r+b" if os.path.exists(self.vectors_path(shard)) else "w+b"
+            with open(self.vectors_path(shard), mode) as f:
+                f.seek(HEADER_SIZE + rows * dim * 4)
+                f.write(vectors[offset:offset + take].tobytes())
+                write_npy_header(f, rows + take, dim)
+            with open(self.ids_path(shard), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(id_, ensure_ascii=False) + "\n" for id_ in ids[offset:offset + take]))
+            state["shard_rows"] += take
+            offset += take
+        if self.sink is not None:
+            self.sink(ids, vectors)
+        state["records"] += len(ids)
+        state["position"] = position
+        self._save_checkpoint(state)
+
+    def run(self) -> dict:
+        """运行（或从检查点继续）任务，返回统计信息"""
+        state = self._load_checkpoint()
+        if state["done"]:
+            print(f"任务已完成，共{state['records']}条记录")
+            return {"records": state["records"], "shards": state["shard"] + 1, "seconds": 0.0}
+        total = _input_size(self.input_path)
+        start_position, start_records = state["position"], state["records"]
+        if start_records:
+            print(f"从检查点继续：已完成{start_records}条记录")
+        start = last_report = time.perf_counter()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            try:
+                for position, ids, texts in self._batches(state):
+                    pending.append((position, ids, executor.submit(self.embed_fn, texts)))
+                    # 在途的批次已满时先等最早的批次写完，再读取下一个批次
+                    while len(pending) >= self.max_in_flight:
+                        self._write(state, pending[0][0], pending[0][1], pending[0][2].result())
+                        pending.popleft()
+                    if time.perf_counter() - last_report >= self.report_interval:
+                        last_report = time.perf_counter()
+                        self._report(state, start, start_position, start_records, total)
+                while pending:
+                    self._write(state, pending[0][0], pending[0][1], pending[0][2].result())
+                    pending.popleft()
+            except BaseException:
+                for _, _, future in pending:
+                    future.cancel()
+                raise
+        state["done"] = True
+        self._save_checkpoint(state)
+        seconds = time.perf_counter() - start
+        self._report(state, start, start_position, start_records, total)
+        return {"records": state["records"], "shards": state["shard"] + 1 if state["dim"] else 0,
+                "seconds": seconds}
+
+    @staticmethod
+    def _report(state, start, start_position, start_records, total):
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        done = state["records"] - start_records
+        progress = state["position"] / total if total else 1.0
+        moved = state["position"] - start_position
+        eta = (total - state["position"]) * elapsed / moved if moved else float("inf")
+        eta_text = _format_seconds(eta) if eta != float("inf") else "未知"
+        print(f"已完成{state['records']}条，本次{done / elapsed:.0f}条/秒，"
+              f"进度{progress:.1%}，预计剩余{eta_text}")
+
+def load_shards(output_dir: str) -> Iterator[Tuple[List, np.ndarray]]:
+    """按顺序读取任务写出的分片，产出(ids, 内存映射的向量矩阵)，只包含检查点之前的行"""
+    with open(os.path.join(output_dir, "checkpoint.json"), "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state["dim"] is None:
+        return
+    for shard in range(state["shard"] + 1):
+        rows = state["shard_rows"] if shard == state["shard"] else None
+        vectors = np.load(os.path.join(output_dir, f"vectors.{shard:05d}.npy"), mmap_mode="r")[:rows]
+        with open(os.path.join(output_dir, f"ids.{shard:05d}.jsonl"), "r", encoding="utf-8") as f:
+            ids = [json.loads(line) for line in f][:len(vectors)]
+        yield ids, vectors
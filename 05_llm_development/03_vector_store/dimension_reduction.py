@@ -0,0 +1,177 @@
+"""
+向量降维与召回率测试
+
+降维后内存和暴力扫描的计算量都与维度成正比，维度减半两者都减半。两种本地降维方式：
+1. truncate：直接保留前dim维再归一化，适用于text-embedding-3这类用Matryoshka方式训练的模型
+   （与请求时传dimensions参数等价）
+2. pca：在样本上拟合主成分，投影到方差最大的dim个方向，适用于任何模型
+
+降维后的向量与原始向量不可比较，查询也必须经过同一个投影，所以Projection应与索引一起保存
+（AnnIndex支持projection参数）。
+
+命令行工具用自己的语料和查询向量测试不同维度下的recall@k和检索延迟：
+    python dimension_reduction.py --vectors corpus.npy --queries queries.npy --dims 1024 512 256 128
+    python dimension_reduction.py --vectors corpus.npy --kinds pca --save projection/pca256 --dims 256
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+KINDS = ("truncate", "pca")
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class Projection:
+    """把向量投影到更低的维度，输出归一化的float32向量"""
+
+    def __init__(self, kind: str = "pca", dim: int = 256):
+        if kind not in KINDS:
+            raise ValueError(f"不支持的降维方式: {kind}，可选: {KINDS}")
+        self.kind = kind
+        self.dim = dim
+        self.input_dim = None
+        self.mean = None
+        self.components = None
+
+    def fit(self, vectors, sample_size: int = 100000) -> "Projection":
+        """truncate只记录输入维度；pca在最多sample_size条样本上计算协方差矩阵的主成分"""
+        self.input_dim = vectors.shape[1]
+        if self.dim > self.input_dim:
+            raise ValueError(f"目标维度{self.dim}大于输入维度{self.input_dim}")
+        if self.kind == "pca":
+            sample = vectors
+            if len(vectors) > sample_size:
+                rng = np.random.default_rng(0)
+                sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+            sample = np.asarray(sample, dtype=np.float32)
+            self.mean = sample.mean(axis=0, dtype=np.float64).astype(np.float32)
+            centered = sample - self.mean
+            # 维度通常远小于样本数，对(维度, 维度)的协方差矩阵做特征分解比对样本做SVD快
+            eigenvalues, eigenvectors = np.linalg.eigh((centered.T @ centered).astype(np.float64))
+            order = np.argsort(eigenvalues)[::-1][:self.dim]
+            self.components = eigenvectors[:, order].T.astype(np.float32)
+        return self
+
+    def transform(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] != self.input_dim:
+            raise ValueError(f"输入维度{vectors.shape[-1]}与投影的输入维度{self.input_dim}不一致")
+        if self.kind == "truncate":
+            return _normalize(vectors[..., :self.dim])
+        return _normalize((vectors - self.mean) @ self.components.T)
+
+    def save(self, path: str):
+        """保存到{path}.npz"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        extra = {"mean": self.mean, "components": self.components} if self.kind == "pca" else {}
+        np.savez(path + ".npz", kind=self.kind, dims=np.array([self.dim, self.input_dim]), **extra)
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        data = np.load(path + ".npz")
+        dim, input_dim = data["dims"]
+        instance = cls(str(data["kind"]), int(dim))
+        instance.input_dim = int(input_dim)
+        if instance.kind == "pca":
+            instance.mean, instance.components = data["mean"], data["components"]
+        return instance
+
+def _search(queries, matrix, k):
+    scores = queries @ matrix.T
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+def benchmark(vectors, queries, dims: List[int], k: int = 10,
+              kinds=KINDS, repeat: int = 3) -> List[Dict]:
+    """测试各降维方式和维度下的recall@k（以原始维度的精确检索为基准）、检索延迟和内存
+
+    Args:
+        vectors: 语料向量，形状为(语料数, 原始维度)
+        queries: 查询向量，最好来自真实的查询
+        dims: 要测试的维度
+        k: 计算recall@k的k
+        kinds: 要测试的降维方式
+        repeat: 检索重复的次数，延迟取最小值
+
+    Returns:
+        每个(方式, 维度)一行结果，第一行为原始维度
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+    k = min(k, len(vectors))
+
+    def measure(matrix, query_matrix):
+        latency = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ids = _search(query_matrix, matrix, k)
+            latency = min(latency, time.perf_counter() - start)
+        return ids, latency * 1000 / len(query_matrix)
+
+    exact_ids, exact_latency = measure(vectors, queries)
+    rows = [{"kind": "full", "dim": vectors.shape[1], "recall": 1.0,
+             "latency_ms": exact_latency, "memory_mb": vectors.nbytes / 2**20}]
+    for kind in kinds:
+        for dim in dims:
+            if dim >= vectors.shape[1]:
+                continue
+            projection = Projection(kind, dim).fit(vectors)
+            matrix = projection.transform(vectors)
+            ids, latency = measure(matrix, projection.transform(queries))
+            hits = sum(len(set(a) & set(e)) for a, e in zip(ids, exact_ids))
+            rows.append({"kind": kind, "dim": dim, "recall": hits / exact_ids.size,
+                         "latency_ms": latency, "memory_mb": matrix.nbytes / 2**20})
+    return rows
+
+def _synthetic(n, dim, n_queries, rank=64):
+    """生成主要方差集中在前rank个方向上的向量，类似真实文本向量的各向异性"""
+    rng = np.random.default_rng(0)
+    scales = np.exp(-np.arange(dim) / rank).astype(np.float32)
+    basis = np.linalg.qr(rng.standard_normal((dim, dim)))[0].astype(np.float32)
+    vectors = (rng.standard_normal((n, dim), dtype=np.float32) * scales) @ basis
+    queries = vectors[rng.integers(0, n, n_queries)] + 0.05 * (rng.standard_normal((n_queries, dim), dtype=np.float32) * scales) @ basis
+    return vectors, queries
+
+def main():
+    parser = argparse.ArgumentParser(description="降维后的召回率与延迟测试")
+    parser.add_argument("--vectors", help="语料向量的.npy文件，默认生成模拟数据")
+    parser.add_argument("--queries", help="查询向量的.npy文件，默认从语料中抽样")
+    parser.add_argument("--dims", type=int, nargs="+", default=[768, 512, 256, 128, 64])
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--save", help="在全部语料上拟合--kinds和--dims的第一项，把投影保存到该路径")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r")
+        if args.queries:
+            queries = np.load(args.queries)
+        else:
+            rng = np.random.default_rng(0)
+            queries = vectors[np.sort(rng.choice(len(vectors), min(200, len(vectors)), replace=False))]
+    else:
+        # 模拟数据的主成分方向是随机旋转的，truncate的效果会很差；Matryoshka模型的向量则前几维最重要
+        vectors, queries = _synthetic(50000, 1536, 200)
+
+    print(f"{len(vectors)}个{vectors.shape[1]}维向量，{len(queries)}个查询，recall@{args.k}")
+    print(f"{'方式':<10}{'维度':>6}{'召回率':>8}{'延迟(ms)':>10}{'内存(MB)':>10}")
+    for row in benchmark(vectors, queries, args.dims, args.k, args.kinds):
+        print(f"{row['kind']:<10}{row['dim']:>6}{row['recall']:>8.3f}{row['latency_ms']:>10.3f}{row['memory_mb']:>10.1f}")
+
+    if args.save:
+        projection = Projection(args.kinds[0], args.dims[0]).fit(vectors)
+        projection.save(args.save)
+        print(f"已保存投影: {args.save}.npz")
+
+if __name__ == "__main__":
+    main()
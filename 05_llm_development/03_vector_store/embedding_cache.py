@@ -0,0 +1,199 @@
+"""
+按内容寻址的向量缓存
+
+缓存键为(模型, sha256(文本))，同一段文本无论出现在哪里、被向量化多少次，只需要请求一次接口。
+每个模型对应一个目录，包含三个文件：
+1. vectors.{代}.f32：只追加的float32矩阵，每行一个向量，读取时内存映射，不需要整体载入内存
+2. keys.{代}.bin：只追加的32字节sha256摘要，第i个摘要对应矩阵的第i行
+3. meta.json：向量维度和当前使用的文件代数；gc()写出新一代文件后再替换meta.json，中途退出不会损坏缓存
+
+打开缓存时只读取摘要文件建立摘要到行号的字典；不再使用的行通过gc()回收。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Callable, Iterable, List
+
+import numpy as np
+
+DIGEST_SIZE = 32
+
+def model_key(model: str, dimensions: int = None) -> str:
+    """缓存使用的模型名：请求了dimensions时为"{model}@{dimensions}"，不同维度的向量分开缓存"""
+    return model if dimensions is None else f"{model}@{dimensions}"
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """单个模型的持久化向量缓存"""
+
+    def __init__(self, directory: str = "embedding_cache", model: str = "text-embedding-ada-002"):
+        self.model = model
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model))
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self.dim = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.directory, f"vectors.{self.generation}.f32")
+
+    @property
+    def keys_path(self):
+        return os.path.join(self.directory, f"keys.{self.generation}.bin")
+
+    def _write_meta(self):
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim, "generation": self.generation}, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def _load(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim, self.generation = meta["dim"], meta["generation"]
+        if self.dim is None:
+            return
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                keys = f.read()
+        row_bytes = self.dim * 4
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        # 先写向量再写摘要，进程中途退出时以两者中较短的为准，截掉多余的部分
+        rows = min(len(keys) // DIGEST_SIZE, vector_rows)
+        self._truncate(rows)
+        self._rows = {keys[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i for i in range(rows)}
+
+    def _truncate(self, rows):
+        for path, size in ((self.vectors_path, rows * self.dim * 4), (self.keys_path, rows * DIGEST_SIZE)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, text: str) -> bool:
+        return text_digest(text) in self._rows
+
+    def _view(self):
+        """内存映射的向量矩阵；文件增长后重新映射"""
+        rows = len(self._rows)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            if rows == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(rows, self.dim))
+        return self._matrix
+
+    def get_many(self, texts: List[str]):
+        """查询缓存
+
+        Returns:
+            (向量矩阵, 是否命中的布尔数组)，未命中的行为0
+        """
+        digests = [text_digest(text) for text in texts]
+        with self._lock:
+            rows = np.array([self._rows.get(d, -1) for d in digests], dtype=np.int64)
+            found = rows >= 0
+            result = np.zeros((len(texts), self.dim or 0), dtype=np.float32)
+            if found.any():
+                result[found] = self._view()[rows[found]]
+        return result, found
+
+    def put_many(self, texts: List[str], vectors) -> None:
+        """写入新的向量；已缓存的文本和重复的文本只保存一次"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度{vectors.shape[1]}与缓存的维度{self.dim}不一致")
+            new_digests, new_rows = [], []
+            for text, vector in zip(texts, vectors):
+                digest = text_digest(text)
+                if digest in self._rows:
+                    continue
+                self._rows[digest] = len(self._rows)
+                new_digests.append(digest)
+                new_rows.append(vector)
+            if not new_rows:
+                return
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(new_rows, dtype=np.float32).tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new_digests))
+
+    def get_or_compute(self, texts: List[str], embed_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """返回texts的向量，只对缓存中没有的文本调用embed_fn
+
+        Args:
+            texts: 文本列表
+            embed_fn: 批量向量化函数，输入文本列表，返回按顺序排列的向量矩阵
+
+        Returns:
+            形状为(len(texts), 向量维度)的float32矩阵
+        """
+        result, found = self.get_many(texts)
+        missing = list(dict.fromkeys(text for text, hit in zip(texts, found) if not hit))
+        self.hits += int(found.sum())
+        self.misses += len(texts) - int(found.sum())
+        if not missing:
+            return result
+        computed = np.asarray(embed_fn(missing), dtype=np.float32)
+        self.put_many(missing, computed)
+        if result.shape[1] == 0:
+            result = np.zeros((len(texts), computed.shape[1]), dtype=np.float32)
+        positions = {text: i for i, text in enumerate(missing)}
+        for i, (text, hit) in enumerate(zip(texts, found)):
+            if not hit:
+                result[i] = computed[positions[text]]
+        return result
+
+    def gc(self, keep_texts: Iterable[str]) -> int:
+        """回收不再被引用的行：只保留keep_texts对应的向量，重写矩阵和摘要文件
+
+        Returns:
+            回收的行数
+        """
+        keep = {text_digest(text) for text in keep_texts}
+        with self._lock:
+            live = [(digest, row) for digest, row in self._rows.items() if digest in keep]
+            removed = len(self._rows) - len(live)
+            if removed == 0:
+                return 0
+            live.sort(key=lambda item: item[1])
+            matrix = self._view()
+            vectors = matrix[[row for _, row in live]] if live else np.zeros((0, self.dim), np.float32)
+            self._matrix = None
+            del matrix
+            old_paths = (self.vectors_path, self.keys_path)
+            # 写出新一代文件，meta.json切换到新一代之后再删除旧文件
+            self.generation += 1
+            with open(self.vectors_path, "wb") as f:
+                f.write(np.ascontiguousarray(vectors).tobytes())
+            with open(self.keys_path, "wb") as f:
+                f.write(b"".join(digest for digest, _ in live))
+            self._write_meta()
+            for path in old_paths:
+                os.remove(path)
+            self._rows = {digest: i for i, (digest, _) in enumerate(live)}
+        return removed
+
+    def stats(self):
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        return {"entries": len(self._rows), "dim": self.dim, "bytes": size,
+                "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,243 @@
+"""
+内存映射的向量矩阵存储
+
+向量保存在一个.npy文件中，通过np.memmap按需读取，进程只为实际访问到的页面占用内存，
+几百万条1536维向量也不需要整体载入。目录中的文件：
+1. vectors.{代}.npy：float32矩阵，预留容量，容量不足时原地扩大文件并改写头部
+2. ids.{代}.jsonl：每行一个id，第i行对应矩阵第i行，只追加
+3. tombstones.{代}.jsonl：被删除的行号，只追加；删除的比例超过阈值时自动压缩
+4. meta.json：向量维度和当前使用的文件代数，压缩时写出新一代文件后再切换
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+# .npy文件头固定为128字节，扩容时可以原地改写而不需要移动数据
+HEADER_SIZE = 128
+INITIAL_CAPACITY = 1024
+
+def write_npy_header(f, rows, dim):
+    header = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, dim)})
+    magic = b"\x93NUMPY\x01\x00"
+    padding = HEADER_SIZE - len(magic) - 2 - len(header) - 1
+    f.seek(0)
+    f.write(magic + (HEADER_SIZE - len(magic) - 2).to_bytes(2, "little")
+            + header.encode("latin1") + b" " * padding + b"\n")
+
+def _read_lines(path):
+    """读取只追加文件的所有完整行，截掉进程中途退出留下的不完整末行"""
+    with open(path, "rb") as f:
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    if end != len(data):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+    return data[:end].decode("utf-8").splitlines()
+
+class EmbeddingMatrix:
+    """按id存取向量的矩阵，支持追加、删除（墓碑）、压缩和零拷贝视图"""
+
+    def __init__(self, directory: str, dim: int = None, normalize: bool = True,
+                 compact_ratio: float = 0.3):
+        """
+        Args:
+            directory: 存储目录
+            dim: 向量维度，新建时必须提供
+            normalize: 写入时是否归一化为单位向量，归一化后内积即为余弦相似度
+            compact_ratio: 被删除的行超过该比例时自动压缩
+        """
+        self.directory = directory
+        self.normalize = normalize
+        self.compact_ratio = compact_ratio
+        self.meta_path = os.path.join(directory, "meta.json")
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim, self.generation = meta["dim"], meta["generation"]
+        else:
+            if dim is None:
+                raise ValueError("新建EmbeddingMatrix时必须指定dim")
+            self.dim, self.generation = dim, 0
+            self._create_files(INITIAL_CAPACITY)
+            self._write_meta()
+        self._open()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name.format(self.generation))
+
+    @property
+    def vectors_path(self):
+        return self._path("vectors.{}.npy")
+
+    @property
+    def ids_path(self):
+        return self._path("ids.{}.jsonl")
+
+    @property
+    def tombstones_path(self):
+        return self._path("tombstones.{}.jsonl")
+
+    def _write_meta(self):
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "generation": self.generation}, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def _create_files(self, capacity):
+        with open(self.vectors_path, "wb") as f:
+            write_npy_header(f, capacity, self.dim)
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+        open(self.ids_path, "w").close()
+        open(self.tombstones_path, "w").close()
+
+    def _open(self):
+        self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.ids: List = [json.loads(line) for line in _read_lines(self.ids_path)]
+        # 存活标记与文件容量等长，追加时不需要重新分配
+        self._alive = np.ones(self.capacity, dtype=bool)
+        for line in _read_lines(self.tombstones_path):
+            self._alive[int(line)] = False
+        self._rows: Dict = {id_: row for row, id_ in enumerate(self.ids) if self._alive[row]}
+
+    @property
+    def capacity(self):
+        return self._vectors.shape[0]
+
+    def __len__(self):
+        """有效（未删除）的向量数"""
+        return len(self._rows)
+
+    def __contains__(self, id_):
+        return id_ in self._rows
+
+    def _grow(self, needed):
+        """容量不足时扩大文件（至少翻倍），只改写文件头，已有数据不移动"""
+        capacity = max(needed, self.capacity * 2)
+        self._vectors.flush()
+        del self._vectors
+        with open(self.vectors_path, "r+b") as f:
+            write_npy_header(f, capacity, self.dim)
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+        self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self._alive = np.concatenate([self._alive, np.ones(capacity - len(self._alive), dtype=bool)])
+
+    def _prepare(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+        return vectors
+
+    def add(self, ids: Iterable, vectors) -> None:
+        """写入向量；已存在的id原地覆盖，新的id追加到末尾"""
+        ids = list(ids)
+        vectors = self._prepare(vectors)
+        if len(ids) != len(vectors):
+            raise ValueError("ids和vectors的数量不一致")
+        new_ids, new_rows = [], []
+        for id_, vector in zip(ids, vectors):
+            row = self._rows.get(id_)
+            if row is not None:
+                self._vectors[row] = vector
+            else:
+                new_ids.append(id_)
+                new_rows.append(vector)
+        if new_ids:
+            start = len(self.ids)
+            if start + len(new_ids) > self.capacity:
+                self._grow(start + len(new_ids))
+            self._vectors[start:start + len(new_ids)] = new_rows
+            # 先写向量再登记id，进程中途退出时未登记的行会被之后的追加覆盖
+            self._vectors.flush()
+            with open(self.ids_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(id_, ensure_ascii=False) + "\n" for id_ in new_ids))
+            self.ids.extend(new_ids)
+            for row, id_ in enumerate(new_ids, start):
+                self._rows[id_] = row
+        else:
+            self._vectors.flush()
+
+    def delete(self, ids: Iterable) -> int:
+        """删除向量：记录墓碑并把该行清零，删除比例过高时自动压缩
+
+        Returns:
+            实际删除的数量
+        """
+        rows = [self._rows.pop(id_) for id_ in ids if id_ in self._rows]
+        if not rows:
+            return 0
+        self._alive[rows] = False
+        # 清零后即使调用方忘记过滤，被删除的行的相似度也只有0
+        self._vectors[rows] = 0.0
+        self._vectors.flush()
+        with open(self.tombstones_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{row}\n" for row in rows))
+        if self.deleted_count > self.compact_ratio * len(self.ids):
+            self.compact()
+        return len(rows)
+
+    @property
+    def deleted_count(self):
+        return len(self.ids) - len(self._rows)
+
+    def get(self, ids: Iterable) -> np.ndarray:
+        """按id读取向量，不存在的id抛出KeyError"""
+        return self._vectors[[self._rows[id_] for id_ in ids]]
+
+    def row_of(self, id_):
+        return self._rows[id_]
+
+    def view(self) -> np.ndarray:
+        """所有已使用行的零拷贝视图（包含已删除的行，它们全为0），可直接传给top_k等函数"""
+        return self._vectors[:len(self.ids)]
+
+    @property
+    def alive(self) -> np.ndarray:
+        """与view()逐行对应的布尔数组，False表示该行已删除"""
+        return self._alive[:len(self.ids)]
+
+    def ids_for(self, rows) -> List:
+        """把view()中的行号转换为id，已删除的行返回None"""
+        return [self.ids[row] if self._alive[row] else None for row in rows]
+
+    def compact(self, chunk_rows: int = 65536) -> int:
+        """压缩：把有效行按块复制到新一代文件，清空墓碑
+
+        Returns:
+            回收的行数
+        """
+        removed = self.deleted_count
+        if removed == 0:
+            return 0
+        live_rows = np.flatnonzero(self.alive)
+        old = self._vectors
+        old_paths = (self.vectors_path, self.ids_path, self.tombstones_path)
+        self.generation += 1
+        self._create_files(max(INITIAL_CAPACITY, len(live_rows)))
+        new = np.load(self.vectors_path, mmap_mode="r+")
+        for start in range(0, len(live_rows), chunk_rows):
+            rows = live_rows[start:start + chunk_rows]
+            new[start:start + len(rows)] = old[rows]
+        new.flush()
+        del new, old
+        with open(self.ids_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(self.ids[row], ensure_ascii=False) + "\n" for row in live_rows))
+        self._write_meta()
+        self._vectors = None
+        for path in old_paths:
+            os.remove(path)
+        self._open()
+        return removed
+
+    def stats(self):
+        return {
+            "rows": len(self._rows),
+            "deleted": self.deleted_count,
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "bytes": os.path.getsize(self.vectors_path),
+        }
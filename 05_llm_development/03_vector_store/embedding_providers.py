@@ -0,0 +1,152 @@
+"""
+可插拔的向量化后端
+
+EmbeddingProvider约定了统一的接口：embed(texts)返回按输入顺序排列的float32矩阵，
+model属性作为缓存键（EmbeddingCache按它分目录）。目前提供的本地后端：
+1. HashingEmbedding：字符n-gram哈希向量，完全在本地用NumPy计算，结果确定、不需要网络，
+   适合去重、预过滤和离线测试；语义效果不如模型向量，但字面相近的文本相似度高
+
+create_provider按名称创建后端，"openai"返回None表示使用OpenAI接口，
+01_text_embedding.py通过环境变量EMBEDDING_PROVIDER和EMBEDDING_OPTIONS（JSON）选择。
+"""
+
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+class EmbeddingProvider(ABC):
+    """向量化后端的基类"""
+
+    @property
+    @abstractmethod
+    def model(self) -> str:
+        """模型名，作为缓存键"""
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """返回形状为(len(texts), 向量维度)的float32矩阵"""
+
+# 64位哈希用到的常数（FNV-1a的乘数和splitmix64的混合常数），numpy的uint64乘法按2^64取模
+_FNV_PRIME = np.uint64(0x100000001B3)
+_MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+def hash_ngrams(codes, n, seed):
+    """对码点数组中每个位置开始的n-gram计算64位哈希"""
+    count = len(codes) - n + 1
+    hashes = np.full(count, seed, dtype=np.uint64)
+    for j in range(n):
+        hashes = (hashes ^ codes[j:j + count]) * _FNV_PRIME
+    hashes ^= hashes >> np.uint64(31)
+    hashes *= _MIX
+    hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+def ngram_hashes(texts: List[str], n: int, seed: int = 0):
+    """所有文本拼接成一个码点数组，一次性计算全部字符n-gram的64位哈希
+
+    Returns:
+        (哈希, 所属文本的下标)，按文本顺序排列，不包含跨越文本边界的n-gram
+    """
+    # 文本之间用0分隔，doc记录每个位置属于哪条文本，分隔符为-1
+    encoded = "\0".join(texts).encode("utf-32-le")
+    codes = np.frombuffer(encoded, dtype=np.uint32).astype(np.uint64)
+    if len(codes) < n:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    doc = np.repeat(np.arange(len(texts)), lengths + 1)[:len(codes)]
+    doc[np.cumsum(lengths + 1)[:-1] - 1] = -1
+    hashes = hash_ngrams(codes, n, np.uint64(seed))
+    start_doc, end_doc = doc[:len(hashes)], doc[n - 1:]
+    # 跨越文本边界的n-gram首尾属于不同文本（或落在分隔符上），丢弃
+    valid = (start_doc >= 0) & (start_doc == end_doc)
+    return hashes[valid], start_doc[valid]
+
+def _hashing_embed(texts: List[str], dim: int, ngram_range: Tuple[int, int], seed: int) -> np.ndarray:
+    """一批文本的哈希向量：每个n-gram哈希到一个维度，并由哈希的最高位决定加1还是减1，以抵消冲突带来的偏差"""
+    texts = [text.lower() for text in texts]
+    counts = np.zeros(len(texts) * dim, dtype=np.float64)
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        hashes, rows = ngram_hashes(texts, n, seed * 1000003 + n)
+        buckets = (hashes % np.uint64(dim)).astype(np.int64)
+        signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+        counts += np.bincount(rows * dim + buckets, weights=signs, minlength=len(counts))
+    vectors = counts.reshape(len(texts), dim).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class HashingEmbedding(EmbeddingProvider):
+    """字符n-gram哈希向量化，中文按字、英文按字母切分n-gram，无需分词和训练"""
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (1, 3), seed: int = 0,
+                 processes: int = None, chunk_size: int = 20000):
+        """
+        Args:
+            dim: 向量维度，越大哈希冲突越少
+            ngram_range: 使用的n-gram长度范围（包含两端）
+            seed: 哈希种子，种子不同的向量之间不可比较
+            processes: 并行的进程数，默认为CPU核数
+            chunk_size: 每个进程一次处理的文本数，文本数不超过它时不启动子进程
+        """
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+        self.seed = seed
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    @property
+    def model(self) -> str:
+        low, high = self.ngram_range
+        return f"hashing-{self.dim}-{low}-{high}-{self.seed}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self.processes <= 1 or len(texts) <= self.chunk_size:
+            return _hashing_embed(texts, self.dim, self.ngram_range, self.seed)
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        with ProcessPoolExecutor(max_workers=min(self.processes, len(chunks))) as executor:
+            results = executor.map(_hashing_embed, chunks, [self.dim] * len(chunks),
+                                   [self.ngram_range] * len(chunks), [self.seed] * len(chunks))
+            return np.concatenate(list(results))
+
+PROVIDERS = {"hashing": HashingEmbedding}
+
+def create_provider(name: str = "openai", **options) -> EmbeddingProvider:
+    """按名称创建向量化后端；name为"openai"时返回None，表示使用OpenAI接口"""
+    if name == "openai":
+        return None
+    if name not in PROVIDERS:
+        raise ValueError(f"不支持的向量化后端: {name}，可选: {['openai', *PROVIDERS]}")
+    return PROVIDERS[name](**options)
+
+def provider_from_env() -> EmbeddingProvider:
+    """根据环境变量EMBEDDING_PROVIDER和EMBEDDING_OPTIONS创建后端，
+    例如EMBEDDING_PROVIDER=hashing、EMBEDDING_OPTIONS={"dim": 512}"""
+    options = json.loads(os.getenv("EMBEDDING_OPTIONS") or "{}")
+    return create_provider(os.getenv("EMBEDDING_PROVIDER", "openai"), **options)
+
+def main():
+    provider = HashingEmbedding(dim=1024)
+    texts = ["机器学习是人工智能的一个子领域", "机器学习是人工智能的子领域", "今天天气很好", "Machine learning is a subfield of AI"]
+    vectors = provider.embed(texts)
+    print(f"后端: {provider.model}，向量形状: {vectors.shape}")
+    for text, score in zip(texts[1:], vectors[1:] @ vectors[0]):
+        print(f"{score:.4f}  {texts[0]} / {text}")
+
+    # 吞吐量：单进程和多进程
+    corpus = [f"{text}（第{i}段）" for i in range(50000) for text in texts]
+    for processes in sorted({1, provider.processes}):
+        provider.processes = processes
+        start = time.perf_counter()
+        provider.embed(corpus)
+        elapsed = time.perf_counter() - start
+        print(f"{processes}个进程: {len(corpus)}条文本耗时{elapsed:.2f}s，{len(corpus) / elapsed:.0f}条/秒")
+
+if __name__ == "__main__":
+    main()
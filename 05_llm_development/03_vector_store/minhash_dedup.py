@@ -0,0 +1,225 @@
+"""
+基于MinHash和LSH的近似重复文本过滤
+
+语料中的模板文字、转载页面等几乎相同的文本块，在向量化和入库之前就应该去掉：
+1. 文本规范化（小写、合并空白）后切成长度为shingle_size的字符片段（shingle）
+2. MinHash：用num_perm个哈希函数分别取所有片段哈希的最小值作为签名，
+   两个签名逐位相等的比例就是两段文本Jaccard相似度的无偏估计
+3. LSH：签名切成bands段，每段rows位，任意一段完全相同的文本才成为候选，
+   候选再用签名估计的相似度与threshold比较，不需要两两比较全部文本
+4. 签名追加写入目录中的文件，之后的导入会与之前所有导入的文本比较；
+   LSH的分桶在打开时由签名重建
+"""
+
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from embedding_cache import text_digest
+from embedding_providers import ngram_hashes
+
+# 乘移位哈希：(a*x + b) mod 2^64 取高32位，a为奇数
+_SHIFT = np.uint64(32)
+
+def _choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """选择(bands, rows)，使候选概率曲线的拐点(1/bands)^(1/rows)不超过threshold且尽量接近它"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        knee = (1 / bands) ** (1 / rows)
+        # 拐点略低于阈值时漏检更少，多出来的候选由签名相似度过滤
+        if knee <= threshold and (best is None or knee > best[0]):
+            best = (knee, bands, rows)
+    return (best[1], best[2]) if best else (num_perm, 1)
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+class MinHashDeduplicator:
+    """近似重复过滤器：Jaccard相似度（按签名估计）不低于threshold的文本视为重复"""
+
+    def __init__(self, directory: str = None, threshold: float = 0.8, num_perm: int = 128,
+                 shingle_size: int = 5, seed: int = 0):
+        """
+        Args:
+            directory: 签名的保存目录，为None时只保存在内存中
+            threshold: Jaccard相似度阈值
+            num_perm: 签名长度，越长估计越准、越占空间
+            shingle_size: 字符片段的长度，中文通常取3到5
+            seed: 哈希种子
+
+        目录中已有签名时，num_perm、shingle_size和seed以保存的为准，threshold可以每次不同
+        """
+        self.directory = directory
+        self.threshold = threshold
+        self.num_perm, self.shingle_size, self.seed = num_perm, shingle_size, seed
+        meta_path = os.path.join(directory, "meta.json") if directory else None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                self.num_perm, self.shingle_size, self.seed = meta["num_perm"], meta["shingle_size"], meta["seed"]
+            else:
+                with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump({"num_perm": num_perm, "shingle_size": shingle_size, "seed": seed}, f)
+                os.replace(meta_path + ".tmp", meta_path)
+        rng = np.random.default_rng(self.seed)
+        self._a = rng.integers(0, 2**63, self.num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2**63, self.num_perm, dtype=np.uint64)
+        self.bands, self.rows = _choose_bands(threshold, self.num_perm)
+        self.ids: List = []
+        # 签名矩阵按容量翻倍扩展，前len(ids)行有效
+        self._buffer = np.zeros((0, self.num_perm), dtype=np.uint32)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        if directory:
+            self._load()
+
+    @property
+    def signatures_path(self):
+        return os.path.join(self.directory, "signatures.u32")
+
+    @property
+    def ids_path(self):
+        return os.path.join(self.directory, "ids.jsonl")
+
+    @property
+    def _signatures(self):
+        return self._buffer[:len(self.ids)]
+
+    def _load(self):
+        signatures = np.zeros((0, self.num_perm), dtype=np.uint32)
+        if os.path.exists(self.signatures_path):
+            signatures = np.fromfile(self.signatures_path, dtype=np.uint32)
+        ids = []
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, "r", encoding="utf-8") as f:
+                ids = [json.loads(line) for line in f if line.endswith("\n")]
+        # 先写签名再写id，进程中途退出时以两者中较短的为准
+        rows = min(len(signatures) // self.num_perm, len(ids))
+        self._buffer = signatures[:rows * self.num_perm].reshape(rows, self.num_perm)
+        self.ids = ids[:rows]
+        with open(self.signatures_path, "ab") as f:
+            f.truncate(rows * self.num_perm * 4)
+        with open(self.ids_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(id_, ensure_ascii=False) + "\n" for id_ in self.ids))
+        os.replace(self.ids_path + ".tmp", self.ids_path)
+        for row in range(rows):
+            self._index(row)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def signatures(self, texts: List[str], chunk: int = 65536) -> np.ndarray:
+        """计算MinHash签名，形状为(len(texts), num_perm)的uint32矩阵"""
+        # 不足一个片段长度的文本补齐，使每段文本至少有一个片段
+        texts = [normalize_text(text).ljust(self.shingle_size, "\x01") for text in texts]
+        hashes, docs = ngram_hashes(texts, self.shingle_size, self.seed)
+        signatures = np.full((self.num_perm, len(texts)), np.iinfo(np.uint32).max, dtype=np.uint32)
+        # 按片段分块计算，内存占用为num_perm*chunk
+        for start in range(0, len(hashes), chunk):
+            block, block_docs = hashes[start:start + chunk], docs[start:start + chunk]
+            values = ((self._a[:, None] * block[None, :] + self._b[:, None]) >> _SHIFT).astype(np.uint32)
+            starts = np.flatnonzero(np.diff(block_docs, prepend=-1))
+            owners = block_docs[starts]
+            minima = np.minimum.reduceat(values, starts, axis=1)
+            signatures[:, owners] = np.minimum(signatures[:, owners], minima)
+        return signatures.T.copy()
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _index(self, row):
+        for bucket, key in zip(self._buckets, self._band_keys(self._signatures[row])):
+            bucket.setdefault(key, []).append(row)
+
+    def _match(self, signature):
+        """返回与签名最相似且不低于阈值的已有行号及相似度，没有时返回(None, 0.0)"""
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        if not candidates:
+            return None, 0.0
+        rows = np.fromiter(candidates, dtype=np.int64)
+        similarity = (self._signatures[rows] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] >= self.threshold:
+            return int(rows[best]), float(similarity[best])
+        return None, 0.0
+
+    def query(self, text: str):
+        """返回与text近似重复的已有文本的(id, 估计的相似度)，没有时返回None"""
+        row, similarity = self._match(self.signatures([text])[0])
+        return None if row is None else (self.ids[row], similarity)
+
+    def filter(self, texts: List[str], ids: Iterable = None, add: bool = True):
+        """过滤近似重复的文本：与已有文本或本批中更靠前的文本重复的被去掉
+
+        Args:
+            texts: 文本列表
+            ids: 与texts对应的id，默认为文本的sha256
+            add: 是否把保留下来的文本加入索引（并写入目录）；下游的向量化或入库可能失败时应传False，
+                成功后再用add()加入，否则失败的文本在重试时会被当成重复而跳过
+
+        Returns:
+            (保留的文本下标列表, {被去掉的下标: 与之重复的已有id})
+        """
+        ids = [text_digest(text).hex() for text in texts] if ids is None else list(ids)
+        signatures = self.signatures(texts)
+        kept, duplicates = [], {}
+        start = len(self.ids)
+        for i, signature in enumerate(signatures):
+            row, _ = self._match(signature)
+            if row is not None:
+                duplicates[i] = self.ids[row]
+                continue
+            kept.append(i)
+            # 先放进内存中的索引，本批后面的文本也会和它比较
+            self._append(ids[i], signature)
+        if add:
+            self._persist(start)
+        else:
+            self._rollback(start)
+        return kept, duplicates
+
+    def add(self, texts: List[str], ids: Iterable = None):
+        """把文本加入索引（并写入目录），不做重复检查，通常用于filter(add=False)保留的文本入库成功之后"""
+        ids = [text_digest(text).hex() for text in texts] if ids is None else list(ids)
+        start = len(self.ids)
+        for id_, signature in zip(ids, self.signatures(texts)):
+            self._append(id_, signature)
+        self._persist(start)
+
+    def _append(self, id_, signature):
+        rows = len(self.ids)
+        if rows == len(self._buffer):
+            buffer = np.empty((max(2 * rows, 1024), self.num_perm), dtype=np.uint32)
+            buffer[:rows] = self._buffer
+            self._buffer = buffer
+        self._buffer[rows] = signature
+        self.ids.append(id_)
+        self._index(rows)
+
+    def _persist(self, start):
+        if not self.directory or start == len(self.ids):
+            return
+        with open(self.signatures_path, "ab") as f:
+            f.write(np.ascontiguousarray(self._signatures[start:]).tobytes())
+        with open(self.ids_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(id_, ensure_ascii=False) + "\n" for id_ in self.ids[start:]))
+
+    def _rollback(self, start):
+        for row in range(start, len(self.ids)):
+            for bucket, key in zip(self._buckets, self._band_keys(self._signatures[row])):
+                bucket[key].remove(row)
+                if not bucket[key]:
+                    del bucket[key]
+        del self.ids[start:]
+
+    def stats(self):
+        return {"entries": len(self.ids), "threshold": self.threshold,
+                "bands": self.bands, "rows": self.rows,
+                "bytes": len(self.ids) * self.num_perm * 4}